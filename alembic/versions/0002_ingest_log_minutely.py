@@ -0,0 +1,24 @@
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0002_ingest_log_minutely'
+down_revision = '0001_initial'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table('ingest_log_minutely',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('minute', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('source_ip', sa.String(64), nullable=False, server_default=''),
+        sa.Column('api_key_or_user_id', sa.String(128), nullable=False, server_default=''),
+        sa.Column('request_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('row_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.UniqueConstraint('minute', 'source_ip', 'api_key_or_user_id', name='uq_ingest_log_minute'),
+    )
+    op.create_index('ix_ingest_log_minutely_minute', 'ingest_log_minutely', ['minute'])
+
+def downgrade():
+    op.drop_index('ix_ingest_log_minutely_minute', table_name='ingest_log_minutely')
+    op.drop_table('ingest_log_minutely')
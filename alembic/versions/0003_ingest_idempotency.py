@@ -0,0 +1,27 @@
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0003_ingest_idempotency'
+down_revision = '0002_ingest_log_minutely'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table('ingest_idempotency',
+        sa.Column('key', sa.String(64), primary_key=True),
+        sa.Column('data_id', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), nullable=False),
+    )
+    op.create_index('ix_ingest_idempotency_created_at', 'ingest_idempotency', ['created_at'])
+    # carry over existing keys, then drop the unbounded unique index on sensor_data
+    op.execute(
+        "INSERT INTO ingest_idempotency (`key`, data_id, created_at) "
+        "SELECT ingest_idempotency_key, id, created_at FROM sensor_data WHERE ingest_idempotency_key IS NOT NULL"
+    )
+    op.drop_constraint('ingest_idempotency_key', 'sensor_data', type_='unique')
+
+def downgrade():
+    op.create_unique_constraint('ingest_idempotency_key', 'sensor_data', ['ingest_idempotency_key'])
+    op.drop_index('ix_ingest_idempotency_created_at', table_name='ingest_idempotency')
+    op.drop_table('ingest_idempotency')
@@ -0,0 +1,37 @@
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0004_sensor_rollups'
+down_revision = '0003_ingest_idempotency'
+branch_labels = None
+depends_on = None
+
+FIELDS = (
+    "ph", "tss", "debit", "nh3n", "cod", "temp", "rh", "wind_speed_kmh", "wind_deg", "noise",
+    "co", "so2", "no2", "o3", "pm25", "pm10", "tvoc", "voltage", "current",
+)
+TABLES = ("sensor_rollup_1m", "sensor_rollup_1h", "sensor_rollup_1d")
+
+def upgrade():
+    for name in TABLES:
+        cols = []
+        for f in FIELDS:
+            cols += [
+                sa.Column(f"{f}_sum", sa.Double(), nullable=False, server_default="0"),
+                sa.Column(f"{f}_cnt", sa.Integer(), nullable=False, server_default="0"),
+                sa.Column(f"{f}_min", sa.Float(), nullable=True),
+                sa.Column(f"{f}_max", sa.Float(), nullable=True),
+            ]
+        op.create_table(name,
+            sa.Column('site_id', sa.Integer(), nullable=False),
+            sa.Column('bucket', sa.DateTime(timezone=True), nullable=False),
+            sa.Column('device_id', sa.Integer(), nullable=False),
+            *cols,
+            sa.PrimaryKeyConstraint('site_id', 'bucket', 'device_id'),
+        )
+    # existing rows are not rolled up here; run scripts/rebuild_rollups.py after upgrading
+
+def downgrade():
+    for name in reversed(TABLES):
+        op.drop_table(name)
@@ -0,0 +1,29 @@
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0005_latest_state'
+down_revision = '0004_sensor_rollups'
+branch_labels = None
+depends_on = None
+
+FIELDS = (
+    "ph", "tss", "debit", "nh3n", "cod", "temp", "rh", "wind_speed_kmh", "wind_deg", "noise",
+    "co", "so2", "no2", "o3", "pm25", "pm10", "tvoc", "voltage", "current",
+)
+
+def upgrade():
+    # column order matters for the MySQL upsert: data_id and ts last
+    op.create_table('latest_state',
+        sa.Column('site_id', sa.Integer(), nullable=False),
+        sa.Column('device_id', sa.Integer(), nullable=False),
+        *[sa.Column(f, sa.Float(), nullable=True) for f in FIELDS],
+        sa.Column('updated_at', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('data_id', sa.Integer(), nullable=False),
+        sa.Column('ts', sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint('site_id', 'device_id'),
+    )
+    # filled by scripts/rebuild_latest_state.py
+
+def downgrade():
+    op.drop_table('latest_state')
@@ -0,0 +1,37 @@
+from datetime import datetime, timezone
+from alembic import op
+import sqlalchemy as sa
+from app.core.config import settings
+from app.utils.partitions import initial_partitioning_sql
+
+# revision identifiers, used by Alembic.
+revision = '0006_sensor_data_partitions'
+down_revision = '0005_latest_state'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.add_column('sites', sa.Column('retention_class', sa.String(16), nullable=False, server_default='standard'))
+    op.add_column('sensor_data', sa.Column('retention_class', sa.String(16), nullable=False, server_default='standard'))
+    bind = op.get_bind()
+    if bind.dialect.name != 'mysql':
+        return
+    # partitioned InnoDB tables allow no foreign keys, and every unique key must
+    # contain the partitioning columns
+    for fk in sa.inspect(bind).get_foreign_keys('sensor_data'):
+        op.drop_constraint(fk['name'], 'sensor_data', type_='foreignkey')
+    op.execute("ALTER TABLE sensor_data DROP PRIMARY KEY, ADD PRIMARY KEY (id, retention_class, ts)")
+    now = datetime.now(timezone.utc)
+    first = bind.execute(sa.text("SELECT MIN(ts) FROM sensor_data")).scalar() or now
+    # copies the table once; later months are added by services/partitions.py
+    op.execute(initial_partitioning_sql(settings.retention_classes, first, now, settings.partition_months_ahead))
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'mysql':
+        op.execute("ALTER TABLE sensor_data REMOVE PARTITIONING")
+        op.execute("ALTER TABLE sensor_data DROP PRIMARY KEY, ADD PRIMARY KEY (id)")
+        op.create_foreign_key(None, 'sensor_data', 'sites', ['site_id'], ['id'])
+        op.create_foreign_key(None, 'sensor_data', 'sensor_devices', ['device_id'], ['id'])
+    op.drop_column('sensor_data', 'retention_class')
+    op.drop_column('sites', 'retention_class')
@@ -0,0 +1,28 @@
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0007_archive_segments'
+down_revision = '0006_sensor_data_partitions'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table('archive_segments',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('site_id', sa.Integer(), nullable=False),
+        sa.Column('month', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('ts_min', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('ts_max', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('id_max', sa.Integer(), nullable=False),
+        sa.Column('rows', sa.Integer(), nullable=False),
+        sa.Column('path', sa.String(length=255), nullable=False),
+        sa.Column('state', sa.String(length=16), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_archive_segments_site_ts', 'archive_segments', ['site_id', 'ts_min', 'ts_max'])
+
+def downgrade():
+    op.drop_index('ix_archive_segments_site_ts', table_name='archive_segments')
+    op.drop_table('archive_segments')
@@ -1,5 +1,5 @@
 # AFTER
-from fastapi import Depends, HTTPException, status, Security
+from fastapi import Depends, HTTPException, Request, status, Security
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
@@ -8,6 +8,7 @@ from typing import Optional, List
 from app.core.db import get_db
 from app.core.security import decode_jwt
 from app.models.models import User, ViewerSite, Site, AuthTokenBlacklist
+from app.services.auth_cache import auth_cache
 
 bearer_scheme = HTTPBearer(auto_error=False)
 
@@ -19,22 +20,26 @@ async def get_current_token(
     return creds.credentials  # JWT string
 
 async def get_current_user(
+    request: Request,
     token: str = Depends(get_current_token),   # 👈 pakai bearer, bukan OAuth2
     db: AsyncSession = Depends(get_db),
 ) -> User:
     payload = decode_jwt(token)
     jti = payload.get("jti")
-    # blacklist check
-    res = await db.execute(select(AuthTokenBlacklist).where(AuthTokenBlacklist.jti == jti))
-    if res.scalar_one_or_none():
+    # blacklist check (in memory once the revocation set is loaded)
+    revoked = auth_cache.is_revoked(jti)
+    if revoked is None:
+        res = await db.execute(select(AuthTokenBlacklist.id).where(AuthTokenBlacklist.jti == jti))
+        revoked = res.first() is not None
+    if revoked:
         raise HTTPException(status_code=401, detail="Token revoked")
 
     uid = payload.get("user_id")
-    res = await db.execute(select(User).where(User.id == uid, User.is_active == True))
-    user = res.scalar_one_or_none()
+    user = await auth_cache.get_user(db, uid)
     if not user:
         raise HTTPException(status_code=401, detail="User not found")
 
+    request.state.user_id = user.id  # for log records
     user._site_uids = payload.get("site_uids", [])
     user._role = payload.get("role", "viewer")
     return user
@@ -4,6 +4,13 @@ from sqlalchemy import select
 from app.core.db import get_db
 from app.api.deps import require_roles
 from app.models.models import User, Site, ViewerSite
+from app.services.ingest_buffer import ingest_buffer
+from app.services.site_cache import site_registry
+from app.services.auth_cache import auth_cache
+from app.services.audit import audit
+from app.services.idempotency import idempotency
+from app.services.latest_state import latest_readings
+from app.services.response_cache import response_cache
 
 router = APIRouter()
 
@@ -47,6 +54,15 @@ async def list_viewer_sites(db: AsyncSession = Depends(get_db)):
     viewer_sites = result.scalars().all()
     return {"viewer_sites": [{"user_id": vs.user_id, "site_id": vs.site_id} for vs in viewer_sites]}
 
+@router.get("/ingest-buffer", dependencies=[Depends(require_roles("admin"))])
+async def ingest_buffer_stats():
+    return {**ingest_buffer.stats(), "audit": audit.stats()}
+
+@router.get("/caches", dependencies=[Depends(require_roles("admin"))])
+async def cache_stats():
+    return {"site": site_registry.stats(), "auth": auth_cache.stats(), "idempotency": idempotency.stats(),
+            "latest_state": latest_readings.stats(), "responses": response_cache.stats()}
+
 @router.get("/viewers", dependencies=[Depends(require_roles("admin"))])
 async def list_viewers(db: AsyncSession = Depends(get_db)):
     result = await db.execute(select(User).where(User.role=="viewer"))
@@ -6,6 +6,7 @@ from app.core.security import hash_password, verify_password, create_jwt
 from app.models.models import User, ViewerSite, Site, AuthTokenBlacklist
 from app.schemas.auth import LoginIn, TokenOut, UserOut
 from app.api.deps import get_current_user, require_roles
+from app.services.auth_cache import auth_cache
 
 router = APIRouter()
 
@@ -72,4 +73,5 @@ async def logout(token: str, db: AsyncSession = Depends(get_db)):
     expires_at = datetime.fromtimestamp(exp, tz=timezone.utc)
     db.add(AuthTokenBlacklist(jti=jti, user_id=user_id, expires_at=expires_at, reason="logout"))
     await db.commit()
+    auth_cache.revoke(jti, exp)
     return {"ok": True}
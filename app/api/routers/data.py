@@ -1,19 +1,52 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func, and_
-from datetime import datetime
+from sqlalchemy import select, func, and_, or_
+from datetime import datetime, timedelta, timezone
 from typing import List
-from app.core.db import get_db
+import csv, io, orjson
+from app.core.config import settings
+from app.core.db import get_read_db, reads_pinned, SessionLocal, ReadSessionLocal
 from app.api.deps import get_current_user, get_viewer_site_uids
-from app.models.models import Site, SensorData, SensorDevice
+from app.models.models import Site, SensorData, SensorDevice, User, SENSOR_FIELDS
 from app.schemas.common import Page
-from app.schemas.data import DataOut
+from app.services import archive, rollups
+from app.services.latest_state import latest_readings
+from app.services.response_cache import response_cache
+from app.services.site_cache import site_registry
+from app.utils.cursor import encode_cursor, decode_cursor
+from app.utils.buckets import BUCKETS, bucket_expr, tz_offset_s
+from app.utils.time import to_utc
 
 router = APIRouter()
 
+KEY_COLUMNS = ("id", "site_id", "device_id", "ts")
+
+def _projection(fields: str | None) -> list:
+    """Key columns plus the requested measurements (all of them when ``fields`` names none)."""
+    names = SENSOR_FIELDS
+    wanted = {f.strip() for f in (fields or "").split(",") if f.strip()}
+    if wanted:
+        names = [f for f in SENSOR_FIELDS if f in wanted]
+    return [getattr(SensorData, c) for c in (*KEY_COLUMNS, *names)]
+
+def _range_filters(device_id: int | None, date_from: datetime | None, date_to: datetime | None) -> list:
+    conds = []
+    if device_id:
+        conds.append(SensorData.device_id==device_id)
+    if date_from or date_to:
+        # partitions are keyed (retention_class, ts): MySQL prunes a ts range only
+        # when the leading column is bound too
+        conds.append(SensorData.retention_class.in_(list(settings.retention_classes)))
+    if date_from:
+        conds.append(SensorData.ts >= date_from)
+    if date_to:
+        conds.append(SensorData.ts < date_to)
+    return conds
+
 @router.get("", response_model=Page)
 async def list_data(
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
     viewer_uids: List[str] = Depends(get_viewer_site_uids),
     site_uid: str | None = None,
     device_id: int | None = None,
@@ -23,67 +56,270 @@ async def list_data(
     page: int = 1,
     per_page: int = 50,
     fields: str | None = None,
+    cursor: str | None = None,
+    count: str | None = None,
 ):
+    """Offset pages (``page``) or keyset pages (``cursor``, taken from next_cursor/prev_cursor).
+
+    ``count=exact|none`` controls the COUNT(*); it defaults to exact for offset pages
+    and to none for cursor pages, where ``total`` is then null.
+    """
     if per_page < 1 or per_page > 500:
         raise HTTPException(400, "per_page out of range")
-    stmt = select(SensorData)
+    order = "desc" if order.lower() == "desc" else "asc"
+    cur = None
+    if cursor:
+        try:
+            cur = decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(400, "Invalid cursor")
+        if cur.order != order:
+            raise HTTPException(400, "cursor was issued for a different order")
+    count = count or ("none" if cur else "exact")
+    if count not in ("exact", "none"):
+        raise HTTPException(400, "count must be exact or none")
+    empty = {"total": 0, "page": page, "per_page": per_page, "items": []}
+
+    # plain column tuples: no ORM entities, no payload JSON
+    stmt = select(*_projection(fields))
     cnt = select(func.count(SensorData.id))
     site_id = None
     if site_uid:
-        res = await db.execute(select(Site).where(Site.uid==site_uid))
-        site = res.scalar_one_or_none()
+        site = await site_registry.resolve(db, site_uid)
         if not site:
-            return {"total": 0, "page": page, "per_page": per_page, "items": []}
+            return empty
         site_id = site.id
         if viewer_uids and site_uid not in viewer_uids:
-            return {"total": 0, "page": page, "per_page": per_page, "items": []}
+            return empty
         stmt = stmt.where(SensorData.site_id==site.id)
         cnt = cnt.where(SensorData.site_id==site.id)
-    if device_id:
-        stmt = stmt.where(SensorData.device_id==device_id)
-        cnt = cnt.where(SensorData.device_id==device_id)
-    if date_from:
-        stmt = stmt.where(SensorData.ts >= date_from)
-        cnt = cnt.where(SensorData.ts >= date_from)
-    if date_to:
-        stmt = stmt.where(SensorData.ts < date_to)
-        cnt = cnt.where(SensorData.ts < date_to)
+    conds = _range_filters(device_id, date_from, date_to)
+    # archived months are merged in from their segment files
+    segs = await archive.segments(db, None if site_id is None else [site_id], date_from, date_to)
+    if segs and not cur and page * per_page > settings.archive_max_offset_rows:
+        # offset pages read every earlier row of both tiers
+        raise HTTPException(400, f"page too deep with archived data (max {settings.archive_max_offset_rows} rows); use cursor=")
+    conds += archive.hot_filters(segs)
+    if conds:
+        stmt = stmt.where(*conds)
+        cnt = cnt.where(*conds)
 
-    total = (await db.execute(cnt)).scalar_one()
-    order_by = SensorData.ts.desc() if order.lower()=="desc" else SensorData.ts.asc()
-    rows = (await db.execute(stmt.order_by(order_by).offset((page-1)*per_page).limit(per_page))).scalars().all()
+    total = (await db.execute(cnt)).scalar_one() if count == "exact" else None
+    if total is not None and segs:
+        total += await archive.count(segs, date_from, date_to, device_id)
 
-    selected = None
-    if fields:
-        selected = set([f.strip() for f in fields.split(",") if f.strip()])
+    # walk (ts, id) descending when the requested order is desc, unless paging backwards
+    backward = bool(cur and cur.backward)
+    desc = (order == "desc") != backward
+    if desc:
+        order_by = (SensorData.ts.desc(), SensorData.id.desc())
+    else:
+        order_by = (SensorData.ts.asc(), SensorData.id.asc())
+    if cur:
+        if desc:
+            seek = or_(SensorData.ts < cur.ts, and_(SensorData.ts == cur.ts, SensorData.id < cur.id))
+        else:
+            seek = or_(SensorData.ts > cur.ts, and_(SensorData.ts == cur.ts, SensorData.id > cur.id))
+        stmt = stmt.where(seek).order_by(*order_by).limit(per_page + 1)
+    else:
+        stmt = stmt.order_by(*order_by).offset((page-1)*per_page).limit(per_page + 1)
+    if segs:
+        # the first offset + per_page + 1 rows of each tier, merged
+        skip = 0 if cur else (page-1)*per_page
+        stmt = stmt.offset(None).limit(skip + per_page + 1)
+        cold = await archive.read_page(segs, [c.key for c in stmt.selected_columns], skip + per_page + 1,
+                                       date_from=date_from, date_to=date_to, device_id=device_id, desc=desc,
+                                       after=(cur.ts, cur.id) if cur else None)
+        rows = archive.merge_page((await db.execute(stmt)).mappings().all(), cold, desc)[skip:skip + per_page + 1]
+    else:
+        rows = (await db.execute(stmt)).mappings().all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backward:
+        rows = rows[::-1]
 
-    items = []
-    for r in rows:
-        d = DataOut(
-            id=r.id, site_id=r.site_id, device_id=r.device_id, ts=r.ts,
-            ph=r.ph, tss=r.tss, debit=r.debit, nh3n=r.nh3n, cod=r.cod, temp=r.temp, rh=r.rh,
-            wind_speed_kmh=r.wind_speed_kmh, wind_deg=r.wind_deg, noise=r.noise,
-            co=r.co, so2=r.so2, no2=r.no2, o3=r.o3, pm25=r.pm25, pm10=r.pm10, tvoc=r.tvoc,
-            voltage=r.voltage, current=r.current
-        ).model_dump()
-        if selected:
-            d = {k:v for k,v in d.items() if k in selected or k in ("id","ts","site_id","device_id")}
-        items.append(d)
-
-    return {"total": total, "page": page, "per_page": per_page, "items": items}
+    next_cursor = prev_cursor = None
+    if rows:
+        if has_more or backward:
+            next_cursor = encode_cursor(rows[-1]["ts"], rows[-1]["id"], False, order)
+        if (backward and has_more) or (not backward and (cur or page > 1)):
+            prev_cursor = encode_cursor(rows[0]["ts"], rows[0]["id"], True, order)
+
+    items = [dict(r) for r in rows]
+    return {"total": total, "page": page, "per_page": per_page, "items": items,
+            "next_cursor": next_cursor, "prev_cursor": prev_cursor}
 
 @router.get("/last")
-async def last_record(site_uid: str, db: AsyncSession = Depends(get_db), viewer_uids: List[str] = Depends(get_viewer_site_uids)):
-    res = await db.execute(select(Site).where(Site.uid==site_uid))
-    site = res.scalar_one_or_none()
+async def last_record(request: Request, site_uid: str, device_id: int | None = None, db: AsyncSession = Depends(get_read_db), viewer_uids: List[str] = Depends(get_viewer_site_uids)):
+    """Newest reading of the site (or of one device) with every parameter, from latest_state."""
+    site = await site_registry.resolve(db, site_uid)
     if not site:
         raise HTTPException(404, "Site not found")
     if viewer_uids and site_uid not in viewer_uids:
         raise HTTPException(403, "Forbidden")
-    row = (await db.execute(select(SensorData).where(SensorData.site_id==site.id).order_by(SensorData.ts.desc()).limit(1))).scalar_one_or_none()
-    if not row:
-        return {}
-    return {
-        "id": row.id, "ts": row.ts, "site_id": row.site_id, "device_id": row.device_id,
-        "ph": row.ph, "tss": row.tss, "debit": row.debit, "temp": row.temp, "rh": row.rh
-    }
+
+    async def build():
+        return await latest_readings.newest(db, site.id, device_id) or {}
+    return await response_cache.serve(request, "data_last", [f"site:{site.id}"], viewer_uids, build)
+
+def _iso_utc(ts: datetime) -> str:
+    # stored values are UTC; MySQL hands them back naive
+    return (ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)).isoformat()
+
+def _encode_csv(rows, columns: list[str]) -> bytes:
+    buf = io.StringIO()
+    w = csv.writer(buf, lineterminator="\n")
+    for r in rows:
+        w.writerow(["" if r[c] is None else (_iso_utc(r[c]) if c == "ts" else r[c]) for c in columns])
+    return buf.getvalue().encode()
+
+def _encode_ndjson(rows) -> bytes:
+    return b"".join(orjson.dumps(dict(r), option=orjson.OPT_NAIVE_UTC | orjson.OPT_APPEND_NEWLINE) for r in rows)
+
+async def _stream_export(maker, stmt, fmt: str, columns: list[str], cold=None, desc: bool = False):
+    # own session: the request's session is closed before the body is streamed
+    async with maker() as session:
+        result = await session.stream(stmt.execution_options(yield_per=settings.export_chunk_rows))
+        if fmt == "csv":
+            yield (",".join(columns) + "\n").encode()
+        parts = result.mappings().partitions()
+        if cold is not None:
+            parts = archive.merge_stream(parts, cold, desc, settings.export_chunk_rows)
+        async for part in parts:
+            yield _encode_csv(part, columns) if fmt == "csv" else _encode_ndjson(part)
+
+@router.get("/export")
+async def export_data(
+    request: Request,
+    db: AsyncSession = Depends(get_read_db),
+    user: User = Depends(get_current_user),
+    viewer_uids: List[str] = Depends(get_viewer_site_uids),
+    site_uid: str | None = None,
+    device_id: int | None = None,
+    date_from: datetime | None = None,
+    date_to: datetime | None = None,
+    order: str = "asc",
+    fields: str | None = None,
+    format: str = "csv",
+):
+    """Stream every matching row as CSV or NDJSON through a server-side cursor."""
+    if format not in ("csv", "ndjson"):
+        raise HTTPException(400, "format must be csv or ndjson")
+    cols = _projection(fields)
+    stmt = select(*cols)
+    site_ids = None
+    if site_uid:
+        site = await site_registry.resolve(db, site_uid)
+        if not site:
+            raise HTTPException(404, "Site not found")
+        if user._role == "viewer" and site_uid not in viewer_uids:
+            raise HTTPException(403, "Forbidden")
+        site_ids = [site.id]
+    elif user._role == "viewer":
+        sites = await site_registry.resolve_many(db, viewer_uids)
+        site_ids = [s.id for s in sites.values()]
+    if site_ids is not None:
+        stmt = stmt.where(SensorData.site_id.in_(site_ids))
+    conds = _range_filters(device_id, date_from, date_to)
+    segs = await archive.segments(db, site_ids, date_from, date_to)
+    conds += archive.hot_filters(segs)
+    if conds:
+        stmt = stmt.where(*conds)
+    desc = order.lower() == "desc"
+    if desc:
+        stmt = stmt.order_by(SensorData.ts.desc(), SensorData.id.desc())
+    else:
+        stmt = stmt.order_by(SensorData.ts.asc(), SensorData.id.asc())
+
+    columns = [c.key for c in cols]
+    cold = archive.iter_rows(segs, columns, date_from, date_to, device_id, desc) if segs else None
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    filename = f"sensor_data_{site_uid or 'all'}.{format}"
+    maker = SessionLocal if reads_pinned(request) else ReadSessionLocal
+    return StreamingResponse(_stream_export(maker, stmt, format, columns, cold, desc), media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+AGGS = {"avg": func.avg, "min": func.min, "max": func.max, "count": func.count}
+
+@router.get("/aggregate")
+async def aggregate_data(
+    site_uid: str,
+    bucket: str = "1h",
+    fields: str = "ph,tss,debit",
+    agg: str = "avg",
+    date_from: datetime | None = None,
+    date_to: datetime | None = None,
+    device_id: int | None = None,
+    align: str = "local",
+    db: AsyncSession = Depends(get_read_db),
+    viewer_uids: List[str] = Depends(get_viewer_site_uids),
+):
+    """Time-bucketed series computed in SQL (GROUP BY the truncated bucket start).
+
+    Read from the rollup tables when one nests in the requested buckets (edges then round
+    to that rollup's resolution), from raw rows otherwise. Buckets align to ``settings.tz``
+    (``align=local``) or to UTC. Default range: the last 7 days.
+    """
+    if bucket not in BUCKETS or bucket == "1m":
+        raise HTTPException(400, "bucket must be one of 5m, 15m, 1h, 1d")
+    names = [f.strip() for f in fields.split(",") if f.strip()]
+    bad = [f for f in names if f not in SENSOR_FIELDS]
+    if not names or bad:
+        raise HTTPException(400, f"unknown fields: {','.join(bad)}" if bad else "fields required")
+    aggs = [a.strip() for a in agg.split(",") if a.strip()]
+    if not aggs or any(a not in AGGS for a in aggs):
+        raise HTTPException(400, "agg must be a subset of avg,min,max,count")
+    if align not in ("local", "utc"):
+        raise HTTPException(400, "align must be local or utc")
+    site = await site_registry.resolve(db, site_uid)
+    if not site:
+        raise HTTPException(404, "Site not found")
+    if viewer_uids and site_uid not in viewer_uids:
+        raise HTTPException(403, "Forbidden")
+
+    date_to = to_utc(date_to)
+    date_from = to_utc(date_from) if date_from else date_to - timedelta(days=7)
+    secs = BUCKETS[bucket]
+    if (date_to - date_from).total_seconds() / secs > settings.aggregate_max_buckets:
+        raise HTTPException(400, "too many buckets; narrow the range or use a larger bucket")
+    offset = tz_offset_s(settings.tz, date_from) if align == "local" else 0
+
+    source = rollups.series_source(secs, offset, date_from) if settings.rollups_enabled else None
+    if source:
+        rows = await rollups.series(db, source, site.id, names, aggs, date_from, date_to, secs, offset, device_id)
+    else:
+        # sum/count/min/max per bucket, so archived months can be folded in
+        segs = await archive.segments(db, [site.id], date_from, date_to)
+        b = bucket_expr(SensorData.ts, secs, offset, db.bind.dialect.name).label("b")
+        cols = []
+        for f in names:
+            v = getattr(SensorData, f)
+            cols += [func.sum(v), func.count(v), func.min(v), func.max(v)]
+        stmt = (select(b, *cols)
+                .where(SensorData.site_id==site.id, *_range_filters(device_id, date_from, date_to), *archive.hot_filters(segs))
+                .group_by(b))
+        acc = {int(r[0]): [list(r[1 + i * 4:5 + i * 4]) for i in range(len(names))] for r in (await db.execute(stmt)).all()}
+        if segs:
+            archive.add_stats(acc, await archive.stats(
+                segs, names, date_from, date_to, lambda t: ((t // 1_000_000 + offset) // secs * secs - offset,), device_id))
+        rows = []
+        for start in sorted(acc):
+            row = [start]
+            for total, cnt, lo, hi in acc[start]:
+                picked = {"avg": float(total) / cnt if cnt else None, "min": lo, "max": hi, "count": cnt}
+                row += [picked[a] for a in aggs]
+            rows.append(row)
+
+    out_tz = timezone(timedelta(seconds=offset))
+    series = {f: {a: [] for a in aggs} for f in names}
+    t = []
+    for row in rows:
+        t.append(datetime.fromtimestamp(int(row[0]), tz=out_tz).isoformat())
+        i = 1
+        for f in names:
+            for a in aggs:
+                v = row[i]
+                series[f][a].append(v if v is None else int(v) if a == "count" else float(v))
+                i += 1
+    return {"site_uid": site_uid, "bucket": bucket, "tz": settings.tz if align == "local" else "UTC",
+            "fields": names, "agg": aggs, "t": t, "series": series}
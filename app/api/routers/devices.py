@@ -1,39 +1,42 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
-from app.core.db import get_db
+from app.core.db import get_db, get_read_db
 from app.api.deps import require_roles, get_viewer_site_uids
 from app.models.models import Site, SensorDevice
 from app.schemas.device import DeviceCreate, DeviceUpdate, DeviceOut
+from app.services.response_cache import response_cache
+from app.services.site_cache import site_registry
 
 router = APIRouter()
 
 @router.post("", dependencies=[Depends(require_roles("admin","operator"))])
 async def create_device(data: DeviceCreate, db: AsyncSession = Depends(get_db)):
-    res = await db.execute(select(Site).where(Site.uid==data.site_uid))
-    site = res.scalar_one_or_none()
+    site = await site_registry.resolve(db, data.site_uid)
     if not site:
         raise HTTPException(400, "Invalid site_uid")
     d = SensorDevice(site_id=site.id, name=data.name, modbus_addr=data.modbus_addr, model=data.model, serial_no=data.serial_no, is_active=data.is_active)
     db.add(d); await db.commit(); await db.refresh(d)
+    response_cache.invalidate("devices")
     return {"ok": True, "id": d.id}
 
 @router.get("", response_model=list[DeviceOut])
-async def list_devices(site_uid: str | None = None, db: AsyncSession = Depends(get_db), viewer_uids: list[str] = Depends(get_viewer_site_uids)):
-    stmt = select(SensorDevice)
-    if site_uid:
-        res = await db.execute(select(Site).where(Site.uid==site_uid))
-        site = res.scalar_one_or_none()
-        if not site:
-            return []
-        stmt = stmt.where(SensorDevice.site_id==site.id)
-        if viewer_uids and site_uid not in viewer_uids:
-            return []
-    res = await db.execute(stmt.order_by(SensorDevice.id.desc()))
-    return [DeviceOut(id=d.id, site_id=d.site_id, name=d.name, modbus_addr=d.modbus_addr, model=d.model, serial_no=d.serial_no, is_active=d.is_active) for d in res.scalars().all()]
+async def list_devices(request: Request, site_uid: str | None = None, db: AsyncSession = Depends(get_read_db), viewer_uids: list[str] = Depends(get_viewer_site_uids)):
+    async def build():
+        stmt = select(SensorDevice)
+        if site_uid:
+            site = await site_registry.resolve(db, site_uid)
+            if not site:
+                return []
+            stmt = stmt.where(SensorDevice.site_id==site.id)
+            if viewer_uids and site_uid not in viewer_uids:
+                return []
+        res = await db.execute(stmt.order_by(SensorDevice.id.desc()))
+        return [DeviceOut(id=d.id, site_id=d.site_id, name=d.name, modbus_addr=d.modbus_addr, model=d.model, serial_no=d.serial_no, is_active=d.is_active) for d in res.scalars().all()]
+    return await response_cache.serve(request, "devices", ["devices", "sites"], viewer_uids, build)
 
 @router.get("/{id}", response_model=DeviceOut)
-async def get_device(id: int, db: AsyncSession = Depends(get_db), viewer_uids: list[str] = Depends(get_viewer_site_uids)):
+async def get_device(id: int, db: AsyncSession = Depends(get_read_db), viewer_uids: list[str] = Depends(get_viewer_site_uids)):
     res = await db.execute(select(SensorDevice).where(SensorDevice.id==id))
     d = res.scalar_one_or_none()
     if not d:
@@ -53,6 +56,7 @@ async def update_device(id: int, data: DeviceUpdate, db: AsyncSession = Depends(
     for k,v in data.model_dump(exclude_unset=True).items():
         setattr(d, k, v)
     await db.commit()
+    response_cache.invalidate("devices")
     return {"ok": True}
 
 @router.delete("/{id}", dependencies=[Depends(require_roles("admin"))])
@@ -62,4 +66,5 @@ async def delete_device(id: int, db: AsyncSession = Depends(get_db)):
     if not d:
         raise HTTPException(404, "Not found")
     await db.delete(d); await db.commit()
+    response_cache.invalidate("devices")
     return {"ok": True}
@@ -1,13 +1,16 @@
 from fastapi import APIRouter, Depends, HTTPException, Request
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, insert
-import jwt
+import jwt, math
 from datetime import datetime, timezone
 from fastapi.responses import PlainTextResponse
 
 from app.core.config import settings
 from app.core.db import get_db
-from app.models.models import Site, SensorData, IngestLog
+from app.models.models import SensorData, IngestLog
+from app.services.site_cache import site_registry
+from app.services.sensor_writer import insert_sensor_rows
+from app.services.audit import audit
 
 router = APIRouter()
 
@@ -15,54 +18,67 @@ router = APIRouter()
 async def get_key():
     return  "sparing"
 
+def _parse_reading(d) -> dict:
+    """Parse one SPARING reading; raises ValueError with the message returned to the logger."""
+    if not isinstance(d, dict):
+        raise ValueError("Invalid reading format")
+    try:
+        ts = datetime.fromtimestamp(int(d["datetime"]), tz=timezone.utc)
+        values = {k: float(d[k]) for k in ("ph", "cod", "tss", "debit")}
+    except KeyError as e:
+        raise ValueError(f"Missing field {e.args[0]}")
+    except (TypeError, ValueError, OverflowError, OSError):
+        raise ValueError("Invalid number")
+    if not all(math.isfinite(v) for v in values.values()):
+        raise ValueError("Invalid number")
+    if not (0 <= values["ph"] <= 14):
+        raise ValueError("Invalid pH value")
+    if values["cod"] < 0:
+        raise ValueError("Invalid COD value")
+    if values["tss"] < 0:
+        raise ValueError("Invalid TSS value")
+    if values["debit"] < 0:
+        raise ValueError("Invalid Debit value")
+    return {"ts": ts, **values}
+
 @router.post("/api/post-data")
 async def post_data(request: Request, db: AsyncSession = Depends(get_db)):
     body = await request.json()
     token = body.get("token")
     if not token:
         raise HTTPException(400, "Token is required")
-    
+
     try:
         decode = jwt.decode(token, settings.jwt_secret or "sparing", algorithms=["HS256"])
-    except jwt.ExpiredSignatureError:
+    except jwt.InvalidTokenError:
         raise HTTPException(400, "invalid token format")
-    
+
     uid = decode.get("uid")
     data = decode.get("data")
-    if not uid or not isinstance(data, list) or len(data) == 0 or len(data) > 30:
-        raise HTTPException (400, "Invalid data format")
-    
-    site = (await db.execute(select(Site).where(Site.uid==uid))).scalar_one_or_none()
-    if not site: 
+    if not uid or not isinstance(data, list) or len(data) == 0 or len(data) > settings.getdata_max_readings:
+        raise HTTPException(400, "Invalid data format")
+
+    site = await site_registry.resolve(db, uid)
+    if not site:
         raise HTTPException(401, "Invalid UID")
-    
-    rows = []
+
+    # validate every reading in one pass; bad readings are reported, not fatal
+    rows, errors = [], []
     now = datetime.now(timezone.utc)
-    for d in data:
-        ts = datetime.fromtimestamp(int(d["datetime"]), tz=timezone.utc)
-        ph = float(d["ph"])
-        if not (0 <= ph <= 14):
-            raise HTTPException(400, "Invalid pH value")
-        cod = float(d["cod"])
-        if cod < 0:
-            raise HTTPException(400, "Invalid COD value")
-        tss = float(d["tss"])
-        if tss < 0:
-            raise HTTPException(400, "Invalid TSS value")
-        debit = float(d["debit"])
-        if debit < 0:
-            raise HTTPException(400, "Invalid Debit value")
-        rows.append({
-            "site_id": site.id, "ts": ts, "ph": ph, "cod": cod,
-             "tss": tss, "debit": debit, "created_at": now,
-              "ingest_source": "getdata", "payload": None
-              })
-        
-        if rows:
-            await db.execute(insert(SensorData), rows)
-            await db.commit()
+    for i, d in enumerate(data):
+        try:
+            values = _parse_reading(d)
+        except ValueError as e:
+            errors.append({"index": i, "error": str(e)})
+            continue
+        rows.append({"site_id": site.id, "retention_class": site.retention_class, **values, "created_at": now, "ingest_source": "getdata", "payload": None})
+    if not rows:
+        raise HTTPException(400, {"message": "No valid readings", "errors": errors})
 
-        db.add(IngestLog(source_ip=(request.client.host if request.client else None),
-                         api_key_or_user_id="getdata", status="ok",))
-        await db.commit()
-        return {"message": "Data Berhasil Disimpan", "rows": len(rows)}
+    chunk = settings.getdata_chunk_rows
+    for i in range(0, len(rows), chunk):
+        await insert_sensor_rows(db, rows[i:i + chunk])
+    audit.ok(db, request.client.host if request.client else None, "getdata",
+             rows=len(rows), note=f"rejected={len(errors)}" if errors else None)
+    await db.commit()
+    return {"message": "Data Berhasil Disimpan", "rows": len(rows), "errors": errors}
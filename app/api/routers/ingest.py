@@ -1,14 +1,27 @@
 from fastapi import APIRouter, Depends, Header, HTTPException, Request
+from pydantic import ValidationError
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, insert
+from app.core.config import settings
 from app.core.db import get_db
+from app.core.logging import logger
 from app.api.deps import get_current_user
 from app.models.models import Site, SensorDevice, SensorData, IngestLog
 from app.schemas.data import IngestStateIn, IngestBulkIn
 from app.utils.time import to_utc
+from app.utils.records import iter_records
+from app.services.sensor_writer import sensor_row, insert_sensor_rows
+from app.services.ingest_buffer import ingest_buffer, BufferFull
+from app.services.site_cache import site_registry
+from app.services.audit import audit
+from app.services.idempotency import idempotency, item_key
 
 router = APIRouter()
 
+# rounds of "claim, conflict, re-read the keys" before a bulk request gives up
+_BULK_CLAIM_ATTEMPTS = 3
+
 def _validate_ranges(data: IngestStateIn):
     if data.ph is not None and not (0 <= data.ph <= 14):
         raise HTTPException(400, "pH out of range")
@@ -29,50 +42,189 @@ def _validate_ranges(data: IngestStateIn):
 async def ingest_state(body: IngestStateIn, request: Request, db: AsyncSession = Depends(get_db), idempotency_key: str | None = Header(default=None, alias="Idempotency-Key"), user=Depends(get_current_user)):
     ip = request.client.host if request.client else None
     try:
-        res = await db.execute(select(Site).where(Site.uid==body.site_uid))
-        site = res.scalar_one_or_none()
+        site = await site_registry.resolve(db, body.site_uid)
         if not site:
             raise HTTPException(400, "Invalid site_uid")
         if user._role == "viewer":
             # viewers cannot POST
             raise HTTPException(403, "Forbidden")
         _validate_ranges(body)
-        # check idempotency
         if idempotency_key:
-            ex = await db.execute(select(SensorData).where(SensorData.ingest_idempotency_key==idempotency_key))
-            row = ex.scalar_one_or_none()
-            if row:
-                return {"ok": True, "id": row.id}
-        ts_utc = to_utc(body.ts)
-        data = SensorData(
-            site_id=site.id,
-            device_id=body.device_id,
-            ts=ts_utc,
-            payload=body.payload,
-            ph=body.ph, tss=body.tss, debit=body.debit, nh3n=body.nh3n, cod=body.cod,
-            temp=body.temp, rh=body.rh, wind_speed_kmh=body.wind_speed_kmh, wind_deg=body.wind_deg, noise=body.noise,
-            co=body.co, so2=body.so2, no2=body.no2, o3=body.o3, pm25=body.pm25, pm10=body.pm10, tvoc=body.tvoc,
-            voltage=body.voltage, current=body.current,
-            ingest_source="api", ingest_idempotency_key=idempotency_key
-        )
-        db.add(data); await db.commit(); await db.refresh(data)
-        db.add(IngestLog(source_ip=ip, api_key_or_user_id=str(user.id), status="ok"))
+            # insert-first: the key's primary key catches retries, no SELECT up front
+            new_id, created = await idempotency.insert_once(db, idempotency_key, sensor_row(site, body, "api", idempotency_key))
+            if created:
+                audit.ok(db, ip, str(user.id))
+                await db.commit()
+                idempotency.remember(idempotency_key, new_id)
+            return {"ok": True, "id": new_id}
+        if ingest_buffer.running:
+            # row-mode audit rows are written by the buffer in the same batch
+            log = {"source_ip": ip, "api_key_or_user_id": str(user.id), "status": "ok"} if audit.mode == "row" else None
+            durable = settings.ingest_buffer_ack != "accepted"
+            try:
+                fut = await ingest_buffer.put(sensor_row(site, body, "api"), log, wait=durable)
+                # a put that waited for room can be failed by a worker shutting down
+                new_id = await fut if durable else None
+            except BufferFull:
+                raise HTTPException(503, "Ingest buffer full", headers={"Retry-After": "1"})
+            except Exception:
+                # the flush failed for this row, which was not stored; the client may retry
+                logger.exception("buffered ingest failed for site_id=%s", site.id)
+                raise HTTPException(503, "Ingest write failed", headers={"Retry-After": "1"})
+            if log is None:
+                audit.ok(db, ip, str(user.id))
+            return {"ok": True, "id": new_id} if durable else {"ok": True, "queued": True}
+        ids = await insert_sensor_rows(db, [sensor_row(site, body, "api")])
+        audit.ok(db, ip, str(user.id))
         await db.commit()
-        return {"ok": True, "id": data.id}
+        return {"ok": True, "id": ids[0]}
     except HTTPException as e:
-        db.add(IngestLog(source_ip=ip, api_key_or_user_id=str(user.id), status="error", error_msg=str(e.detail)))
-        await db.commit()
+        await audit.error(db, ip, str(user.id), str(e.detail))
         raise
 
+async def _write_bulk(db: AsyncSession, items, keys: list, valid: list, seen: dict, results: list) -> tuple[list, int]:
+    """Insert the valid, not-yet-seen items and claim their keys; returns (claimed keys, rows)."""
+    rows, row_idx, dup_idx = [], [], []
+    batch_keys = set()
+    for i, site in valid:
+        key = keys[i]
+        if key and key in seen:
+            results[i] = {"ok": True, "id": seen[key]}
+            continue
+        if key and key in batch_keys:
+            # repeated inside the batch: answered with the id of the first copy
+            dup_idx.append((i, key))
+            continue
+        if key:
+            batch_keys.add(key)
+        rows.append(sensor_row(site, items[i], "bulk", key))
+        row_idx.append(i)
+
+    ids = await insert_sensor_rows(db, rows)
+    claimed = []
+    for i, new_id in zip(row_idx, ids):
+        results[i] = {"ok": True, "id": new_id}
+        if keys[i]:
+            claimed.append((keys[i], new_id))
+    await idempotency.claim(db, claimed)
+    batch_ids = dict(claimed)
+    for i, key in dup_idx:
+        results[i] = {"ok": True, "id": batch_ids[key]}
+    return claimed, len(rows)
+
 @router.post("/bulk")
-async def ingest_bulk(body: IngestBulkIn, request: Request, db: AsyncSession = Depends(get_db), user=Depends(get_current_user)):
+async def ingest_bulk(body: IngestBulkIn, request: Request, db: AsyncSession = Depends(get_db), idempotency_key: str | None = Header(default=None, alias="Idempotency-Key"), user=Depends(get_current_user)):
+    """Per-item ``idempotency_key`` wins; otherwise a batch-level Idempotency-Key header
+    gives each item a key derived from the batch key and its position."""
     if len(body.bulk) > 1000:
         raise HTTPException(400, "bulk too large (max 1000)")
-    results = []
-    for item in body.bulk:
+    if user._role == "viewer":
+        raise HTTPException(403, "Forbidden")
+    ip = request.client.host if request.client else None
+    items = body.bulk
+    keys = [item.idempotency_key or (item_key(idempotency_key, i) if idempotency_key else None) for i, item in enumerate(items)]
+
+    # one query for all uncached sites, one for all keys missing from the LRU
+    uids = {item.site_uid for item in items}
+    sites = await site_registry.resolve_many(db, uids)
+    seen = await idempotency.lookup_many(db, [k for k in keys if k])
+
+    results: list[dict | None] = [None] * len(items)
+    valid = []
+    for i, item in enumerate(items):
+        site = sites.get(item.site_uid)
+        if site is None:
+            results[i] = {"ok": False, "error": "Invalid site_uid"}
+            continue
         try:
-            res = await ingest_state(item, request, db, None, user)  # reuse logic
-            results.append(res)
+            _validate_ranges(item)
         except HTTPException as e:
-            results.append({"ok": False, "error": str(e.detail)})
+            results[i] = {"ok": False, "error": str(e.detail)}
+            continue
+        valid.append((i, site))
+
+    principal = str(user.id)
+    for _ in range(_BULK_CLAIM_ATTEMPTS):
+        try:
+            claimed, n_rows = await _write_bulk(db, items, keys, valid, seen, results)
+            break
+        except IntegrityError:
+            # a concurrent request claimed one of our keys between lookup and insert
+            await db.rollback()
+            known = len(seen)
+            seen.update(await idempotency.lookup_many(db, [k for k in keys if k]))
+            if len(seen) == known:
+                raise  # not a key conflict
+    else:
+        await audit.error(db, ip, principal, "idempotency key conflict")
+        raise HTTPException(503, "Idempotency keys contended, retry", headers={"Retry-After": "1"})
+
+    for r in results:
+        if not r["ok"]:
+            await audit.error(db, ip, principal, r["error"], commit=False)
+    if n_rows:
+        audit.ok(db, ip, principal, rows=n_rows, note=f"bulk rows={n_rows}")
+    await db.commit()
+    for k, new_id in claimed:
+        idempotency.remember(k, new_id)
     return {"results": results}
+
+@router.post("/stream")
+async def ingest_stream(request: Request, format: str | None = None, db: AsyncSession = Depends(get_db), user=Depends(get_current_user)):
+    """Backfill from an NDJSON or CSV body, read incrementally and inserted in fixed-size chunks.
+
+    Each chunk commits on its own, so memory stays flat whatever the body size.
+    """
+    if user._role == "viewer":
+        raise HTTPException(403, "Forbidden")
+    fmt = format or ("csv" if "csv" in request.headers.get("content-type", "") else "ndjson")
+    if fmt not in ("ndjson", "csv"):
+        raise HTTPException(400, "format must be ndjson or csv")
+    chunk_rows = settings.ingest_stream_chunk_rows
+    max_errors = settings.ingest_stream_max_errors
+    accepted = rejected = 0
+    errors = []
+    rows = []
+    unknown_uids = set()
+
+    def reject(lineno: int, msg: str):
+        nonlocal rejected
+        rejected += 1
+        if len(errors) < max_errors:
+            errors.append({"line": lineno, "error": msg})
+
+    async for lineno, rec, err in iter_records(request.stream(), fmt):
+        if err:
+            reject(lineno, err)
+            continue
+        try:
+            item = IngestStateIn.model_validate(rec)
+            _validate_ranges(item)
+        except ValidationError as e:
+            first = e.errors()[0]
+            reject(lineno, f"{'.'.join(str(p) for p in first['loc'])}: {first['msg']}")
+            continue
+        except HTTPException as e:
+            reject(lineno, str(e.detail))
+            continue
+        site = None if item.site_uid in unknown_uids else await site_registry.resolve(db, item.site_uid)
+        if not site:
+            unknown_uids.add(item.site_uid)
+            reject(lineno, "Invalid site_uid")
+            continue
+        rows.append(sensor_row(site, item, "stream"))
+        if len(rows) >= chunk_rows:
+            await insert_sensor_rows(db, rows)
+            await db.commit()
+            accepted += len(rows)
+            rows = []
+    if rows:
+        await insert_sensor_rows(db, rows)
+        accepted += len(rows)
+    ip = request.client.host if request.client else None
+    if accepted:
+        audit.ok(db, ip, str(user.id), rows=accepted, note=f"stream accepted={accepted} rejected={rejected}")
+    if rejected:
+        await audit.error(db, ip, str(user.id), f"stream rejected={rejected}", commit=False)
+    await db.commit()
+    return {"accepted": accepted, "rejected": rejected, "errors": errors}
@@ -1,44 +1,115 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func
+from sqlalchemy import select, func, case, and_
 from datetime import datetime, timedelta, timezone
-from app.core.db import get_db
+from app.core.config import settings
+from app.core.db import get_read_db
 from app.api.deps import get_viewer_site_uids
-from app.models.models import Site, SensorData
+from app.models.models import SensorData, SENSOR_FIELDS
+from app.services import archive, rollups
+from app.services.latest_state import latest_readings
+from app.services.response_cache import response_cache
+from app.services.site_cache import site_registry
+from app.utils.time import local_day_start, to_utc
 
 router = APIRouter()
 
 @router.get("/sites/{uid}/stats/last-seen")
-async def last_seen(uid: str, db: AsyncSession = Depends(get_db), viewer_uids: list[str] = Depends(get_viewer_site_uids)):
-    res = await db.execute(select(Site).where(Site.uid==uid))
-    site = res.scalar_one_or_none()
+async def last_seen(request: Request, uid: str, db: AsyncSession = Depends(get_read_db), viewer_uids: list[str] = Depends(get_viewer_site_uids)):
+    site = await site_registry.resolve(db, uid)
     if not site:
         raise HTTPException(404, "Site not found")
     if viewer_uids and uid not in viewer_uids:
         raise HTTPException(403, "Forbidden")
-    row = (await db.execute(select(func.max(SensorData.ts)).where(SensorData.site_id==site.id))).scalar_one_or_none()
-    return {"site_uid": uid, "last_ts": row}
+
+    async def build():
+        row = await latest_readings.newest(db, site.id)
+        return {"site_uid": uid, "last_ts": row["ts"] if row else None}
+    return await response_cache.serve(request, "last_seen", [f"site:{site.id}"], viewer_uids, build)
+
+METRIC_WINDOWS = ("today", "24h", "7d", "30d", "custom")
+
+def _metric_windows(names: list[str], now: datetime, date_from: datetime | None, date_to: datetime | None) -> dict:
+    # rolling windows end one minute ahead so the current 1m rollup bucket is included
+    end = now + timedelta(minutes=1)
+    ranges = {
+        "today": (local_day_start(now, settings.tz), end),
+        "24h": (now - timedelta(hours=24), end),
+        "7d": (now - timedelta(days=7), end),
+        "30d": (now - timedelta(days=30), end),
+    }
+    if "custom" in names:
+        ranges["custom"] = (to_utc(date_from), to_utc(date_to) if date_to else end)
+    return {n: ranges[n] for n in names}
+
+async def _raw_window_stats(db: AsyncSession, site_id: int, fields: list[str], windows: dict) -> dict:
+    """Same numbers as rollups.stats_by_window, from sensor_data in one scan of the widest
+    range plus the archived rows of that range."""
+    lo = min(a for a, _ in windows.values())
+    hi = max(b for _, b in windows.values())
+    segs = await archive.segments(db, [site_id], lo, hi)
+    cols = []
+    for a, b in windows.values():
+        inside = and_(SensorData.ts >= a, SensorData.ts < b)
+        for f in fields:
+            v = case((inside, getattr(SensorData, f)))
+            cols += [func.sum(v), func.count(v), func.min(v), func.max(v)]
+    row = (await db.execute(select(*cols).where(
+        SensorData.site_id==site_id, SensorData.retention_class.in_(list(settings.retention_classes)),
+        SensorData.ts >= lo, SensorData.ts < hi, *archive.hot_filters(segs),
+    ))).one()
+    n = len(fields) * 4
+    acc = {w: [list(row[j:j + 4]) for j in range(i * n, (i + 1) * n, 4)] for i, w in enumerate(windows)}
+    if segs:
+        us = lambda ts: (to_utc(ts) - archive.EPOCH) // timedelta(microseconds=1)
+        bounds = [(w, us(a), us(b)) for w, (a, b) in windows.items()]
+        archive.add_stats(acc, await archive.stats(
+            segs, fields, lo, hi, lambda t: [w for w, a, b in bounds if a <= t < b]))
+    return {w: {f: {"avg": float(total) / cnt if cnt else None, "min": mn, "max": mx, "count": cnt}
+                for f, (total, cnt, mn, mx) in zip(fields, acc[w])} for w in windows}
 
 @router.get("/sites/{uid}/metrics")
-async def site_metrics(uid: str, db: AsyncSession = Depends(get_db), viewer_uids: list[str] = Depends(get_viewer_site_uids)):
-    res = await db.execute(select(Site).where(Site.uid==uid))
-    site = res.scalar_one_or_none()
+async def site_metrics(
+    request: Request,
+    uid: str,
+    fields: str = "ph,tss,debit",
+    windows: str = "today",
+    date_from: datetime | None = None,
+    date_to: datetime | None = None,
+    db: AsyncSession = Depends(get_read_db),
+    viewer_uids: list[str] = Depends(get_viewer_site_uids),
+):
+    """avg/min/max/count of ``fields`` (or ``all``) per window.
+
+    Windows: ``today`` (local day in ``settings.tz``), ``24h``, ``7d``, ``30d`` and ``custom``
+    (``date_from`` .. ``date_to``). All windows come from one query over the rollups, or
+    one pass over sensor_data when rollups are disabled.
+    """
+    names = list(SENSOR_FIELDS) if fields == "all" else [f.strip() for f in fields.split(",") if f.strip()]
+    bad = [f for f in names if f not in SENSOR_FIELDS]
+    if not names or bad:
+        raise HTTPException(400, f"unknown fields: {','.join(bad)}" if bad else "fields required")
+    wanted = list(dict.fromkeys(w.strip() for w in windows.split(",") if w.strip()))
+    if not wanted or any(w not in METRIC_WINDOWS for w in wanted):
+        raise HTTPException(400, "windows must be a subset of " + ",".join(METRIC_WINDOWS))
+    if "custom" in wanted and date_from is None:
+        raise HTTPException(400, "custom window needs date_from")
+    site = await site_registry.resolve(db, uid)
     if not site:
         raise HTTPException(404, "Site not found")
     if viewer_uids and uid not in viewer_uids:
         raise HTTPException(403, "Forbidden")
-    now = datetime.now(timezone.utc)
-    day_start = datetime(now.year, now.month, now.day, tzinfo=timezone.utc)
-    q = await db.execute(select(
-        func.avg(SensorData.ph), func.min(SensorData.ph), func.max(SensorData.ph),
-        func.avg(SensorData.tss), func.min(SensorData.tss), func.max(SensorData.tss),
-        func.avg(SensorData.debit), func.min(SensorData.debit), func.max(SensorData.debit),
-    ).where(SensorData.site_id==site.id, SensorData.ts>=day_start))
-    (ph_avg, ph_min, ph_max, tss_avg, tss_min, tss_max, debit_avg, debit_min, debit_max) = q.one()
-    return {
-        "today": {
-            "ph": {"avg": ph_avg, "min": ph_min, "max": ph_max},
-            "tss": {"avg": tss_avg, "min": tss_min, "max": tss_max},
-            "debit": {"avg": debit_avg, "min": debit_min, "max": debit_max},
+
+    async def build():
+        ranges = _metric_windows(wanted, datetime.now(timezone.utc), date_from, date_to)
+        if settings.rollups_enabled:
+            res = await rollups.stats_by_window(db, [site.id], names, ranges)
+            stats = {w: res[(site.id, w)] for w in ranges}
+        else:
+            stats = await _raw_window_stats(db, site.id, names, ranges)
+        return {
+            "site_uid": uid, "tz": settings.tz,
+            "windows": {w: {"from": a, "to": b} for w, (a, b) in ranges.items()},
+            **stats,
         }
-    }
+    return await response_cache.serve(request, "metrics", [f"site:{site.id}"], viewer_uids, build)
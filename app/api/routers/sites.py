@@ -1,44 +1,122 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, update, delete
-from app.core.db import get_db
+from sqlalchemy import select, update, delete, func
+from datetime import datetime, timedelta, timezone
+from app.core.config import settings
+from app.core.db import get_db, get_read_db
 from app.api.deps import get_current_user, require_roles, get_viewer_site_uids
-from app.models.models import Site
+from app.models.models import Site, SensorData, ArchiveSegment, LatestState, ROLLUP_TABLES
 from app.schemas.site import SiteCreate, SiteUpdate, SiteOut
+from app.models.models import SENSOR_FIELDS
+from app.services import archive, rollups
+from app.services.latest_state import latest_readings, newest_reading
+from app.services.response_cache import response_cache
+from app.services.site_cache import site_registry
+from app.utils.time import local_day_start
 
 router = APIRouter()
 
+def _check_retention_class(name: str | None):
+    if name not in settings.retention_classes:
+        raise HTTPException(400, "retention_class must be one of " + ",".join(settings.retention_classes))
+
 @router.post("", dependencies=[Depends(require_roles("admin","operator"))])
 async def create_site(data: SiteCreate, db: AsyncSession = Depends(get_db)):
     exists = await db.execute(select(Site).where(Site.uid==data.uid))
     if exists.scalar_one_or_none():
         raise HTTPException(409, "uid exists")
+    _check_retention_class(data.retention_class)
     s = Site(**data.model_dump())
     db.add(s)
     await db.commit()
     await db.refresh(s)
+    site_registry.invalidate(s.uid)
+    response_cache.invalidate("sites", "fleet")
     return {"ok": True, "id": s.id}
 
 @router.get("", response_model=list[SiteOut])
-async def list_sites(db: AsyncSession = Depends(get_db), viewer_uids: list[str] = Depends(get_viewer_site_uids)):
+async def list_sites(request: Request, db: AsyncSession = Depends(get_read_db), viewer_uids: list[str] = Depends(get_viewer_site_uids)):
+    async def build():
+        stmt = select(Site)
+        if viewer_uids:
+            stmt = stmt.where(Site.uid.in_(viewer_uids))
+        res = await db.execute(stmt.order_by(Site.id.desc()))
+        return [SiteOut(**{
+            "id": s.id, "uid": s.uid, "name": s.name, "company_name": s.company_name,
+            "lat": s.lat, "lon": s.lon, "is_active": s.is_active, "retention_class": s.retention_class
+        }) for s in res.scalars().all()]
+    return await response_cache.serve(request, "sites", ["sites"], viewer_uids, build)
+
+@router.get("/overview")
+async def sites_overview(request: Request, fields: str = "ph,tss,debit", db: AsyncSession = Depends(get_read_db),
+                         viewer_uids: list[str] = Depends(get_viewer_site_uids)):
+    """Every visible site with last-seen, latest reading and today's stats.
+
+    Three queries whatever the number of sites: sites, latest_state, rollups.
+    """
+    names = [f.strip() for f in fields.split(",") if f.strip()]
+    bad = [f for f in names if f not in SENSOR_FIELDS]
+    if not names or bad:
+        raise HTTPException(400, f"unknown fields: {','.join(bad)}" if bad else "fields required")
+    return await response_cache.serve(request, "overview", ["sites", "fleet"], viewer_uids,
+                                      lambda: _overview(db, names, viewer_uids))
+
+async def _raw_stats_many(db: AsyncSession, site_ids: list[int], fields: list[str], start: datetime, end: datetime) -> dict[int, dict]:
+    """Same numbers as rollups.window_stats_many, from one grouped scan of sensor_data plus
+    the archived rows of the window."""
+    segs = await archive.segments(db, site_ids, start, end)
+    cols = []
+    for f in fields:
+        v = getattr(SensorData, f)
+        cols += [func.sum(v), func.count(v), func.min(v), func.max(v)]
+    res = await db.execute(select(SensorData.site_id, *cols).where(
+        SensorData.site_id.in_(site_ids), SensorData.retention_class.in_(list(settings.retention_classes)),
+        SensorData.ts >= start, SensorData.ts < end, *archive.hot_filters(segs),
+    ).group_by(SensorData.site_id))
+    acc = {sid: [[None, 0, None, None] for _ in fields] for sid in site_ids}
+    for row in res.all():
+        acc[row[0]] = [list(row[j:j + 4]) for j in range(1, len(fields) * 4 + 1, 4)]
+    for sid in {seg.site_id for seg in segs}:
+        archive.add_stats(acc, await archive.stats(
+            [seg for seg in segs if seg.site_id == sid], fields, start, end, lambda t, sid=sid: (sid,)))
+    return {sid: {f: {"avg": float(total) / cnt if cnt else None, "min": mn, "max": mx, "count": cnt}
+                  for f, (total, cnt, mn, mx) in zip(fields, acc[sid])} for sid in site_ids}
+
+async def _overview(db: AsyncSession, names: list[str], viewer_uids: list[str]) -> dict:
     stmt = select(Site)
     if viewer_uids:
         stmt = stmt.where(Site.uid.in_(viewer_uids))
-    res = await db.execute(stmt.order_by(Site.id.desc()))
-    return [SiteOut(**{
-        "id": s.id, "uid": s.uid, "name": s.name, "company_name": s.company_name,
-        "lat": s.lat, "lon": s.lon, "is_active": s.is_active
-    }) for s in res.scalars().all()]
+    sites = (await db.execute(stmt.order_by(Site.id.desc()))).scalars().all()
+    ids = [s.id for s in sites]
+    now = datetime.now(timezone.utc)
+    day_start = local_day_start(now, settings.tz)  # same "today" as /sites/{uid}/metrics
+    readings = await latest_readings.get_many(db, ids) if ids else {}
+    today = {}
+    if ids and settings.rollups_enabled:
+        today = await rollups.window_stats_many(db, ids, names, day_start, now + timedelta(minutes=1))
+    elif ids:
+        today = await _raw_stats_many(db, ids, names, day_start, now + timedelta(minutes=1))
+    out = []
+    for s in sites:
+        last = newest_reading(readings[s.id])
+        out.append({
+            "id": s.id, "uid": s.uid, "name": s.name, "company_name": s.company_name,
+            "lat": s.lat, "lon": s.lon, "is_active": s.is_active,
+            "last_seen": last["ts"] if last else None,
+            "last": {k: last[k] for k in ("id", "ts", "device_id", *names)} if last else None,
+            "today": {f: {k: v[k] for k in ("avg", "min", "max")} for f, v in today[s.id].items()},
+        })
+    return {"generated_at": now, "sites": out}
 
 @router.get("/{id}", response_model=SiteOut)
-async def get_site(id: int, db: AsyncSession = Depends(get_db), viewer_uids: list[str] = Depends(get_viewer_site_uids)):
+async def get_site(id: int, db: AsyncSession = Depends(get_read_db), viewer_uids: list[str] = Depends(get_viewer_site_uids)):
     res = await db.execute(select(Site).where(Site.id==id))
     s = res.scalar_one_or_none()
     if not s:
         raise HTTPException(404, "Not found")
     if viewer_uids and s.uid not in viewer_uids:
         raise HTTPException(403, "Forbidden")
-    return SiteOut(id=s.id, uid=s.uid, name=s.name, company_name=s.company_name, lat=s.lat, lon=s.lon, is_active=s.is_active)
+    return SiteOut(id=s.id, uid=s.uid, name=s.name, company_name=s.company_name, lat=s.lat, lon=s.lon, is_active=s.is_active, retention_class=s.retention_class)
 
 @router.patch("/{id}", dependencies=[Depends(require_roles("admin","operator"))])
 async def update_site(id: int, data: SiteUpdate, db: AsyncSession = Depends(get_db)):
@@ -47,9 +125,14 @@ async def update_site(id: int, data: SiteUpdate, db: AsyncSession = Depends(get_
     if not s:
         raise HTTPException(404, "Not found")
     payload = data.model_dump(exclude_unset=True)
+    if "retention_class" in payload:
+        # applies to rows ingested from now on; stored rows keep the class they were written with
+        _check_retention_class(payload["retention_class"])
     for k,v in payload.items():
         setattr(s, k, v)
     await db.commit()
+    site_registry.invalidate(s.uid)
+    response_cache.invalidate("sites", "fleet", f"site:{s.id}")
     return {"ok": True}
 
 @router.delete("/{id}", dependencies=[Depends(require_roles("admin"))])
@@ -58,5 +141,16 @@ async def delete_site(id: int, db: AsyncSession = Depends(get_db)):
     s = res.scalar_one_or_none()
     if not s:
         raise HTTPException(404, "Not found")
+    # sensor_data has no foreign keys (partitioned), so readings are checked here
+    has_data = (await db.execute(select(SensorData.id).where(SensorData.site_id==id).limit(1))).first()
+    has_archive = (await db.execute(select(ArchiveSegment.id).where(ArchiveSegment.site_id==id).limit(1))).first()
+    if has_data or has_archive:
+        raise HTTPException(409, "site has sensor data")
+    uid = s.uid
+    for table in (*ROLLUP_TABLES.values(), LatestState.__table__):
+        await db.execute(delete(table).where(table.c.site_id==id))
     await db.delete(s); await db.commit()
+    latest_readings.invalidate(id)
+    site_registry.invalidate(uid)
+    response_cache.invalidate("sites", "fleet", f"site:{id}")
     return {"ok": True}
@@ -1,18 +1,127 @@
+import hashlib, time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Callable
+from fastapi import Request
+from sqlalchemy import event, text
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
-from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.orm import DeclarativeBase, Session
 from app.core.config import settings
+from app.core.instrumentation import TimedQueuePool, instrument_engine, instrument_queries
+from app.core.logging import logger
 
-engine = create_async_engine(settings.db_url, pool_pre_ping=True, pool_recycle=1800)
-SessionLocal = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+def _make_engine(url: str, pool_size: int, max_overflow: int, name: str):
+    kw = {}
+    if make_url(url).get_backend_name() != "sqlite":
+        kw = {"poolclass": TimedQueuePool, "pool_size": pool_size, "max_overflow": max_overflow}
+    eng = create_async_engine(url, pool_pre_ping=True, pool_recycle=1800, **kw)
+    instrument_engine(eng, name)
+    instrument_queries(eng)
+    return eng
+
+class PrimarySession(Session):
+    """Sessions on the primary; a commit marks the session so get_db can pin the caller's reads,
+    and runs the callbacks queued with ``on_commit``."""
+
+def on_commit(session: AsyncSession | Session, fn: Callable[[], None]):
+    """Run ``fn`` once the session's current transaction has committed; a rollback drops it.
+
+    For side effects that must not see uncommitted rows: metrics, cache invalidation.
+    """
+    session.info.setdefault("on_commit", []).append(fn)
+
+@event.listens_for(PrimarySession, "after_commit")
+def _after_commit(session):
+    session.info["wrote"] = True
+    for fn in session.info.pop("on_commit", ()):
+        try:
+            fn()
+        except Exception:
+            logger.exception("on_commit callback failed")
+
+@event.listens_for(PrimarySession, "after_rollback")
+def _after_rollback(session):
+    session.info.pop("on_commit", None)
+
+engine = _make_engine(settings.db_url, settings.db_pool_size, settings.db_max_overflow, "primary")
+SessionLocal = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession, sync_session_class=PrimarySession)
+
+# reads go to DB_READ_URL when set, through a pool of their own
+if settings.db_read_url:
+    read_engine = _make_engine(settings.db_read_url, settings.db_read_pool_size, settings.db_read_max_overflow, "replica")
+    ReadSessionLocal = async_sessionmaker(read_engine, expire_on_commit=False, class_=AsyncSession)
+else:
+    read_engine, ReadSessionLocal = engine, SessionLocal
 
 class Base(DeclarativeBase):
     pass
 
-async def get_db():
+# caller -> monotonic time of its last commit on this worker
+_writers: OrderedDict[str, float] = OrderedDict()
+
+def _caller(request: Request) -> str:
+    cred = request.headers.get("authorization") or request.headers.get("x-api-key")
+    if cred:
+        return hashlib.sha1(cred.encode()).hexdigest()
+    return "ip:" + (request.client.host if request.client else "unknown")
+
+def reads_pinned(request: Request) -> bool:
+    """True when this request's reads must see the primary: the caller asked for it with
+    ``X-Read-Primary: 1`` or committed on this worker within DB_READ_STICKY_S."""
+    if request.headers.get("x-read-primary") == "1":
+        return True
+    wrote = _writers.get(_caller(request))
+    return wrote is not None and time.monotonic() - wrote < settings.db_read_sticky_s
+
+async def get_db(request: Request):
+    """Session on the primary, for writes and for reads that must see them."""
     async with SessionLocal() as session:
+        try:
+            yield session
+        finally:
+            if session.info.get("wrote") and read_engine is not engine:
+                key = _caller(request)
+                _writers[key] = time.monotonic()
+                _writers.move_to_end(key)
+                while len(_writers) > 10000:
+                    _writers.popitem(last=False)
+
+async def get_read_db(request: Request):
+    """Session on the read replica, or on the primary when there is none or reads are pinned."""
+    maker = SessionLocal if reads_pinned(request) else ReadSessionLocal
+    async with maker() as session:
         yield session
 
+@asynccontextmanager
+async def named_lock(name: str):
+    """Hold MySQL's GET_LOCK(name) on a connection of its own; yields False when another
+    session has it. Other dialects run a single process here and always get the lock."""
+    if engine.dialect.name != "mysql":
+        yield True
+        return
+    async with engine.connect() as conn:
+        got = bool((await conn.execute(text("SELECT GET_LOCK(:n, 0)"), {"n": name})).scalar())
+        try:
+            yield got
+        finally:
+            if got:
+                await conn.execute(text("SELECT RELEASE_LOCK(:n)"), {"n": name})
+
 async def init_models():
     # Alembic handles migrations; this just ensures connection OK
     async with engine.begin() as conn:
         await conn.run_sync(lambda _: None)
+
+def upsert(dialect: str, table, rows: list[dict], keys: list[str], set_: Callable):
+    """INSERT .. ON DUPLICATE KEY UPDATE (MySQL) / ON CONFLICT DO UPDATE (SQLite).
+
+    ``set_(new)`` builds the update mapping; ``new`` refers to the incoming row values.
+    """
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+        stmt = sqlite_insert(table).values(rows)
+        return stmt.on_conflict_do_update(index_elements=keys, set_=set_(stmt.excluded))
+    from sqlalchemy.dialects.mysql import insert as mysql_insert
+    stmt = mysql_insert(table).values(rows)
+    return stmt.on_duplicate_key_update(set_(stmt.inserted))
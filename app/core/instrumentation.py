@@ -0,0 +1,149 @@
+import atexit, os, re
+from contextvars import ContextVar
+from time import perf_counter
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from app.core.config import settings
+from app.core.logging import logger
+
+# Prometheus metrics. Under gunicorn, PROMETHEUS_MULTIPROC_DIR (set in the Dockerfile, reset by
+# gunicorn.conf.py) makes every worker write its samples to files that /metrics sums up.
+if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+    # alembic, seed.py and scripts/ import the app without gunicorn.conf.py having run
+    os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+    # drop this process's live gauges when it exits, whether or not gunicorn started it
+    atexit.register(lambda: multiprocess.mark_process_dead(os.getpid()))
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Request latency by route template", ["method", "route"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+REQUESTS = Counter("http_requests_total", "Responses by route template and status", ["method", "route", "status"])
+INGEST_ROWS = Counter("ingest_rows_total", "Sensor rows inserted, per ingest source", ["source"])
+RATE_LIMITED = Counter("rate_limit_rejections_total", "Requests answered 429, per rule prefix", ["prefix"])
+POOL_CHECKED_OUT = Gauge("db_pool_checked_out", "Connections checked out of the pool", ["engine"], multiprocess_mode="livesum")
+POOL_OVERFLOW = Gauge("db_pool_overflow", "Connections open beyond pool_size", ["engine"], multiprocess_mode="livesum")
+POOL_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds", "Time to get a connection from the pool, connecting included", ["engine"],
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5),
+)
+# per-worker cache counters since the worker started, published every METRICS_PUBLISH_S;
+# hit ratio = sum(cache_hits) / (sum(cache_hits) + sum(cache_misses))
+CACHE_HITS = Gauge("cache_hits", "Lookups answered by a per-worker cache", ["cache"], multiprocess_mode="livesum")
+CACHE_MISSES = Gauge("cache_misses", "Lookups a per-worker cache had to pass on", ["cache"], multiprocess_mode="livesum")
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """Queue pool that records checkout waits and its overflow once ``instrument_engine``
+    has named it."""
+    _wait = None
+    _overflow_gauge = None
+
+    def _do_get(self):
+        if self._wait is None:
+            return super()._do_get()
+        start = perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            self._wait.observe(perf_counter() - start)
+            self._overflow_gauge.set(max(self.overflow(), 0))
+
+    def _do_return_conn(self, record):
+        try:
+            super()._do_return_conn(record)
+        finally:
+            # set after the return: that is where a surplus connection is closed
+            if self._overflow_gauge is not None:
+                self._overflow_gauge.set(max(self.overflow(), 0))
+
+def instrument_engine(engine, name: str):
+    pool = engine.sync_engine.pool
+    checked_out = POOL_CHECKED_OUT.labels(name)
+    if isinstance(pool, TimedQueuePool):
+        pool._wait, pool._overflow_gauge = POOL_WAIT.labels(name), POOL_OVERFLOW.labels(name)
+
+    def on_checkout(*_):
+        checked_out.inc()
+
+    def on_checkin(*_):
+        checked_out.dec()
+
+    event.listen(pool, "checkout", on_checkout)
+    event.listen(pool, "checkin", on_checkin)
+
+class QueryStats:
+    """SQL statements run for one request, filled in by the hooks of ``instrument_queries``."""
+    __slots__ = ("scope", "count", "seconds", "statements")
+
+    def __init__(self, scope: dict | None = None):
+        self.scope = scope
+        self.count = 0
+        self.seconds = 0.0
+        self.statements: list[tuple[float, str]] = []  # (seconds, sql), with SERVER_TIMING_DETAIL
+
+    @property
+    def route(self) -> str | None:
+        return getattr((self.scope or {}).get("route"), "path", None)
+
+# set per request by ServerTimingMiddleware; None outside requests (background jobs)
+query_stats_ctx: ContextVar[QueryStats | None] = ContextVar("query_stats", default=None)
+
+_SQL_NORMALIZE = [
+    (re.compile(r"'(?:[^'\\]|\\.|'')*'"), "?"),
+    (re.compile(r"%\(\w+\)s|%s|\?|\b\d+(?:\.\d+)?\b"), "?"),
+    (re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)"), "(...)"),
+    (re.compile(r"\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+"), "(...), ..."),
+    (re.compile(r"\s+"), " "),
+]
+
+def normalize_sql(sql: str, limit: int = 2000) -> str:
+    """One-line SQL with literals and placeholders as ?, IN lists and VALUES rows collapsed."""
+    for pattern, repl in _SQL_NORMALIZE:
+        sql = pattern.sub(repl, sql)
+    return sql.strip()[:limit]
+
+def instrument_queries(engine):
+    """Time every statement: per-request totals go to ``query_stats_ctx``, statements slower
+    than SLOW_QUERY_MS are logged with the request ID and route."""
+    sync = engine.sync_engine
+
+    @event.listens_for(sync, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info["query_start"] = perf_counter()
+
+    @event.listens_for(sync, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = perf_counter() - conn.info.pop("query_start", perf_counter())
+        stats = query_stats_ctx.get()
+        if stats is not None:
+            stats.count += 1
+            stats.seconds += elapsed
+            if settings.server_timing_detail and len(stats.statements) < 10:
+                stats.statements.append((elapsed, statement))
+        if settings.slow_query_ms and elapsed * 1000 >= settings.slow_query_ms:
+            logger.warning("slow query", extra={"fields": {
+                "duration_ms": round(elapsed * 1000, 2), "route": stats.route if stats else None,
+                "sql": normalize_sql(statement),
+            }})
+
+def count_ingested(rows: list[dict]):
+    counts: dict[str, int] = {}
+    for r in rows:
+        source = r.get("ingest_source") or "unknown"
+        counts[source] = counts.get(source, 0) + 1
+    for source, n in counts.items():
+        INGEST_ROWS.labels(source).inc(n)
+
+def publish_cache_stats(stats: dict[str, tuple[int, int]]):
+    """Set the cache gauges from {cache: (hits, misses)}."""
+    for name, (hits, misses) in stats.items():
+        CACHE_HITS.labels(name).set(hits)
+        CACHE_MISSES.labels(name).set(misses)
+
+def render() -> tuple[bytes, str]:
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
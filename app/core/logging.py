@@ -1,22 +1,133 @@
-import logging, sys, json, time, uuid
+import atexit, logging, os, queue, sys, time
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+import orjson
+from app.core.config import settings
+
+# set per request by RequestIDMiddleware
+request_id_ctx: ContextVar[str | None] = ContextVar("request_id", default=None)
+# the request's ASGI scope, also set by RequestIDMiddleware: the route template and the
+# user id (scope["state"]["user_id"], set by get_current_user) are read from it
+request_scope_ctx: ContextVar[dict | None] = ContextVar("request_scope", default=None)
+
+CONTEXT_FIELDS = ("request_id", "route", "user_id", "suppressed", "dropped")
+
+class RequestContextFilter(logging.Filter):
+    """Copies the request context onto the record; runs in the caller's thread, before the queue."""
+
+    def filter(self, record):
+        if not hasattr(record, "request_id"):
+            rid = request_id_ctx.get()
+            if rid:
+                record.request_id = rid
+        scope = request_scope_ctx.get()
+        if scope is not None:
+            route = getattr(scope.get("route"), "path", None)
+            if route and not hasattr(record, "route"):
+                record.route = route
+            user_id = scope.get("state", {}).get("user_id")
+            if user_id is not None and not hasattr(record, "user_id"):
+                record.user_id = user_id
+        return True
+
+class ErrorSampler(logging.Filter):
+    """Passes the first ``burst`` identical ERROR+ records (logger, call site, message and
+    exception type) per ``window_s``; the first one let through after that carries
+    ``suppressed``, the number dropped. Lower levels always pass."""
+
+    def __init__(self, window_s: float = 60, burst: int = 10, max_keys: int = 10000):
+        super().__init__()
+        self.window_s = window_s
+        self.burst = burst
+        self.max_keys = max_keys
+        self._seen: dict[tuple, list] = {}  # key -> [window start, records in window, suppressed]
+
+    def filter(self, record):
+        if record.levelno < logging.ERROR or self.window_s <= 0:
+            return True
+        exc = record.exc_info[0].__name__ if record.exc_info and record.exc_info[0] else None
+        key = (record.name, record.levelno, record.pathname, record.lineno, record.getMessage(), exc)
+        now = time.monotonic()
+        entry = self._seen.get(key)
+        if entry is None or now - entry[0] >= self.window_s:
+            if entry is not None and entry[2]:
+                record.suppressed = entry[2]
+            if entry is None and len(self._seen) >= self.max_keys:
+                self._seen.clear()
+            self._seen[key] = [now, 1, 0]
+            return True
+        entry[1] += 1
+        if entry[1] <= self.burst:
+            return True
+        entry[2] += 1
+        return False
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Queues records for the listener thread, which formats and writes them.
+
+    Only the message is rendered here (its args may change later); a full queue drops the
+    record and the next one queued carries ``dropped``.
+    """
+
+    def __init__(self, q: queue.Queue):
+        super().__init__(q)
+        self.dropped = 0
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        if self.dropped:
+            record.dropped = self.dropped
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+        else:
+            self.dropped = 0
 
 class JsonFormatter(logging.Formatter):
     def format(self, record):
         base = {
             "level": record.levelname,
             "msg": record.getMessage(),
-            "time": int(time.time() * 1000),
+            "time": int(record.created * 1000),
             "logger": record.name,
         }
-        if hasattr(record, "request_id"):
-            base["request_id"] = record.request_id
+        for f in CONTEXT_FIELDS:
+            v = getattr(record, f, None)
+            if v is not None:
+                base[f] = v
+        if hasattr(record, "fields"):
+            base.update(record.fields)
         if record.exc_info:
             base["exc"] = self.formatException(record.exc_info)
-        return json.dumps(base, ensure_ascii=False)
+        return orjson.dumps(base, default=str).decode()
+
+_stream = logging.StreamHandler(sys.stdout)
+_stream.setFormatter(JsonFormatter())
+
+handler = NonBlockingQueueHandler(queue.Queue(settings.log_queue_size))
+handler.addFilter(ErrorSampler(settings.log_sample_window_s, settings.log_sample_burst))
+handler.addFilter(RequestContextFilter())
+
+listener = QueueListener(handler.queue, _stream)
+listener.start()
+
+@atexit.register
+def _flush_logs():
+    if listener._thread is not None:
+        listener.stop()
+
+def _restart_listener():
+    # the thread does not survive a fork (gunicorn --preload)
+    listener._thread = None
+    listener.start()
 
-handler = logging.StreamHandler(sys.stdout)
-handler.setFormatter(JsonFormatter())
+os.register_at_fork(after_in_child=_restart_listener)
 
 logger = logging.getLogger("app")
-logger.setLevel(logging.INFO)
+logger.setLevel(settings.log_level.upper())
 logger.addHandler(handler)
@@ -1,16 +1,67 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse  # 👈
+from fastapi.responses import JSONResponse, Response  # 👈
 from app.core.config import settings
 from app.api.routers import auth, sites, devices, ingest, data, metrics, admin, getdata
 from app.middlewares.request_id import RequestIDMiddleware
-from app.middlewares.rate_limit import RateLimitMiddleware
+from app.middlewares.metrics import MetricsMiddleware
+from app.middlewares.server_timing import ServerTimingMiddleware
+from app.middlewares.rate_limit import RateLimitMiddleware, rules_from_settings, backend_from_settings
 from app.core.db import init_models
 from app.core.logging import logger
+from app.core.instrumentation import publish_cache_stats, render as render_metrics
+from app.services.ingest_buffer import ingest_buffer
+from app.services.auth_cache import auth_cache
+from app.services.tasks import periodic
+from app.services.audit import audit
+from app.services.site_cache import site_registry
+from app.services.latest_state import latest_readings
+from app.services.response_cache import response_cache
+from app.services.idempotency import idempotency
+from app.services.partitions import maintain as maintain_partitions
+from app.services import archive
+
+async def publish_caches():
+    publish_cache_stats({
+        "site": (site_registry.hits, site_registry.misses),
+        "auth_user": (auth_cache.user_hits, auth_cache.user_misses),
+        "idempotency": (idempotency.hits, idempotency.misses),
+        "latest_state": (latest_readings.hits, latest_readings.misses),
+        "responses": (response_cache.hits, response_cache.misses),
+    })
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if settings.ingest_buffer_enabled:
+        await ingest_buffer.start()
+    try:
+        await auth_cache.sync()
+    except Exception:
+        # get_current_user falls back to the DB until a sync succeeds
+        logger.exception("Initial token blacklist sync failed")
+    periodic.every(settings.auth_revocation_sync_s, auth_cache.sync)
+    periodic.every(settings.auth_blacklist_purge_s, auth_cache.purge)
+    periodic.every(settings.audit_flush_s, audit.flush)
+    periodic.every(settings.idempotency_expire_s, idempotency.expire)
+    if settings.metrics_enabled:
+        periodic.every(settings.metrics_publish_s, publish_caches)
+    if settings.partition_maintenance_s:
+        # at start too: workers restarted more often than the interval would never run it
+        periodic.every(settings.partition_maintenance_s, maintain_partitions, at_start=True)
+    if archive.enabled() and settings.archive_interval_s:
+        periodic.every(settings.archive_interval_s, archive.run)
+    yield
+    await periodic.stop()
+    # flush rows still queued before the worker exits
+    await ingest_buffer.stop()
+    await audit.flush()
 
 # ✅ pakai JSONResponse sebagai default (atau hilangkan param ini)
-app = FastAPI(title="SPARING API", version="1.0.0", default_response_class=JSONResponse)
+app = FastAPI(title="SPARING API", version="1.0.0", default_response_class=JSONResponse, lifespan=lifespan)
 
+if settings.server_timing_enabled:
+    app.add_middleware(ServerTimingMiddleware)
 app.add_middleware(RequestIDMiddleware)
 app.add_middleware(
     CORSMiddleware,
@@ -19,7 +70,10 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-app.add_middleware(RateLimitMiddleware, routes_prefix=["/ingest"], rate_per_min=settings.rate_limit_per_min)
+app.add_middleware(RateLimitMiddleware, rules=rules_from_settings(), backend=backend_from_settings())
+if settings.metrics_enabled:
+    # outermost, so rate-limited requests are timed too
+    app.add_middleware(MetricsMiddleware)
 
 app.include_router(auth.router, prefix="/auth", tags=["Auth"])
 app.include_router(sites.router, prefix="/sites", tags=["Sites"])
@@ -30,6 +84,13 @@ app.include_router(metrics.router, tags=["Metrics"])
 app.include_router(admin.router, prefix="/admin", tags=["Admin"])
 app.include_router(getdata.router, tags=["GetData"])
 
+if settings.metrics_enabled:
+    @app.get("/metrics", include_in_schema=False)
+    async def prometheus_metrics():
+        await publish_caches()
+        body, content_type = render_metrics()
+        return Response(body, media_type=content_type)
+
 @app.get("/healthz", tags=["Health"])
 async def healthz():
     try:
@@ -0,0 +1,38 @@
+from time import perf_counter
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from app.core.instrumentation import REQUEST_LATENCY, REQUESTS
+
+class MetricsMiddleware:
+    """Pure ASGI: latency histogram and status counter per method and route template.
+
+    The template comes from the matched route (``scope["route"]``), so /sites/1 and
+    /sites/2 share a series; requests that match no route count as "unmatched".
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self._series: dict[tuple, tuple] = {}  # labelled children, looked up once
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = perf_counter()
+        status = 500
+
+        async def send_with_status(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = getattr(scope.get("route"), "path", "unmatched")
+            key = (scope["method"], route, status)
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = (REQUEST_LATENCY.labels(scope["method"], route),
+                                              REQUESTS.labels(scope["method"], route, str(status)))
+            series[0].observe(perf_counter() - start)
+            series[1].inc()
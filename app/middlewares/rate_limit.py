@@ -1,25 +1,184 @@
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.datastructures import MutableHeaders
 from starlette.requests import Request
-from starlette.responses import Response, JSONResponse
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from collections import OrderedDict
+from dataclasses import dataclass
 from time import time
-from collections import defaultdict
 from typing import List
+import hashlib, math, sqlite3, threading, anyio, jwt
 
-class RateLimitMiddleware(BaseHTTPMiddleware):
-    def __init__(self, app, routes_prefix: List[str], rate_per_min: int = 60):
-        super().__init__(app)
-        self.routes_prefix = routes_prefix
-        self.rate_per_min = rate_per_min
-        self.bucket = defaultdict(list)  # naive in-memory
-
-    async def dispatch(self, request: Request, call_next):
-        path = request.url.path
-        if any(path.startswith(p) for p in self.routes_prefix):
-            key = request.client.host or "unknown"
-            now = time()
-            window = now - 60
-            self.bucket[key] = [t for t in self.bucket[key] if t >= window]
-            if len(self.bucket[key]) >= self.rate_per_min:
-                return JSONResponse({"detail": "Rate limit exceeded"}, status_code=429)
-            self.bucket[key].append(now)
-        return await call_next(request)
+from app.core.config import settings
+from app.core.instrumentation import RATE_LIMITED
+from app.core.logging import logger
+
+@dataclass
+class RateRule:
+    prefix: str
+    rate_per_min: int
+    burst: int | None = None  # bucket size, defaults to rate_per_min
+    # ip | user | api_key | site; "site" reads site_uid from the query string or a /sites/{uid}
+    # path only (bodies are not parsed here), so on /ingest it falls back to the client IP
+    key: str = "ip"
+
+    @property
+    def capacity(self) -> int:
+        return self.burst or self.rate_per_min
+
+def gcra(tat: float | None, now: float, interval: float, burst: int):
+    """Generic cell rate algorithm (token bucket as a single timestamp).
+
+    Returns (new_tat or None when rejected, remaining, retry_after, reset_after).
+    """
+    tat = max(tat or now, now)
+    new_tat = tat + interval
+    allow_at = new_tat - burst * interval
+    if now < allow_at:
+        return None, 0, allow_at - now, tat - now
+    return new_tat, int((now - allow_at) / interval), 0.0, new_tat - now
+
+class MemoryBackend:
+    """Per-worker buckets in an LRU-bounded table."""
+    blocking = False
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._tat: OrderedDict[str, float] = OrderedDict()
+
+    def hit(self, key: str, interval: float, burst: int, now: float):
+        new_tat, remaining, retry_after, reset = gcra(self._tat.get(key), now, interval, burst)
+        if new_tat is not None:
+            self._tat[key] = new_tat
+            self._tat.move_to_end(key)
+            if len(self._tat) > self.max_keys:
+                self._tat.popitem(last=False)
+        return new_tat is not None, remaining, retry_after, reset
+
+class SqliteBackend:
+    """Buckets shared by all workers on one host through a local SQLite file.
+
+    ``hit`` blocks (up to ``timeout`` on a contended file), so the middleware runs it in a
+    worker thread. When the file stays locked or fails, the hit is counted by a per-worker
+    ``MemoryBackend`` instead of failing the request.
+    """
+    blocking = True
+
+    def __init__(self, path: str, prune_every: int = 10_000, timeout: float = 1.0):
+        self.conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False, timeout=timeout)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=OFF")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tat REAL NOT NULL)")
+        self.prune_every = prune_every
+        self.fallback = MemoryBackend()
+        self._lock = threading.Lock()  # one connection, used from worker threads
+        self._hits = 0
+        self._failing = False
+
+    def hit(self, key: str, interval: float, burst: int, now: float):
+        with self._lock:
+            try:
+                result = self._hit(key, interval, burst, now)
+            except sqlite3.Error as e:
+                if not self._failing:
+                    logger.warning("rate limit store unavailable, using per-worker buckets", extra={"fields": {"error": str(e)}})
+                self._failing = True
+                return self.fallback.hit(key, interval, burst, now)
+            self._failing = False
+            return result
+
+    def _hit(self, key: str, interval: float, burst: int, now: float):
+        c = self.conn
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            row = c.execute("SELECT tat FROM buckets WHERE key = ?", (key,)).fetchone()
+            new_tat, remaining, retry_after, reset = gcra(row[0] if row else None, now, interval, burst)
+            if new_tat is not None:
+                c.execute("INSERT INTO buckets (key, tat) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET tat = excluded.tat", (key, new_tat))
+            self._hits += 1
+            if self._hits % self.prune_every == 0:
+                # a bucket whose tat has passed is full again, same as no row
+                c.execute("DELETE FROM buckets WHERE tat < ?", (now,))
+            c.execute("COMMIT")
+        except Exception:
+            if c.in_transaction:
+                c.execute("ROLLBACK")
+            raise
+        return new_tat is not None, remaining, retry_after, reset
+
+def _client_key(request: Request, kind: str) -> str:
+    ip = request.client.host if request.client else "unknown"
+    if kind == "user":
+        auth = request.headers.get("authorization", "")
+        if auth[:7].lower() == "bearer ":
+            try:
+                payload = jwt.decode(auth[7:], settings.jwt_secret, algorithms=[settings.jwt_alg])
+                return f"u:{payload.get('user_id')}"
+            except jwt.InvalidTokenError:
+                pass
+    elif kind == "api_key":
+        key = request.headers.get("x-api-key")
+        if key:
+            return "k:" + hashlib.sha1(key.encode()).hexdigest()
+    elif kind == "site":
+        uid = request.query_params.get("site_uid")
+        if not uid and request.url.path.startswith("/sites/"):
+            uid = request.url.path.split("/")[2]
+        if uid:
+            return f"s:{uid}"
+    return f"ip:{ip}"
+
+class RateLimitMiddleware:
+    """Pure ASGI rate limiter; requests outside every rule pass straight through."""
+
+    def __init__(self, app: ASGIApp, rules: List[RateRule] | None = None, backend=None,
+                 routes_prefix: List[str] | None = None, rate_per_min: int = 60):
+        self.app = app
+        if rules is None:
+            rules = [RateRule(prefix=p, rate_per_min=rate_per_min) for p in (routes_prefix or [])]
+        self.rules = sorted(rules, key=lambda r: len(r.prefix), reverse=True)  # longest prefix wins
+        self.backend = backend or MemoryBackend()
+        self.rejected = 0
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        path = scope["path"]
+        rule = next((r for r in self.rules if path.startswith(r.prefix)), None)
+        if rule is None:
+            return await self.app(scope, receive, send)
+        key = f"{rule.prefix}|{_client_key(Request(scope), rule.key)}"
+        args = (key, 60.0 / rule.rate_per_min, rule.capacity, time())
+        if getattr(self.backend, "blocking", False):
+            allowed, remaining, retry_after, reset = await anyio.to_thread.run_sync(self.backend.hit, *args)
+        else:
+            allowed, remaining, retry_after, reset = self.backend.hit(*args)
+        headers = {
+            "X-RateLimit-Limit": str(rule.capacity),
+            "X-RateLimit-Remaining": str(remaining),
+            "X-RateLimit-Reset": str(math.ceil(reset)),
+        }
+        if not allowed:
+            self.rejected += 1
+            RATE_LIMITED.labels(rule.prefix).inc()
+            headers["Retry-After"] = str(math.ceil(retry_after))
+            response = JSONResponse({"detail": "Rate limit exceeded"}, status_code=429, headers=headers)
+            return await response(scope, receive, send)
+
+        async def send_with_headers(message: Message):
+            if message["type"] == "http.response.start":
+                h = MutableHeaders(scope=message)
+                for k, v in headers.items():
+                    h[k] = v
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
+
+def rules_from_settings() -> List[RateRule]:
+    if settings.rate_limit_rules:
+        return [RateRule(**r) for r in settings.rate_limit_rules]
+    return [RateRule(prefix="/ingest", rate_per_min=settings.rate_limit_per_min)]
+
+def backend_from_settings():
+    if settings.rate_limit_backend == "sqlite":
+        return SqliteBackend(settings.rate_limit_sqlite_path)
+    return MemoryBackend(max_keys=settings.rate_limit_max_keys)
@@ -1,11 +1,35 @@
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.requests import Request
-from starlette.responses import Response
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 import uuid
 
-class RequestIDMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        request_id = str(uuid.uuid4())
-        response: Response = await call_next(request)
-        response.headers["X-Request-ID"] = request_id
-        return response
+from app.core.logging import request_id_ctx, request_scope_ctx
+
+def _valid(rid: str | None) -> bool:
+    return bool(rid) and len(rid) <= 128 and rid.isprintable()
+
+class RequestIDMiddleware:
+    """Pure ASGI: tags each request with an ID (the caller's X-Request-ID when sane),
+    exposes it to logging through a contextvar and echoes it in the response."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        incoming = Headers(scope=scope).get("x-request-id")
+        request_id = incoming if _valid(incoming) else str(uuid.uuid4())
+        scope.setdefault("state", {})["request_id"] = request_id
+
+        async def send_with_id(message: Message):
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message)["X-Request-ID"] = request_id
+            await send(message)
+
+        token = request_id_ctx.set(request_id)
+        scope_token = request_scope_ctx.set(scope)
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            request_scope_ctx.reset(scope_token)
+            request_id_ctx.reset(token)
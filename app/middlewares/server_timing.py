@@ -0,0 +1,45 @@
+from time import perf_counter
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from app.core.config import settings
+from app.core.instrumentation import QueryStats, normalize_sql, query_stats_ctx
+
+def server_timing(stats: QueryStats, total_s: float) -> str:
+    parts = [f'db;dur={stats.seconds * 1000:.2f};desc="{stats.count} queries"', f"app;dur={total_s * 1000:.2f}"]
+    for i, (secs, sql) in enumerate(stats.statements, 1):
+        desc = normalize_sql(sql, 100).replace('"', "'").replace("\\", "")
+        parts.append(f'sql{i};dur={secs * 1000:.2f};desc="{desc}"')
+    return ", ".join(parts)
+
+class ServerTimingMiddleware:
+    """Pure ASGI: collects the request's SQL statement count and DB time through a
+    contextvar and reports them, with the time to the first response byte, in Server-Timing.
+
+    Statements run while a streamed body is sent come after the header and are not in it.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        stats = QueryStats(scope)
+        start = perf_counter()
+        # browsers hide the header from cross-origin pages unless allowed
+        origin = Headers(scope=scope).get("origin")
+        allow_origin = origin if origin and origin in settings.cors_origins else None
+
+        async def send_with_timing(message: Message):
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", server_timing(stats, perf_counter() - start))
+                if allow_origin:
+                    headers.append("Timing-Allow-Origin", allow_origin)
+            await send(message)
+
+        token = query_stats_ctx.set(stats)
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            query_stats_ctx.reset(token)
@@ -1,4 +1,4 @@
-from sqlalchemy import String, Integer, Boolean, DateTime, ForeignKey, Float, JSON, UniqueConstraint, Index, Text
+from sqlalchemy import String, Integer, Boolean, DateTime, ForeignKey, Float, Double, JSON, UniqueConstraint, Index, Text, Table, Column
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from datetime import datetime, timezone
 from app.core.db import Base
@@ -28,6 +28,8 @@ class Site(Base):
     lat: Mapped[float | None] = mapped_column(Float, nullable=True)
     lon: Mapped[float | None] = mapped_column(Float, nullable=True)
     is_active: Mapped[bool] = mapped_column(Boolean, default=True)
+    # key of settings.retention_classes; copied onto each sensor_data row at ingest
+    retention_class: Mapped[str] = mapped_column(String(16), default="standard")
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=utcnow)
     updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=utcnow, onupdate=utcnow)
     devices: Mapped[list["SensorDevice"]] = relationship(back_populates="site")
@@ -64,10 +66,16 @@ class SensorDevice(Base):
     site: Mapped["Site"] = relationship(back_populates="devices")
 
 class SensorData(Base):
+    """On MySQL the table is partitioned by RANGE COLUMNS(retention_class, ts), one partition
+    per class and month (see services/partitions.py). The primary key there is
+    (id, retention_class, ts) and there are no foreign keys, which partitioned InnoDB
+    tables do not support; ``id`` alone is still unique.
+    """
     __tablename__ = "sensor_data"
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
-    site_id: Mapped[int] = mapped_column(ForeignKey("sites.id"), index=True)
-    device_id: Mapped[int | None] = mapped_column(ForeignKey("sensor_devices.id"), nullable=True, index=True)
+    site_id: Mapped[int] = mapped_column(Integer, index=True)
+    device_id: Mapped[int | None] = mapped_column(Integer, nullable=True, index=True)
+    retention_class: Mapped[str] = mapped_column(String(16), default="standard")
     ts: Mapped[datetime] = mapped_column(DateTime(timezone=True), index=True)
     payload: Mapped[dict | None] = mapped_column(JSON, nullable=True)
 
@@ -93,12 +101,103 @@ class SensorData(Base):
 
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=utcnow, index=True)
     ingest_source: Mapped[str | None] = mapped_column(String(32), nullable=True)
-    ingest_idempotency_key: Mapped[str | None] = mapped_column(String(64), unique=True, nullable=True)
+    # informational copy; uniqueness lives in ingest_idempotency
+    ingest_idempotency_key: Mapped[str | None] = mapped_column(String(64), nullable=True)
 
     __table_args__ = (
         Index("ix_sensor_data_site_ts_desc", "site_id", "ts"),
     )
 
+# numeric measurement columns of SensorData, in schema order
+SENSOR_FIELDS = (
+    "ph", "tss", "debit", "nh3n", "cod", "temp", "rh", "wind_speed_kmh", "wind_deg", "noise",
+    "co", "so2", "no2", "o3", "pm25", "pm10", "tvoc", "voltage", "current",
+)
+
+def _rollup_table(name: str) -> Table:
+    # one row per (site, bucket start, device); device_id 0 stands for rows without a device.
+    # For every field: <f>_sum and <f>_cnt over non-null values, <f>_min and <f>_max.
+    cols = []
+    for f in SENSOR_FIELDS:
+        cols += [
+            Column(f"{f}_sum", Double, nullable=False, default=0),
+            Column(f"{f}_cnt", Integer, nullable=False, default=0),
+            Column(f"{f}_min", Float, nullable=True),
+            Column(f"{f}_max", Float, nullable=True),
+        ]
+    return Table(
+        name, Base.metadata,
+        Column("site_id", Integer, primary_key=True),
+        Column("bucket", DateTime(timezone=True), primary_key=True),
+        Column("device_id", Integer, primary_key=True),
+        *cols,
+    )
+
+# rollups of sensor_data, maintained on insert (see services/rollups.py), keyed by bucket seconds
+ROLLUP_TABLES = {
+    60: _rollup_table("sensor_rollup_1m"),
+    3600: _rollup_table("sensor_rollup_1h"),
+    86400: _rollup_table("sensor_rollup_1d"),
+}
+
+class LatestState(Base):
+    """Newest reading per (site, device); device_id 0 stands for rows without a device.
+
+    Maintained with upsert-if-newer (see services/latest_state.py). MySQL applies
+    ON DUPLICATE KEY UPDATE assignments in column order and each sees the ones before
+    it, so data_id and ts, which the newer-than test reads, must stay the last columns.
+    """
+    __tablename__ = "latest_state"
+    site_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    device_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    ph: Mapped[float | None] = mapped_column(Float, nullable=True)
+    tss: Mapped[float | None] = mapped_column(Float, nullable=True)
+    debit: Mapped[float | None] = mapped_column(Float, nullable=True)
+    nh3n: Mapped[float | None] = mapped_column(Float, nullable=True)
+    cod: Mapped[float | None] = mapped_column(Float, nullable=True)
+    temp: Mapped[float | None] = mapped_column(Float, nullable=True)
+    rh: Mapped[float | None] = mapped_column(Float, nullable=True)
+    wind_speed_kmh: Mapped[float | None] = mapped_column(Float, nullable=True)
+    wind_deg: Mapped[float | None] = mapped_column(Float, nullable=True)
+    noise: Mapped[float | None] = mapped_column(Float, nullable=True)
+    co: Mapped[float | None] = mapped_column(Float, nullable=True)
+    so2: Mapped[float | None] = mapped_column(Float, nullable=True)
+    no2: Mapped[float | None] = mapped_column(Float, nullable=True)
+    o3: Mapped[float | None] = mapped_column(Float, nullable=True)
+    pm25: Mapped[float | None] = mapped_column(Float, nullable=True)
+    pm10: Mapped[float | None] = mapped_column(Float, nullable=True)
+    tvoc: Mapped[float | None] = mapped_column(Float, nullable=True)
+    voltage: Mapped[float | None] = mapped_column(Float, nullable=True)
+    current: Mapped[float | None] = mapped_column(Float, nullable=True)
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=utcnow)
+    data_id: Mapped[int] = mapped_column(Integer)
+    ts: Mapped[datetime] = mapped_column(DateTime(timezone=True))
+
+class ArchiveSegment(Base):
+    """One site's month of sensor_data moved to a column file under settings.archive_dir
+    (see services/archive.py). Several segments may cover a month when late rows were
+    archived afterwards.
+
+    ``state`` is "deleting" while the rows are removed from sensor_data in batches; readers
+    then take rows with id <= ``id_max`` in that month from the file only. It is "ready" once
+    sensor_data no longer holds them.
+    """
+    __tablename__ = "archive_segments"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    site_id: Mapped[int] = mapped_column(Integer)
+    month: Mapped[datetime] = mapped_column(DateTime(timezone=True))  # first day, UTC
+    ts_min: Mapped[datetime] = mapped_column(DateTime(timezone=True))
+    ts_max: Mapped[datetime] = mapped_column(DateTime(timezone=True))
+    id_max: Mapped[int] = mapped_column(Integer)
+    rows: Mapped[int] = mapped_column(Integer)
+    path: Mapped[str] = mapped_column(String(255))  # relative to settings.archive_dir
+    state: Mapped[str] = mapped_column(String(16), default="deleting")
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=utcnow)
+
+    __table_args__ = (
+        Index("ix_archive_segments_site_ts", "site_id", "ts_min", "ts_max"),
+    )
+
 class IngestLog(Base):
     __tablename__ = "ingest_logs"
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
@@ -108,6 +207,25 @@ class IngestLog(Base):
     error_msg: Mapped[str | None] = mapped_column(Text, nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=utcnow, index=True)
 
+class IngestIdempotency(Base):
+    """Idempotency keys of ingested rows; old keys are expired (see services/idempotency.py)."""
+    __tablename__ = "ingest_idempotency"
+    key: Mapped[str] = mapped_column(String(64), primary_key=True)
+    data_id: Mapped[int] = mapped_column(Integer)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=utcnow, index=True)
+
+class IngestLogMinute(Base):
+    """Successful ingests rolled up per minute, source IP and principal (see services/audit.py)."""
+    __tablename__ = "ingest_log_minutely"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    minute: Mapped[datetime] = mapped_column(DateTime(timezone=True), index=True)
+    source_ip: Mapped[str] = mapped_column(String(64), default="")
+    api_key_or_user_id: Mapped[str] = mapped_column(String(128), default="")
+    request_count: Mapped[int] = mapped_column(Integer, default=0)
+    row_count: Mapped[int] = mapped_column(Integer, default=0)
+
+    __table_args__ = (UniqueConstraint("minute", "source_ip", "api_key_or_user_id", name="uq_ingest_log_minute"),)
+
 class ApiKey(Base):
     __tablename__ = "api_keys"
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
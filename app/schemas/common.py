@@ -2,10 +2,12 @@ from pydantic import BaseModel, Field, ConfigDict
 from typing import Any, List, Optional
 
 class Page(BaseModel):
-    total: int
+    total: int | None = None  # null when the count was skipped (count=none)
     page: int = 1
     per_page: int = 50
     items: list[Any]
+    next_cursor: str | None = None
+    prev_cursor: str | None = None
 
 class Message(BaseModel):
     ok: bool = True
@@ -27,8 +27,11 @@ class IngestStateIn(BaseModel):
     current: float | None = None
     payload: dict[str, Any] | None = None
 
+class IngestBulkItem(IngestStateIn):
+    idempotency_key: str | None = Field(default=None, max_length=64)
+
 class IngestBulkIn(BaseModel):
-    bulk: list[IngestStateIn]
+    bulk: list[IngestBulkItem]
 
 class DataOut(BaseModel):
     id: int
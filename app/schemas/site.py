@@ -8,6 +8,7 @@ class SiteCreate(BaseModel):
     lat: float | None = None
     lon: float | None = None
     is_active: bool = True
+    retention_class: str = "standard"
 
 class SiteUpdate(BaseModel):
     name: str | None = None
@@ -15,6 +16,7 @@ class SiteUpdate(BaseModel):
     lat: float | None = None
     lon: float | None = None
     is_active: bool | None = None
+    retention_class: str | None = None
 
 class SiteOut(BaseModel):
     id: int
@@ -24,3 +26,4 @@ class SiteOut(BaseModel):
     lat: float | None = None
     lon: float | None = None
     is_active: bool
+    retention_class: str = "standard"
@@ -0,0 +1,355 @@
+import heapq, os
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from typing import AsyncIterator, Iterable, Iterator
+import anyio
+from sqlalchemy import select, delete, update, func, and_, not_
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.core.db import SessionLocal, named_lock
+from app.core.logging import logger
+from app.models.models import ArchiveSegment, SensorData, Site, SENSOR_FIELDS
+from app.utils.colfile import SegmentFile, write
+from app.utils.partitions import add_months, month_start
+from app.utils.time import to_utc
+
+LOCK = "sparing_sensor_data_archive"
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+# column file layout of a segment; site_id is the segment's, device_id 0 stands for NULL
+TYPES = {
+    "id": "int", "ts": "int", "device_id": "int", **{f: "float" for f in SENSOR_FIELDS},
+    "created_at": "int", "ingest_source": "json", "ingest_idempotency_key": "json", "payload": "json",
+}
+
+def enabled() -> bool:
+    return bool(settings.archive_dir)
+
+def _us(ts: datetime) -> int:
+    return (to_utc(ts) - EPOCH) // timedelta(microseconds=1)
+
+def _dt(us: int) -> datetime:
+    # naive UTC, like sensor_data.ts coming back from MySQL
+    return datetime(1970, 1, 1) + timedelta(microseconds=us)
+
+def _key(row) -> tuple[int, int]:
+    return _us(row["ts"]), row["id"]
+
+def _path(seg: ArchiveSegment) -> str:
+    return os.path.join(settings.archive_dir, seg.path)
+
+def _hot_month(site_id: int, month: datetime) -> list:
+    return [SensorData.retention_class.in_(list(settings.retention_classes)), SensorData.site_id == site_id,
+            SensorData.ts >= month, SensorData.ts < add_months(month, 1)]
+
+# --- archiver ---------------------------------------------------------------------------
+
+async def archive_month(site_id: int, month: datetime) -> int:
+    """Move one site's month of sensor_data to a segment file; returns the rows moved."""
+    data: dict[str, list] = {c: [] for c in TYPES}
+    async with SessionLocal() as db:
+        stmt = (select(*[getattr(SensorData, c) for c in TYPES]).where(*_hot_month(site_id, month))
+                .order_by(SensorData.ts, SensorData.id))
+        result = await db.stream(stmt.execution_options(yield_per=settings.export_chunk_rows))
+        async for part in result.mappings().partitions():
+            for r in part:
+                for c, values in data.items():
+                    v = r[c]
+                    if c in ("ts", "created_at"):
+                        v = _us(v)
+                    elif c == "device_id":
+                        v = v or 0
+                    values.append(v)
+        if not data["id"]:
+            return 0
+        id_max = max(data["id"])
+        rel = os.path.join(str(site_id), f"{month:%Y%m}_{id_max}.spc")
+        os.makedirs(os.path.join(settings.archive_dir, str(site_id)), exist_ok=True)
+        await anyio.to_thread.run_sync(write, os.path.join(settings.archive_dir, rel), TYPES, data, "ts",
+                                       settings.archive_group_rows)
+        seg = ArchiveSegment(site_id=site_id, month=month, ts_min=_dt(data["ts"][0]), ts_max=_dt(data["ts"][-1]),
+                             id_max=id_max, rows=len(data["id"]), path=rel, state="deleting")
+        db.add(seg)
+        await db.commit()
+    await _finish(seg)
+    return seg.rows
+
+async def _finish(seg: ArchiveSegment):
+    """Delete a segment's rows from sensor_data in throttled batches, then mark it ready."""
+    f = SegmentFile(_path(seg))
+    ids = [i for g in f.groups() for i in f.read(g, ["id"])["id"]]
+    batch = settings.archive_delete_batch
+    for i in range(0, len(ids), batch):
+        async with SessionLocal() as db:
+            await db.execute(delete(SensorData).where(SensorData.id.in_(ids[i:i + batch]), *_hot_month(seg.site_id, seg.month))
+                             .execution_options(synchronize_session=False))
+            await db.commit()
+        await anyio.sleep(settings.archive_delete_pause_s)
+    async with SessionLocal() as db:
+        await db.execute(update(ArchiveSegment).where(ArchiveSegment.id == seg.id).values(state="ready"))
+        await db.commit()
+
+async def expire(now: datetime) -> int:
+    """Remove segments of months past their site's retention (0 or unknown class keeps them)."""
+    current = month_start(now)
+    n = 0
+    async with SessionLocal() as db:
+        rows = (await db.execute(
+            select(ArchiveSegment, Site.retention_class).join(Site, Site.id == ArchiveSegment.site_id)
+            .where(ArchiveSegment.state == "ready")
+        )).all()
+        for seg, cls in rows:
+            keep = settings.retention_classes.get(cls, 0)
+            if keep > 0 and seg.month < add_months(current, -keep):
+                try:
+                    os.remove(_path(seg))
+                except FileNotFoundError:
+                    pass
+                await db.delete(seg)
+                n += 1
+        await db.commit()
+    return n
+
+async def run(now: datetime | None = None) -> dict:
+    """Archive closed months older than ARCHIVE_AFTER_DAYS, oldest first, and expire segments.
+
+    Guarded by a named lock so only one worker archives; a segment interrupted while its rows
+    were being deleted is finished first. At most ARCHIVE_MONTHS_PER_RUN segments are written.
+    """
+    out = {"segments": 0, "rows": 0, "expired": 0}
+    if not enabled():
+        return out
+    now = to_utc(now)
+    cutoff = month_start(now - timedelta(days=settings.archive_after_days))
+    async with named_lock(LOCK) as got:
+        if not got:
+            return out
+        async with SessionLocal() as db:
+            pending = (await db.execute(select(ArchiveSegment).where(ArchiveSegment.state == "deleting"))).scalars().all()
+            oldest = (await db.execute(
+                select(SensorData.site_id, func.min(SensorData.ts))
+                .where(SensorData.retention_class.in_(list(settings.retention_classes)), SensorData.ts < cutoff)
+                .group_by(SensorData.site_id)
+            )).all()
+        for seg in pending:
+            await _finish(seg)
+        budget = settings.archive_months_per_run
+        for site_id, first in sorted(oldest):
+            month = month_start(to_utc(first))
+            while month < cutoff and budget > 0:
+                n = await archive_month(site_id, month)
+                if n:
+                    logger.info("archived %d rows of site %d for %s", n, site_id, f"{month:%Y-%m}")
+                    out["segments"] += 1
+                    out["rows"] += n
+                    budget -= 1
+                month = add_months(month, 1)
+        out["expired"] = await expire(now)
+    return out
+
+# --- readers ----------------------------------------------------------------------------
+
+async def segments(db: AsyncSession, site_ids: Iterable[int] | None, date_from: datetime | None,
+                   date_to: datetime | None) -> list[ArchiveSegment]:
+    """Segments that may hold rows in the window; none when archiving is off."""
+    if not enabled():
+        return []
+    q = select(ArchiveSegment)
+    if site_ids is not None:
+        q = q.where(ArchiveSegment.site_id.in_(list(site_ids)))
+    if date_from:
+        q = q.where(ArchiveSegment.ts_max >= date_from)
+    if date_to:
+        q = q.where(ArchiveSegment.ts_min < date_to)
+    return list((await db.execute(q)).scalars().all())
+
+def hot_filters(segs: list[ArchiveSegment]) -> list:
+    """sensor_data conditions leaving out rows of segments still being deleted."""
+    return [not_(and_(*_hot_month(s.site_id, s.month), SensorData.id <= s.id_max)) for s in segs if s.state == "deleting"]
+
+def _bounds(date_from, date_to) -> tuple[int | None, int | None]:
+    return (_us(date_from) if date_from else None), (_us(date_to) if date_to else None)
+
+def _segment_rows(seg: ArchiveSegment, columns: list[str], lo: int | None, hi: int | None,
+                  device_id: int | None, desc: bool, after: tuple[int, int] | None) -> Iterator[tuple]:
+    # (sort key, row) in (ts, id) order; the key is negated when desc so heapq can merge it
+    if after is not None:
+        if desc:
+            hi = after[0] + 1 if hi is None else min(hi, after[0] + 1)
+        else:
+            lo = after[0] if lo is None else max(lo, after[0])
+    f = SegmentFile(_path(seg))
+    names = list(dict.fromkeys(["id", "ts", "device_id", *[c for c in columns if c in TYPES]]))
+    groups = f.groups(lo, hi)
+    for g in reversed(groups) if desc else groups:
+        data = f.read(g, names)
+        ts, ids, dev = data["ts"], data["id"], data["device_id"]
+        values = []
+        for c in columns:
+            if c == "site_id":
+                values.append([seg.site_id] * len(ts))
+            elif c == "ts":
+                values.append([_dt(t) for t in ts])
+            elif c == "device_id":
+                values.append([d or None for d in dev])
+            else:
+                values.append(data[c])
+        for i in range(len(ts) - 1, -1, -1) if desc else range(len(ts)):
+            t = ts[i]
+            if (lo is not None and t < lo) or (hi is not None and t >= hi):
+                continue
+            if device_id and dev[i] != device_id:
+                continue
+            if after is not None and ((t, ids[i]) >= after if desc else (t, ids[i]) <= after):
+                continue
+            key = (-t, -ids[i]) if desc else (t, ids[i])
+            yield key, {c: v[i] for c, v in zip(columns, values)}
+
+def iter_rows(segs: list[ArchiveSegment], columns: list[str], date_from: datetime | None = None,
+              date_to: datetime | None = None, device_id: int | None = None, desc: bool = False,
+              after: tuple[datetime, int] | None = None) -> Iterator[dict]:
+    """Archived rows in (ts, id) order, descending when ``desc``, strictly past ``after``.
+
+    ``columns`` names the keys of each row (key columns and fields). A file is opened only
+    once the merge reaches its time range, and read one row group at a time.
+    """
+    lo, hi = _bounds(date_from, date_to)
+    after_key = (_us(after[0]), after[1]) if after else None
+    pending = sorted(segs, key=lambda s: -_us(s.ts_max) if desc else _us(s.ts_min))
+    heap: list = []
+    n = 0
+
+    def push(it):
+        nonlocal n
+        item = next(it, None)
+        if item is not None:
+            heapq.heappush(heap, (item[0], n, item[1], it))
+            n += 1
+
+    while pending or heap:
+        while pending and (not heap or (-_us(pending[0].ts_max) if desc else _us(pending[0].ts_min)) <= heap[0][0][0]):
+            push(_segment_rows(pending.pop(0), columns, lo, hi, device_id, desc, after_key))
+        if not heap:
+            continue
+        _, _, row, it = heapq.heappop(heap)
+        yield row
+        push(it)
+
+async def read_page(segs: list[ArchiveSegment], columns: list[str], limit: int, **kw) -> list[dict]:
+    """First ``limit`` rows of ``iter_rows``, read in a worker thread."""
+    return await anyio.to_thread.run_sync(lambda: list(islice(iter_rows(segs, columns, **kw), limit)))
+
+def _count(segs: list[ArchiveSegment], date_from, date_to, device_id) -> int:
+    lo, hi = _bounds(date_from, date_to)
+    n = 0
+    for seg in segs:
+        if not device_id and (lo is None or _us(seg.ts_min) >= lo) and (hi is None or _us(seg.ts_max) < hi):
+            n += seg.rows  # whole segment in the window
+            continue
+        f = SegmentFile(_path(seg))
+        for g in f.groups(lo, hi):
+            data = f.read(g, ["ts", "device_id"])
+            n += sum(1 for t, d in zip(data["ts"], data["device_id"])
+                     if (lo is None or t >= lo) and (hi is None or t < hi) and (not device_id or d == device_id))
+    return n
+
+async def count(segs: list[ArchiveSegment], date_from: datetime | None, date_to: datetime | None,
+                device_id: int | None = None) -> int:
+    return await anyio.to_thread.run_sync(_count, segs, date_from, date_to, device_id)
+
+def _fold(segs: list[ArchiveSegment], fields: list[str], date_from, date_to, device_id, keys) -> dict:
+    lo, hi = _bounds(date_from, date_to)
+    acc: dict = {}
+    for seg in segs:
+        f = SegmentFile(_path(seg))
+        for g in f.groups(lo, hi):
+            data = f.read(g, ["ts", "device_id", *fields])
+            cols = [data[c] for c in fields]
+            for i, (t, d) in enumerate(zip(data["ts"], data["device_id"])):
+                if (lo is not None and t < lo) or (hi is not None and t >= hi) or (device_id and d != device_id):
+                    continue
+                for k in keys(t):
+                    stats = acc.get(k)
+                    if stats is None:
+                        stats = acc[k] = [[0.0, 0, None, None] for _ in fields]
+                    for s, col in zip(stats, cols):
+                        v = col[i]
+                        if v is None:
+                            continue
+                        s[0] += v
+                        s[1] += 1
+                        if s[2] is None or v < s[2]:
+                            s[2] = v
+                        if s[3] is None or v > s[3]:
+                            s[3] = v
+    return acc
+
+async def stats(segs: list[ArchiveSegment], fields: list[str], date_from: datetime | None, date_to: datetime | None,
+                keys, device_id: int | None = None) -> dict:
+    """[sum, count, min, max] per field of the archived rows in the window, grouped by
+    ``keys(ts)`` (epoch microseconds -> the group keys the row counts towards)."""
+    return await anyio.to_thread.run_sync(_fold, segs, fields, date_from, date_to, device_id, keys)
+
+def add_stats(acc: dict, more: dict):
+    """Fold the [sum, count, min, max] lists of ``more`` into ``acc``."""
+    for k, stats in more.items():
+        into = acc.get(k)
+        if into is None:
+            acc[k] = stats
+            continue
+        for s, (total, cnt, lo, hi) in zip(into, stats):
+            s[0] = (s[0] or 0) + (total or 0)
+            s[1] += cnt
+            s[2] = lo if s[2] is None else s[2] if lo is None else min(s[2], lo)
+            s[3] = hi if s[3] is None else s[3] if hi is None else max(s[3], hi)
+
+def _newest_by_device(segs: list[ArchiveSegment], columns: list[str]) -> dict:
+    best: dict[int, tuple] = {}  # device_id -> ((ts, id), segment, file, group, index)
+    for seg in segs:
+        f = SegmentFile(_path(seg))
+        for g in f.groups():
+            data = f.read(g, ["id", "ts", "device_id"])
+            for i, key in enumerate(zip(data["ts"], data["id"])):
+                d = data["device_id"][i]
+                if d not in best or key > best[d][0]:
+                    best[d] = (key, seg, f, g, i)
+    out = {}
+    for d, (_, seg, f, g, i) in best.items():
+        data = f.read(g, [c for c in columns if c in TYPES])
+        out[d or None] = {c: seg.site_id if c == "site_id" else _dt(data["ts"][i]) if c == "ts"
+                          else d or None if c == "device_id" else data[c][i] for c in columns}
+    return out
+
+async def newest_by_device(segs: list[ArchiveSegment], columns: list[str]) -> dict[int | None, dict]:
+    """Newest archived row per device (None for rows without one), by (ts, id)."""
+    return await anyio.to_thread.run_sync(_newest_by_device, segs, columns)
+
+def merge_page(hot: list, cold: list[dict], desc: bool) -> list:
+    """Merge two (ts, id)-ordered row lists."""
+    return list(heapq.merge(hot, cold, key=_key, reverse=desc))
+
+async def merge_stream(hot_parts: AsyncIterator, cold: Iterator[dict], desc: bool, chunk: int) -> AsyncIterator[list]:
+    """Interleave sensor_data partitions from a server-side cursor with archived rows,
+    yielding lists of about ``chunk`` rows."""
+    c = next(cold, None)
+    out: list = []
+    async for part in hot_parts:
+        for h in part:
+            hk = _key(h)
+            while c is not None and ((_key(c) > hk) if desc else (_key(c) < hk)):
+                out.append(c)
+                c = next(cold, None)
+                if len(out) >= chunk:
+                    yield out
+                    out = []
+            out.append(h)
+        if len(out) >= chunk:
+            yield out
+            out = []
+    while c is not None:
+        out.append(c)
+        c = next(cold, None)
+        if len(out) >= chunk:
+            yield out
+            out = []
+    if out:
+        yield out
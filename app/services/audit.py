@@ -0,0 +1,82 @@
+from datetime import datetime, timezone
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.core.db import SessionLocal, engine, upsert
+from app.core.logging import logger
+from app.models.models import IngestLog, IngestLogMinute
+
+class AuditSink:
+    """Where ingest outcomes are recorded.
+
+    ``row`` mode keeps the original behaviour: one IngestLog row per call, written in
+    the caller's transaction. ``aggregate`` mode counts successes per minute, source IP
+    and principal into ingest_log_minutely, and writes error rows in batches from a
+    background flush, so the ingest path does no audit writes of its own.
+    """
+
+    def __init__(self, mode: str = "aggregate", max_pending_errors: int = 10000):
+        self.mode = mode
+        self.max_pending_errors = max_pending_errors
+        self._counts: dict[tuple[datetime, str, str], list[int]] = {}
+        self._errors: list[dict] = []
+        self.dropped_errors = 0
+
+    def ok(self, db: AsyncSession, ip: str | None, principal: str, rows: int = 1, note: str | None = None):
+        """Record a success. In row mode the IngestLog row rides on the caller's commit."""
+        if self.mode == "row":
+            db.add(IngestLog(source_ip=ip, api_key_or_user_id=principal, status="ok", error_msg=note))
+            return
+        now = datetime.now(timezone.utc)
+        key = (now.replace(second=0, microsecond=0), ip or "", principal or "")
+        c = self._counts.get(key)
+        if c is None:
+            self._counts[key] = [1, rows]
+        else:
+            c[0] += 1
+            c[1] += rows
+
+    async def error(self, db: AsyncSession, ip: str | None, principal: str, msg: str, commit: bool = True):
+        """Record a failure. Row mode writes (and by default commits) it right away."""
+        if self.mode == "row":
+            db.add(IngestLog(source_ip=ip, api_key_or_user_id=principal, status="error", error_msg=msg))
+            if commit:
+                await db.commit()
+            return
+        if len(self._errors) >= self.max_pending_errors:
+            self.dropped_errors += 1
+            return
+        self._errors.append({
+            "source_ip": ip, "api_key_or_user_id": principal, "status": "error",
+            "error_msg": msg, "created_at": datetime.now(timezone.utc),
+        })
+
+    async def flush(self):
+        counts, self._counts = self._counts, {}
+        errors, self._errors = self._errors, []
+        if not counts and not errors:
+            return
+        rows = [{"minute": m, "source_ip": ip, "api_key_or_user_id": p, "request_count": c[0], "row_count": c[1]}
+                for (m, ip, p), c in counts.items()]
+        try:
+            async with SessionLocal() as db:
+                if rows:
+                    await db.execute(upsert(
+                        engine.dialect.name, IngestLogMinute.__table__, rows,
+                        ["minute", "source_ip", "api_key_or_user_id"],
+                        lambda new: {
+                            "request_count": IngestLogMinute.request_count + new.request_count,
+                            "row_count": IngestLogMinute.row_count + new.row_count,
+                        },
+                    ))
+                if errors:
+                    await db.execute(insert(IngestLog), errors)
+                await db.commit()
+        except Exception:
+            logger.exception("audit flush failed; %d counters and %d errors lost", len(rows), len(errors))
+
+    def stats(self) -> dict:
+        return {"mode": self.mode, "pending_counters": len(self._counts),
+                "pending_errors": len(self._errors), "dropped_errors": self.dropped_errors}
+
+audit = AuditSink(mode=settings.audit_mode, max_pending_errors=settings.audit_max_pending_errors)
@@ -0,0 +1,104 @@
+import time
+from datetime import datetime, timezone
+from sqlalchemy import select, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.core.db import SessionLocal
+from app.models.models import User, AuthTokenBlacklist
+
+class AuthCache:
+    """In-memory view of the token blacklist plus a short-TTL cache of active users.
+
+    Revocations made on this worker apply at once; revocations from other workers
+    arrive with the next sync, i.e. within ``auth_revocation_sync_s`` seconds. Users are
+    deactivated outside the API (there is no endpoint for it), so a deactivated user's
+    tokens keep working until the cached record expires after ``user_ttl_s``.
+    """
+
+    FULL_SYNC_EVERY = 10  # delta syncs between full reloads (catches late-committed rows)
+
+    def __init__(self, user_ttl_s: float = 30, max_users: int = 10000):
+        self.user_ttl_s = user_ttl_s
+        self.max_users = max_users
+        self._revoked: dict[str, float] = {}  # jti -> exp (epoch seconds)
+        self._watermark = 0  # highest blacklist id seen
+        self._syncs = 0
+        self.loaded = False
+        self._users: dict[int, tuple[float, dict]] = {}
+        self.user_hits = 0
+        self.user_misses = 0
+
+    # ---- revocations ----
+    def is_revoked(self, jti: str) -> bool | None:
+        """True/False once the blacklist is loaded, None before (caller must ask the DB)."""
+        if jti in self._revoked:
+            return True
+        return False if self.loaded else None
+
+    def revoke(self, jti: str, exp: float):
+        self._revoked[jti] = exp
+
+    async def sync(self):
+        now = datetime.now(timezone.utc)
+        full = not self.loaded or self._syncs % self.FULL_SYNC_EVERY == 0
+        stmt = select(AuthTokenBlacklist.id, AuthTokenBlacklist.jti, AuthTokenBlacklist.expires_at).where(AuthTokenBlacklist.expires_at > now)
+        if not full:
+            stmt = stmt.where(AuthTokenBlacklist.id > self._watermark)
+        async with SessionLocal() as db:
+            rows = (await db.execute(stmt)).all()
+        revoked = {} if full else self._revoked
+        for id_, jti, expires_at in rows:
+            if expires_at.tzinfo is None:
+                expires_at = expires_at.replace(tzinfo=timezone.utc)
+            revoked[jti] = expires_at.timestamp()
+            self._watermark = max(self._watermark, id_)
+        if full:
+            # keep local revocations the DB read may not have seen yet
+            for jti, exp in self._revoked.items():
+                revoked.setdefault(jti, exp)
+            self._revoked = revoked
+        self._syncs += 1
+        self.loaded = True
+
+    async def purge(self):
+        """Delete expired blacklist rows; an expired token fails signature checks anyway."""
+        now = datetime.now(timezone.utc)
+        async with SessionLocal() as db:
+            await db.execute(delete(AuthTokenBlacklist).where(AuthTokenBlacklist.expires_at < now))
+            await db.commit()
+        ts = now.timestamp()
+        self._revoked = {j: e for j, e in self._revoked.items() if e > ts}
+
+    # ---- users ----
+    async def get_user(self, db: AsyncSession, user_id: int) -> User | None:
+        """Return a fresh, detached User for an active user id.
+
+        A new instance per call keeps per-request attributes (``_role``, ``_site_uids``)
+        from leaking between requests.
+        """
+        entry = self._users.get(user_id)
+        if entry and entry[0] > time.monotonic():
+            self.user_hits += 1
+            return User(**entry[1])
+        self.user_misses += 1
+        res = await db.execute(select(User).where(User.id == user_id, User.is_active == True))
+        user = res.scalar_one_or_none()
+        if not user:
+            self._users.pop(user_id, None)
+            return None
+        if len(self._users) >= self.max_users:
+            self._users.clear()
+        self._users[user_id] = (time.monotonic() + self.user_ttl_s, {
+            "id": user.id, "name": user.name, "email": user.email, "role": user.role, "is_active": user.is_active,
+        })
+        return user
+
+    def stats(self) -> dict:
+        total = self.user_hits + self.user_misses
+        return {
+            "revoked_loaded": self.loaded, "revoked": len(self._revoked),
+            "users": len(self._users), "user_hits": self.user_hits, "user_misses": self.user_misses,
+            "user_hit_ratio": round(self.user_hits / total, 4) if total else 0.0,
+        }
+
+auth_cache = AuthCache(user_ttl_s=settings.auth_user_cache_ttl_s)
@@ -0,0 +1,114 @@
+import hashlib, time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Iterable
+from sqlalchemy import select, insert, update, delete
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.core.db import SessionLocal
+from app.models.models import IngestIdempotency
+from app.services.sensor_writer import insert_sensor_rows
+
+def item_key(batch_key: str, index: int) -> str:
+    """Per-item key derived from a batch-level Idempotency-Key (fits the 64-char column)."""
+    return hashlib.sha1(f"{batch_key}:{index}".encode()).hexdigest()
+
+class IdempotencyStore:
+    """Idempotency keys for ingest: ingest_idempotency table plus an in-process LRU.
+
+    Writes are insert-first: the key row goes in the data row's transaction and a duplicate
+    is detected by the primary key on ``key`` instead of a SELECT beforehand. Keys older than
+    ``ttl_s`` are deleted by ``expire`` so the table stays bounded.
+    """
+
+    def __init__(self, max_size: int = 50000, ttl_s: float = 72 * 3600):
+        self.max_size = max_size
+        self.ttl_s = ttl_s
+        self._lru: OrderedDict[str, tuple[float, int]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> int | None:
+        entry = self._lru.get(key)
+        if entry is None or entry[0] + self.ttl_s < time.time():
+            self.misses += 1
+            return None
+        self._lru.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def remember(self, key: str, data_id: int):
+        self._lru[key] = (time.time(), data_id)
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_size:
+            self._lru.popitem(last=False)
+
+    async def lookup_many(self, db: AsyncSession, keys: Iterable[str]) -> dict[str, int]:
+        found, missing = {}, []
+        for k in set(keys):
+            hit = self.get(k)
+            if hit is None:
+                missing.append(k)
+            else:
+                found[k] = hit
+        if missing:
+            res = await db.execute(select(IngestIdempotency.key, IngestIdempotency.data_id).where(IngestIdempotency.key.in_(missing)))
+            for k, data_id in res.all():
+                found[k] = data_id
+                self.remember(k, data_id)
+        return found
+
+    async def claim(self, db: AsyncSession, pairs: list[tuple[str, int]]):
+        """Insert key rows in the caller's transaction; raises IntegrityError on a duplicate."""
+        if pairs:
+            now = datetime.now(timezone.utc)
+            await db.execute(insert(IngestIdempotency), [{"key": k, "data_id": i, "created_at": now} for k, i in pairs])
+
+    async def insert_once(self, db: AsyncSession, key: str, row: dict) -> tuple[int, bool]:
+        """Insert ``row`` unless ``key`` was seen before; returns (id, created).
+
+        The key is claimed before the row goes in, so a retry stops at the primary key
+        without touching sensor_data, the rollups or latest_state; a claim still held by an
+        uncommitted request waits for it. A duplicate rolls the session back. A new row is
+        left for the caller to commit, and to ``remember`` once it has: a failed commit must
+        not leave the key in the LRU.
+        """
+        hit = self.get(key)
+        if hit is not None:
+            return hit, False
+        try:
+            # data_id is filled in below, inside the same transaction
+            await self.claim(db, [(key, 0)])
+        except IntegrityError:
+            await db.rollback()
+            existing = (await db.execute(select(IngestIdempotency.data_id).where(IngestIdempotency.key == key))).scalar_one_or_none()
+            if existing is None:
+                raise
+            self.remember(key, existing)
+            return existing, False
+        ids = await insert_sensor_rows(db, [row])
+        await db.execute(update(IngestIdempotency).where(IngestIdempotency.key == key).values(data_id=ids[0]))
+        return ids[0], True
+
+    async def expire(self, batch: int = 5000):
+        """Delete keys past their TTL in small batches."""
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.ttl_s)
+        async with SessionLocal() as db:
+            while True:
+                keys = (await db.execute(
+                    select(IngestIdempotency.key).where(IngestIdempotency.created_at < cutoff).limit(batch)
+                )).scalars().all()
+                if not keys:
+                    break
+                await db.execute(delete(IngestIdempotency).where(IngestIdempotency.key.in_(keys)))
+                await db.commit()
+                if len(keys) < batch:
+                    break
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"size": len(self._lru), "max_size": self.max_size, "hits": self.hits, "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0}
+
+idempotency = IdempotencyStore(max_size=settings.idempotency_cache_size, ttl_s=settings.idempotency_ttl_h * 3600)
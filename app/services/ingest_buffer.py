@@ -0,0 +1,191 @@
+import asyncio, time
+from sqlalchemy import insert
+from app.core.config import settings
+from app.core.db import SessionLocal
+from app.core.logging import logger
+from app.models.models import IngestLog
+from app.services.sensor_writer import insert_sensor_rows
+
+class BufferFull(Exception):
+    pass
+
+class IngestBuffer:
+    """Per-worker write-behind queue that merges single-row ingests into batched INSERTs.
+
+    A batch is flushed once it holds ``max_rows`` rows or its oldest row has waited
+    ``flush_ms``. When the queue holds ``max_queue`` rows, ``put`` either raises
+    BufferFull or waits for room, depending on ``block_when_full``.
+    """
+
+    def __init__(self, max_rows: int = 200, flush_ms: int = 200, max_queue: int = 10000, block_when_full: bool = False):
+        self.max_rows = max_rows
+        self.flush_ms = flush_ms
+        self.max_queue = max_queue
+        self.block_when_full = block_when_full
+        self.queue: asyncio.Queue | None = None
+        self._task: asyncio.Task | None = None
+        self._closing = False
+        # stats
+        self.flushes = 0
+        self.flushed_rows = 0
+        self.failed_rows = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+        self.last_wait_ms = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._closing
+
+    async def start(self):
+        if self._task is not None:
+            return
+        self._closing = False
+        self.queue = asyncio.Queue(maxsize=self.max_queue)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop accepting rows and flush everything still queued."""
+        if self._task is None:
+            return
+        self._closing = True
+        await self.queue.put(None)  # wake the flusher
+        await self._task
+        self._task = None
+        self._fail_leftovers()
+
+    def _fail_leftovers(self):
+        # puts blocked on a full queue can land after the flusher's last drain
+        dropped = 0
+        while not self.queue.empty():
+            item = self.queue.get_nowait()
+            if item is None:
+                continue
+            dropped += 1
+            fut = item[2]
+            if fut and not fut.done():
+                fut.set_exception(BufferFull("ingest buffer stopped"))
+        if dropped:
+            self.failed_rows += dropped
+            logger.warning("ingest buffer stopped with %d rows queued; they were not written", dropped)
+
+    async def put(self, row: dict, log: dict | None = None, wait: bool = True) -> asyncio.Future | None:
+        """Queue one sensor_data row (and its ingest log row).
+
+        Returns a future resolved with the row id after commit when ``wait`` is set.
+        """
+        if not self.running:
+            raise BufferFull("ingest buffer not running")
+        fut = asyncio.get_running_loop().create_future() if wait else None
+        item = (row, log, fut, time.monotonic())
+        if self.block_when_full:
+            await self.queue.put(item)
+            if self._task is None:
+                # stopped while this put waited for room
+                self._fail_leftovers()
+        else:
+            try:
+                self.queue.put_nowait(item)
+            except asyncio.QueueFull:
+                raise BufferFull("ingest buffer full")
+        return fut
+
+    async def _run(self):
+        done = False
+        while not done:
+            first = await self.queue.get()
+            if first is None:
+                break
+            batch = [first]
+            deadline = first[3] + self.flush_ms / 1000
+            while len(batch) < self.max_rows:
+                timeout = deadline - time.monotonic()
+                try:
+                    item = self.queue.get_nowait() if timeout <= 0 else await asyncio.wait_for(self.queue.get(), timeout)
+                except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                    break
+                if item is None:
+                    done = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+        # drain whatever is left after the stop sentinel, including puts that were
+        # blocked on a full queue and land while this drain flushes
+        while not self.queue.empty():
+            rest = []
+            while not self.queue.empty():
+                item = self.queue.get_nowait()
+                if item is not None:
+                    rest.append(item)
+            for i in range(0, len(rest), self.max_rows):
+                await self._flush(rest[i:i + self.max_rows])
+
+    async def _flush(self, batch: list):
+        started = time.monotonic()
+        self.last_wait_ms = (started - batch[0][3]) * 1000
+        rows = [b[0] for b in batch]
+        logs = [b[1] for b in batch if b[1]]
+        try:
+            async with SessionLocal() as db:
+                ids = await insert_sensor_rows(db, rows)
+                if logs:
+                    await db.execute(insert(IngestLog), logs)
+                await db.commit()
+            for (_, _, fut, _), new_id in zip(batch, ids):
+                if fut and not fut.done():
+                    fut.set_result(new_id)
+            written = len(batch)
+        except Exception:
+            logger.exception("ingest buffer flush failed (%d rows)", len(batch))
+            # isolate the bad row(s) so one failure does not sink the batch
+            written = 0
+            for item in batch:
+                written += await self._flush_one(item)
+        elapsed = (time.monotonic() - started) * 1000
+        self.flushes += 1
+        self.flushed_rows += written
+        self.last_flush_ms = elapsed
+        self.total_flush_ms += elapsed
+        self.max_flush_ms = max(self.max_flush_ms, elapsed)
+
+    async def _flush_one(self, item) -> bool:
+        """Write one row on its own; returns whether it was committed."""
+        row, log, fut, _ = item
+        try:
+            async with SessionLocal() as db:
+                ids = await insert_sensor_rows(db, [row])
+                if log:
+                    await db.execute(insert(IngestLog), [log])
+                await db.commit()
+            if fut and not fut.done():
+                fut.set_result(ids[0])
+            return True
+        except Exception as e:
+            self.failed_rows += 1
+            if fut and not fut.done():
+                fut.set_exception(e)
+            else:
+                logger.exception("ingest buffer dropped a row for site_id=%s", row.get("site_id"))
+            return False
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.running,
+            "queue_depth": self.queue.qsize() if self.queue else 0,
+            "queue_max": self.max_queue,
+            "flushes": self.flushes,
+            "flushed_rows": self.flushed_rows,
+            "failed_rows": self.failed_rows,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+            "avg_flush_ms": round(self.total_flush_ms / self.flushes, 2) if self.flushes else 0.0,
+            "max_flush_ms": round(self.max_flush_ms, 2),
+            "last_wait_ms": round(self.last_wait_ms, 2),
+        }
+
+ingest_buffer = IngestBuffer(
+    max_rows=settings.ingest_buffer_max_rows,
+    flush_ms=settings.ingest_buffer_flush_ms,
+    max_queue=settings.ingest_buffer_max_queue,
+    block_when_full=settings.ingest_buffer_when_full == "block",
+)
@@ -0,0 +1,156 @@
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from sqlalchemy import select, delete, insert, func, case, or_, and_
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.core.db import SessionLocal, on_commit, upsert
+from app.models.models import LatestState, SensorData, Site, SENSOR_FIELDS
+from app.services import archive
+from app.utils.time import to_utc
+
+COLUMNS = (*SENSOR_FIELDS, "updated_at", "data_id", "ts")  # table order, see LatestState
+
+def _state_row(row, data_id: int, now: datetime) -> dict:
+    out = {"site_id": row["site_id"], "device_id": row["device_id"] or 0}
+    for f in SENSOR_FIELDS:
+        out[f] = row[f]
+    out.update(updated_at=now, data_id=data_id, ts=row["ts"])
+    return out
+
+def _if_newer(new) -> dict:
+    t = LatestState.__table__.c
+    newer = or_(new.ts > t.ts, and_(new.ts == t.ts, new.data_id > t.data_id))
+    return {c: case((newer, getattr(new, c)), else_=t[c]) for c in COLUMNS}
+
+def newest_reading(readings: dict[int, dict]) -> dict | None:
+    return max(readings.values(), key=lambda r: (to_utc(r["ts"]), r["id"]), default=None)
+
+class LatestStateMirror:
+    """Per-worker copy of latest_state: site_id -> {device_id: reading}.
+
+    Entries live ``ttl_s`` seconds; writes on this worker drop the site's entry once they
+    commit, so other workers see a new reading within ``ttl_s``.
+    """
+
+    def __init__(self, ttl_s: float = 2, max_sites: int = 4096):
+        self.ttl_s = ttl_s
+        self.max_sites = max_sites
+        self._items: OrderedDict[int, tuple[float, dict[int, dict]]] = OrderedDict()
+        self._generation = 0  # bumped by invalidate
+        self.hits = 0
+        self.misses = 0
+
+    def _put(self, site_id: int, readings: dict[int, dict]):
+        self._items[site_id] = (time.monotonic() + self.ttl_s, readings)
+        self._items.move_to_end(site_id)
+        while len(self._items) > self.max_sites:
+            self._items.popitem(last=False)
+
+    async def get_many(self, db: AsyncSession, site_ids) -> dict[int, dict[int, dict]]:
+        """Readings per site for ``site_ids``; all misses are loaded with one query."""
+        out, missing = {}, []
+        now = time.monotonic()
+        for sid in site_ids:
+            entry = self._items.get(sid)
+            if entry is not None and entry[0] > now:
+                self._items.move_to_end(sid)
+                out[sid] = entry[1]
+            else:
+                missing.append(sid)
+        self.hits += len(out)
+        self.misses += len(missing)
+        if missing:
+            generation = self._generation
+            loaded = {sid: {} for sid in missing}
+            res = await db.execute(select(LatestState).where(LatestState.site_id.in_(missing)))
+            for s in res.scalars():
+                loaded[s.site_id][s.device_id] = {
+                    "id": s.data_id, "ts": s.ts, "site_id": s.site_id, "device_id": s.device_id or None,
+                    **{f: getattr(s, f) for f in SENSOR_FIELDS},
+                }
+            if generation == self._generation:
+                # else a commit landed while loading and these readings may predate it
+                for sid, readings in loaded.items():
+                    self._put(sid, readings)
+            out.update(loaded)
+        return out
+
+    async def get(self, db: AsyncSession, site_id: int) -> dict[int, dict]:
+        return (await self.get_many(db, [site_id]))[site_id]
+
+    async def newest(self, db: AsyncSession, site_id: int, device_id: int | None = None) -> dict | None:
+        readings = await self.get(db, site_id)
+        if device_id is not None:
+            return readings.get(device_id)
+        return newest_reading(readings)
+
+    def invalidate(self, site_id: int | None = None):
+        self._generation += 1
+        if site_id is None:
+            self._items.clear()
+        else:
+            self._items.pop(site_id, None)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"size": len(self._items), "max_sites": self.max_sites, "ttl_s": self.ttl_s,
+                "hits": self.hits, "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0}
+
+latest_readings = LatestStateMirror(ttl_s=settings.latest_state_ttl_s, max_sites=settings.site_cache_size)
+
+async def apply(db: AsyncSession, rows: list[dict], ids: list[int]):
+    """Upsert the newest of ``rows`` per (site, device) unless latest_state already has a newer one.
+
+    The sites' mirror entries are dropped when the caller commits.
+    """
+    now = datetime.now(timezone.utc)
+    newest: dict[tuple[int, int], tuple] = {}
+    for row, data_id in zip(rows, ids):
+        key = (row["site_id"], row["device_id"] or 0)
+        rank = (to_utc(row["ts"]), data_id)
+        if key not in newest or rank > newest[key][0]:
+            newest[key] = (rank, row, data_id)
+    if not newest:
+        return
+    states = [_state_row(row, data_id, now) for _, (_, row, data_id) in sorted(newest.items())]
+    await db.execute(upsert(db.bind.dialect.name, LatestState.__table__, states, ["site_id", "device_id"], _if_newer))
+    def drop():
+        for site_id in {site_id for site_id, _ in newest}:
+            latest_readings.invalidate(site_id)
+    on_commit(db, drop)
+
+async def rebuild(site_id: int | None = None) -> int:
+    """Recompute latest_state from sensor_data and archived segments, one site per transaction.
+
+    Needed after deleting rows or writing around the application; older backfilled rows
+    never displace a newer reading, so plain backfills do not need it.
+    """
+    cols = [SensorData.id, SensorData.site_id, SensorData.device_id, SensorData.ts] + [getattr(SensorData, f) for f in SENSOR_FIELDS]
+    n = 0
+    async with SessionLocal() as db:
+        site_ids = [site_id] if site_id is not None else (await db.execute(select(Site.id))).scalars().all()
+        for sid in site_ids:
+            now = datetime.now(timezone.utc)
+            segs = await archive.segments(db, [sid], None, None)
+            newest = await archive.newest_by_device(segs, [c.key for c in cols]) if segs else {}
+            per_device = await db.execute(
+                select(SensorData.device_id, func.max(SensorData.ts)).where(SensorData.site_id == sid).group_by(SensorData.device_id)
+            )
+            for device_id, ts in per_device.all():
+                dev = SensorData.device_id.is_(None) if device_id is None else SensorData.device_id == device_id
+                row = (await db.execute(
+                    select(*cols).where(SensorData.site_id == sid, dev, SensorData.ts == ts).order_by(SensorData.id.desc()).limit(1)
+                )).mappings().one()
+                cold = newest.get(device_id)
+                if cold is None or (to_utc(row["ts"]), row["id"]) > (to_utc(cold["ts"]), cold["id"]):
+                    newest[device_id] = row
+            states = [_state_row(row, row["id"], now) for _, row in sorted(newest.items(), key=lambda kv: kv[0] or 0)]
+            await db.execute(delete(LatestState).where(LatestState.site_id == sid))
+            if states:
+                await db.execute(insert(LatestState), states)
+            await db.commit()
+            latest_readings.invalidate(sid)
+            n += len(states)
+    return n
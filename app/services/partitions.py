@@ -0,0 +1,33 @@
+from datetime import datetime, timezone
+from sqlalchemy import text
+from app.core.config import settings
+from app.core.db import engine, named_lock
+from app.core.logging import logger
+from app.utils.partitions import partition_ddl
+
+LOCK = "sparing_sensor_data_partitions"
+
+async def maintain() -> list[str]:
+    """Create the coming months' partitions and drop the expired ones (MySQL only).
+
+    Guarded by a named lock so only one worker runs the DDL. Returns the statements run.
+    """
+    if engine.dialect.name != "mysql":
+        return []
+    async with named_lock(LOCK) as got:
+        if not got:
+            return []
+        async with engine.connect() as conn:
+            existing = (await conn.execute(text(
+                "SELECT PARTITION_NAME, PARTITION_DESCRIPTION FROM information_schema.PARTITIONS "
+                "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'sensor_data' ORDER BY PARTITION_ORDINAL_POSITION"
+            ))).all()
+            if not existing or existing[0][0] is None:
+                logger.warning("sensor_data is not partitioned; run the alembic migrations")
+                return []
+            stmts = partition_ddl([tuple(r) for r in existing], settings.retention_classes,
+                                  datetime.now(timezone.utc), settings.partition_months_ahead)
+            for stmt in stmts:
+                logger.info("partition maintenance: %s", stmt.replace("\n", " "))
+                await conn.exec_driver_sql(stmt)
+            return stmts
@@ -0,0 +1,113 @@
+import hashlib, time
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Awaitable, Callable, Iterable, NamedTuple
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response
+from starlette.requests import Request
+from app.core.config import settings
+from app.core.db import engine, read_engine, reads_pinned
+
+class CachedResponse(NamedTuple):
+    expires: float
+    versions: tuple[tuple[str, int], ...]
+    body: bytes
+    etag: str
+    last_modified: str
+    modified_at: float
+
+class ResponseCache:
+    """Per-worker cache of JSON GET responses with ETag / Last-Modified revalidation.
+
+    Entries are keyed by route name, path, query string and viewer scope and expire after the
+    route's TTL. Each entry carries tags (``site:<id>``, ``sites``, ``devices``, ``fleet``);
+    ``invalidate`` bumps a tag's version so every entry built under the old version is
+    stale at once. Writes on other workers are only seen once the TTL runs out.
+
+    Requests whose reads are pinned to the primary bypass the cache. With a read ``replica``,
+    entries built within DB_READ_STICKY_S of an invalidation of one of their tags are not
+    stored: the replica may not have the write yet.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttls: dict[str, float] | None = None, enabled: bool = True,
+                 replica: bool = False):
+        self.max_entries = max_entries
+        self.ttls = ttls or {}
+        self.enabled = enabled
+        self.replica = replica
+        self._items: OrderedDict[tuple, CachedResponse] = OrderedDict()
+        self._versions: dict[str, int] = {}
+        self._bumped: dict[str, float] = {}  # tag -> monotonic time of its last invalidation
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def invalidate(self, *tags: str):
+        now = time.monotonic()
+        for t in tags:
+            self._versions[t] = self._versions.get(t, 0) + 1
+            self._bumped[t] = now
+
+    def _fresh(self, entry: CachedResponse) -> bool:
+        return entry.expires > time.monotonic() and all(self._versions.get(t, 0) == v for t, v in entry.versions)
+
+    async def serve(self, request: Request, route: str, tags: Iterable[str], viewer_uids: list[str],
+                    build: Callable[[], Awaitable]) -> Response:
+        """Answer from the cache, or run ``build`` and cache its JSON-encoded result."""
+        tags = list(tags)
+        scope = ",".join(sorted(viewer_uids)) if viewer_uids else "*"
+        key = (route, request.url.path, tuple(sorted(request.query_params.multi_items())), scope)
+        use = self.enabled and not reads_pinned(request)
+        entry = self._items.get(key) if use else None
+        if entry is not None and self._fresh(entry):
+            self._items.move_to_end(key)
+            self.hits += 1
+        else:
+            self.misses += 1
+            # versions taken before the read, so a write during build() leaves the entry stale
+            versions = tuple((t, self._versions.get(t, 0)) for t in tags)
+            body = JSONResponse(jsonable_encoder(await build())).body
+            now = time.time()
+            entry = CachedResponse(
+                expires=time.monotonic() + self.ttls.get(route, 0), versions=versions, body=body,
+                etag='"' + hashlib.sha1(body).hexdigest() + '"',
+                last_modified=formatdate(now, usegmt=True), modified_at=now,
+            )
+            if use and self.ttls.get(route, 0) > 0 and not self._lagging(tags):
+                self._items[key] = entry
+                self._items.move_to_end(key)
+                while len(self._items) > self.max_entries:
+                    self._items.popitem(last=False)
+        headers = {"ETag": entry.etag, "Last-Modified": entry.last_modified, "Cache-Control": "private, no-cache"}
+        if _not_modified(request, entry):
+            self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+        return Response(entry.body, media_type="application/json", headers=headers)
+
+    def _lagging(self, tags: Iterable[str]) -> bool:
+        if not self.replica:
+            return False
+        now = time.monotonic()
+        return any(now - self._bumped.get(t, float("-inf")) < settings.db_read_sticky_s for t in tags)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"enabled": self.enabled, "size": len(self._items), "max_entries": self.max_entries,
+                "hits": self.hits, "misses": self.misses, "not_modified": self.not_modified,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0}
+
+def _not_modified(request: Request, entry: CachedResponse) -> bool:
+    inm = request.headers.get("if-none-match")
+    if inm is not None:
+        tags = [t.strip().removeprefix("W/") for t in inm.split(",")]
+        return "*" in tags or entry.etag in tags
+    ims = request.headers.get("if-modified-since")
+    if ims:
+        try:
+            return int(entry.modified_at) <= parsedate_to_datetime(ims).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+response_cache = ResponseCache(max_entries=settings.response_cache_size, ttls=settings.response_cache_ttl_s,
+                               enabled=settings.response_cache_enabled, replica=read_engine is not engine)
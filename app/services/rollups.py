@@ -0,0 +1,223 @@
+from datetime import datetime, timedelta
+from itertools import islice
+import anyio
+from sqlalchemy import select, delete, func, literal, union_all
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.core.db import SessionLocal, upsert
+from app.core.logging import logger
+from app.models.models import SensorData, SENSOR_FIELDS, ROLLUP_TABLES
+from app.services import archive
+from app.utils.buckets import bucket_expr, floor_ts, tz_offset_s
+from app.utils.time import to_utc
+
+RESOLUTIONS = sorted(ROLLUP_TABLES, reverse=True)  # coarse to fine: 1d, 1h, 1m
+KEYS = ["site_id", "bucket", "device_id"]
+
+def _bucket(ts: datetime, seconds: int) -> datetime:
+    # buckets follow settings.tz so 1d rows are local days
+    return floor_ts(ts, seconds, tz_offset_s(settings.tz, ts))
+
+def accumulate(rows, acc: dict | None = None) -> dict:
+    """Fold sensor rows (mappings with site_id, device_id, ts and fields) into per-bucket
+    [sum, cnt, min, max] lists, keyed by (resolution, site_id, bucket, device_id)."""
+    acc = {} if acc is None else acc
+    for r in rows:
+        ts = to_utc(r["ts"])
+        offset = tz_offset_s(settings.tz, ts)
+        device_id = r["device_id"] or 0
+        for secs in RESOLUTIONS:
+            key = (secs, r["site_id"], floor_ts(ts, secs, offset), device_id)
+            stats = acc.get(key)
+            if stats is None:
+                stats = acc[key] = [[0.0, 0, None, None] for _ in SENSOR_FIELDS]
+            for s, f in zip(stats, SENSOR_FIELDS):
+                v = r[f]
+                if v is None:
+                    continue
+                s[0] += v
+                s[1] += 1
+                if s[2] is None or v < s[2]:
+                    s[2] = v
+                if s[3] is None or v > s[3]:
+                    s[3] = v
+    return acc
+
+def _merge(table, dialect: str):
+    least, greatest = (func.min, func.max) if dialect == "sqlite" else (func.least, func.greatest)
+
+    def set_(new):
+        out = {}
+        for f in SENSOR_FIELDS:
+            lo, hi = table.c[f"{f}_min"], table.c[f"{f}_max"]
+            nlo, nhi = getattr(new, f"{f}_min"), getattr(new, f"{f}_max")
+            out[f"{f}_sum"] = table.c[f"{f}_sum"] + getattr(new, f"{f}_sum")
+            out[f"{f}_cnt"] = table.c[f"{f}_cnt"] + getattr(new, f"{f}_cnt")
+            out[f"{f}_min"] = least(func.coalesce(lo, nlo), func.coalesce(nlo, lo))
+            out[f"{f}_max"] = greatest(func.coalesce(hi, nhi), func.coalesce(nhi, hi))
+        return out
+    return set_
+
+async def write(db: AsyncSession, acc: dict):
+    """Add accumulated stats to the rollup tables in the caller's transaction."""
+    dialect = db.bind.dialect.name
+    by_table: dict[int, list[dict]] = {}
+    # fixed key order keeps concurrent upserts from locking rows in opposite orders
+    for key in sorted(acc):
+        secs, site_id, bucket, device_id = key
+        row = {"site_id": site_id, "bucket": bucket, "device_id": device_id}
+        for (total, cnt, lo, hi), f in zip(acc[key], SENSOR_FIELDS):
+            row[f"{f}_sum"], row[f"{f}_cnt"], row[f"{f}_min"], row[f"{f}_max"] = total, cnt, lo, hi
+        by_table.setdefault(secs, []).append(row)
+    for secs, rows in by_table.items():
+        table = ROLLUP_TABLES[secs]
+        await db.execute(upsert(dialect, table, rows, KEYS, _merge(table, dialect)))
+
+async def apply(db: AsyncSession, rows: list[dict]):
+    """Roll freshly inserted sensor rows up; runs in the same transaction as the INSERT."""
+    await write(db, accumulate(rows))
+
+def _accumulate_archived(segs: list, date_from: datetime, date_to: datetime, acc: dict, batch: int) -> int:
+    rows = archive.iter_rows(segs, ["site_id", "device_id", "ts", *SENSOR_FIELDS], date_from, date_to)
+    n = 0
+    while part := list(islice(rows, batch)):
+        accumulate(part, acc)
+        n += len(part)
+    return n
+
+async def rebuild(date_from: datetime, date_to: datetime, site_id: int | None = None, batch: int = 5000) -> int:
+    """Recompute rollups from raw rows, one local day per transaction.
+
+    For backfills and rows written around the application. The range is widened to whole
+    local days; archived months are read from their segment files. Rows ingested into a day
+    while it is being rebuilt may be missed; rebuild past days, or run it again afterwards.
+    Returns the number of raw rows read.
+    """
+    day = _bucket(to_utc(date_from), 86400)
+    end = to_utc(date_to)
+    cols = [SensorData.site_id, SensorData.device_id, SensorData.ts] + [getattr(SensorData, f) for f in SENSOR_FIELDS]
+    total = 0
+    while day < end:
+        nxt = _bucket(day + timedelta(hours=36), 86400)  # next local midnight, DST-safe
+        async with SessionLocal() as db:
+            for table in ROLLUP_TABLES.values():
+                stmt = delete(table).where(table.c.bucket >= day, table.c.bucket < nxt)
+                if site_id is not None:
+                    stmt = stmt.where(table.c.site_id == site_id)
+                await db.execute(stmt)
+            segs = await archive.segments(db, None if site_id is None else [site_id], day, nxt)
+            q = select(*cols).where(SensorData.retention_class.in_(list(settings.retention_classes)),
+                                    SensorData.ts >= day, SensorData.ts < nxt, *archive.hot_filters(segs))
+            if site_id is not None:
+                q = q.where(SensorData.site_id == site_id)
+            acc: dict = {}
+            result = await db.stream(q.execution_options(yield_per=batch))
+            async for part in result.mappings().partitions():
+                accumulate(part, acc)
+                total += len(part)
+            if segs:
+                total += await anyio.to_thread.run_sync(_accumulate_archived, segs, day, nxt, acc, batch)
+            await write(db, acc)
+            await db.commit()
+        logger.info("rollups rebuilt for the day starting %s", day.isoformat())
+        day = nxt
+    return total
+
+def plan(start: datetime, end: datetime) -> list[tuple[int, datetime, datetime]]:
+    """Cover [start, end) with the coarsest rollup buckets that fit, finest at the edges.
+
+    The 1m level is the floor, so the edges are exact to the minute.
+    """
+    def split(a: datetime, b: datetime, levels: list[int]):
+        secs = levels[0]
+        if len(levels) == 1:
+            return [(secs, _bucket(a, secs), b)] if a < b else []
+        lo = _bucket(a, secs)
+        if lo < a:
+            lo = _bucket(lo + timedelta(seconds=secs * 1.5), secs)
+        hi = _bucket(b, secs)
+        if lo >= hi:
+            return split(a, b, levels[1:])
+        return split(a, lo, levels[1:]) + [(secs, lo, hi)] + split(hi, b, levels[1:])
+    return split(to_utc(start), to_utc(end), RESOLUTIONS)
+
+def _site_filters(table, site_id: int, device_id: int | None, a: datetime, b: datetime) -> list:
+    conds = [table.c.site_id == site_id, table.c.bucket >= a, table.c.bucket < b]
+    if device_id:
+        conds.append(table.c.device_id == device_id)
+    return conds
+
+def _empty(fields) -> dict:
+    return {f: {"avg": None, "min": None, "max": None, "count": 0} for f in fields}
+
+async def stats_by_window(db: AsyncSession, site_ids, fields, windows: dict[str, tuple[datetime, datetime]],
+                          device_id: int | None = None) -> dict[tuple[int, str], dict]:
+    """avg/min/max/count per (site, window) and field in one query, from rollups only.
+
+    ``windows`` maps a name to a [start, end) range; each becomes a few UNION ALL branches
+    over the rollup levels picked by ``plan``.
+    """
+    site_ids = list(site_ids)
+    out = {(sid, w): _empty(fields) for sid in site_ids for w in windows}
+    parts = []
+    for name, (start, end) in windows.items():
+        for secs, a, b in plan(start, end):
+            t = ROLLUP_TABLES[secs]
+            cols = [t.c.site_id, literal(name).label("w")]
+            for f in fields:
+                cols += [t.c[f"{f}_sum"], t.c[f"{f}_cnt"], t.c[f"{f}_min"], t.c[f"{f}_max"]]
+            conds = [t.c.site_id.in_(site_ids), t.c.bucket >= a, t.c.bucket < b]
+            if device_id:
+                conds.append(t.c.device_id == device_id)
+            parts.append(select(*cols).where(*conds))
+    if not parts or not site_ids:
+        return out
+    u = union_all(*parts).subquery()
+    aggs = []
+    for f in fields:
+        aggs += [func.sum(u.c[f"{f}_sum"]), func.sum(u.c[f"{f}_cnt"]), func.min(u.c[f"{f}_min"]), func.max(u.c[f"{f}_max"])]
+    for row in (await db.execute(select(u.c.site_id, u.c.w, *aggs).group_by(u.c.site_id, u.c.w))).all():
+        stats = out[(row[0], row[1])]
+        for i, f in enumerate(fields):
+            total, cnt, lo, hi = row[2 + i * 4:6 + i * 4]
+            cnt = int(cnt or 0)
+            stats[f] = {"avg": float(total) / cnt if cnt else None, "min": lo, "max": hi, "count": cnt}
+    return out
+
+async def window_stats_many(db: AsyncSession, site_ids, fields, start: datetime, end: datetime,
+                            device_id: int | None = None) -> dict[int, dict]:
+    """avg/min/max/count per site and field over [start, end), from rollups only."""
+    res = await stats_by_window(db, site_ids, fields, {"w": (start, end)}, device_id)
+    return {sid: stats for (sid, _), stats in res.items()}
+
+async def window_stats(db: AsyncSession, site_id: int, fields, start: datetime, end: datetime,
+                       device_id: int | None = None) -> dict:
+    """avg/min/max/count per field over [start, end), from rollups only."""
+    return (await window_stats_many(db, [site_id], fields, start, end, device_id))[site_id]
+
+def series_source(seconds: int, offset_s: int, at: datetime) -> int | None:
+    """Coarsest rollup resolution whose buckets nest in ``seconds`` buckets aligned at
+    ``offset_s``; None when none does (e.g. UTC days over a half-hour zone)."""
+    local = tz_offset_s(settings.tz, at)
+    for secs in RESOLUTIONS:
+        if seconds % secs == 0 and (offset_s - local) % secs == 0:
+            return secs
+    return None
+
+async def series(db: AsyncSession, source: int, site_id: int, fields, aggs, start: datetime, end: datetime,
+                 seconds: int, offset_s: int, device_id: int | None = None) -> list[tuple]:
+    """Rows of (bucket epoch, value per field/agg) regrouped from the ``source`` rollup."""
+    t = ROLLUP_TABLES[source]
+    b = bucket_expr(t.c.bucket, seconds, offset_s, db.bind.dialect.name).label("b")
+    cols = []
+    for f in fields:
+        for a in aggs:
+            if a == "avg":
+                cols.append(func.sum(t.c[f"{f}_sum"]) / func.nullif(func.sum(t.c[f"{f}_cnt"]), 0))
+            elif a == "count":
+                cols.append(func.sum(t.c[f"{f}_cnt"]))
+            else:
+                cols.append(getattr(func, a)(t.c[f"{f}_{a}"]))
+    start = _bucket(to_utc(start), source)
+    stmt = select(b, *cols).where(*_site_filters(t, site_id, device_id, start, to_utc(end))).group_by(b).order_by(b)
+    return (await db.execute(stmt)).all()
@@ -0,0 +1,73 @@
+from datetime import datetime, timezone
+from sqlalchemy import insert, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.core.db import on_commit
+from app.core.instrumentation import count_ingested
+from app.core.logging import logger
+from app.models.models import SensorData, SENSOR_FIELDS
+from app.services import latest_state, rollups
+from app.services.response_cache import response_cache
+from app.services.site_cache import SiteRef
+from app.utils.time import to_utc
+
+def sensor_row(site: SiteRef, body, source: str, idempotency_key: str | None = None, created_at: datetime | None = None) -> dict:
+    # every row carries the same keys so a batch fits one multi-row INSERT
+    row = {
+        "site_id": site.id,
+        "retention_class": site.retention_class,
+        "device_id": body.device_id,
+        "ts": to_utc(body.ts),
+        "payload": body.payload,
+        "created_at": created_at or datetime.now(timezone.utc),
+        "ingest_source": source,
+        "ingest_idempotency_key": idempotency_key,
+    }
+    for f in SENSOR_FIELDS:
+        row[f] = getattr(body, f)
+    return row
+
+_warned_lock_mode = False
+
+async def _autoinc(db: AsyncSession) -> tuple[int, int]:
+    """(@@auto_increment_increment, @@innodb_autoinc_lock_mode) of the session's connection, read once per connection."""
+    global _warned_lock_mode
+    conn = await db.connection()
+    got = conn.info.get("autoinc")
+    if got is None:
+        step, mode = (await conn.execute(text("SELECT @@auto_increment_increment, @@innodb_autoinc_lock_mode"))).one()
+        if int(mode) == 2 and not _warned_lock_mode:
+            _warned_lock_mode = True
+            logger.warning("innodb_autoinc_lock_mode=2: sensor rows are inserted one at a time; set it to 1 for multi-row inserts")
+        conn.info["autoinc"] = got = (int(step), int(mode))
+    return got
+
+async def insert_sensor_rows(db: AsyncSession, rows: list[dict]) -> list[int]:
+    """Insert rows with a single multi-row INSERT and return their ids in order.
+
+    Also folds the rows into the rollup tables and latest_state. Does not commit; the
+    ingest counter and the response cache move when the caller does.
+    MySQL has no RETURNING, so the ids follow from lastrowid: with
+    innodb_autoinc_lock_mode 0 or 1 InnoDB gives a multi-row INSERT one block of ids,
+    spaced by auto_increment_increment. Mode 2 (MySQL 8's default) does not promise
+    that, so there every row gets its own INSERT and its own lastrowid.
+    """
+    if not rows:
+        return []
+    dialect = db.bind.dialect.name
+    step, mode = await _autoinc(db) if dialect == "mysql" else (1, 1)
+    if mode == 2:
+        ids = [(await db.execute(insert(SensorData).values(r))).lastrowid for r in rows]
+    else:
+        first = (await db.execute(insert(SensorData).values(rows))).lastrowid
+        if dialect == "sqlite":
+            # sqlite reports the id of the last row instead of the first
+            first = first - len(rows) + 1
+        ids = list(range(first, first + len(rows) * step, step))
+    if settings.rollups_enabled:
+        await rollups.apply(db, rows)
+    on_commit(db, lambda: count_ingested(rows))
+    await latest_state.apply(db, rows, ids)
+    tags = ("fleet", *{f"site:{r['site_id']}" for r in rows})
+    on_commit(db, lambda: response_cache.invalidate(*tags))
+    return ids
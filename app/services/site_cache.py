@@ -0,0 +1,93 @@
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Iterable
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.models.models import Site
+
+class SiteRef(NamedTuple):
+    id: int
+    uid: str
+    is_active: bool
+    retention_class: str
+
+SITE_REF_COLUMNS = (Site.id, Site.uid, Site.is_active, Site.retention_class)
+
+class SiteRegistry:
+    """Bounded, TTL-limited uid -> SiteRef cache shared by all routers.
+
+    Unknown uids are not cached, so a site created on another worker is seen on the
+    next lookup. Site updates/deletes on this worker invalidate explicitly; other
+    workers pick them up within ``ttl_s``.
+    """
+
+    def __init__(self, max_size: int = 4096, ttl_s: float = 60):
+        self.max_size = max_size
+        self.ttl_s = ttl_s
+        self._items: OrderedDict[str, tuple[float, SiteRef]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, uid: str) -> SiteRef | None:
+        entry = self._items.get(uid)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self._items[uid]
+            return None
+        self._items.move_to_end(uid)
+        return entry[1]
+
+    def _put(self, ref: SiteRef):
+        self._items[ref.uid] = (time.monotonic() + self.ttl_s, ref)
+        self._items.move_to_end(ref.uid)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    async def resolve(self, db: AsyncSession, uid: str) -> SiteRef | None:
+        ref = self._get(uid)
+        if ref is not None:
+            self.hits += 1
+            return ref
+        self.misses += 1
+        row = (await db.execute(select(*SITE_REF_COLUMNS).where(Site.uid == uid))).one_or_none()
+        if row is None:
+            return None
+        ref = SiteRef(*row)
+        self._put(ref)
+        return ref
+
+    async def resolve_many(self, db: AsyncSession, uids: Iterable[str]) -> dict[str, SiteRef]:
+        found, missing = {}, []
+        for uid in set(uids):
+            ref = self._get(uid)
+            if ref is None:
+                missing.append(uid)
+            else:
+                found[uid] = ref
+        self.hits += len(found)
+        self.misses += len(missing)
+        if missing:
+            res = await db.execute(select(*SITE_REF_COLUMNS).where(Site.uid.in_(missing)))
+            for row in res.all():
+                ref = SiteRef(*row)
+                self._put(ref)
+                found[ref.uid] = ref
+        return found
+
+    def invalidate(self, uid: str | None = None):
+        if uid is None:
+            self._items.clear()
+        else:
+            self._items.pop(uid, None)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._items), "max_size": self.max_size, "ttl_s": self.ttl_s,
+            "hits": self.hits, "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+        }
+
+site_registry = SiteRegistry(max_size=settings.site_cache_size, ttl_s=settings.site_cache_ttl_s)
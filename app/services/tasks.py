@@ -0,0 +1,33 @@
+import asyncio
+from typing import Awaitable, Callable
+from app.core.logging import logger
+
+class PeriodicTasks:
+    """Runs async jobs on a fixed interval for the lifetime of a worker."""
+
+    def __init__(self):
+        self._tasks: list[asyncio.Task] = []
+
+    def every(self, interval_s: float, fn: Callable[[], Awaitable], name: str | None = None, at_start: bool = False):
+        """Run ``fn`` every ``interval_s``; first right away when ``at_start``, else after one interval."""
+        self._tasks.append(asyncio.create_task(self._loop(interval_s, fn, name or fn.__qualname__, at_start)))
+
+    async def _loop(self, interval_s: float, fn, name: str, at_start: bool = False):
+        while True:
+            if not at_start:
+                await asyncio.sleep(interval_s)
+            at_start = False
+            try:
+                await fn()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("periodic task %s failed", name)
+
+    async def stop(self):
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+periodic = PeriodicTasks()
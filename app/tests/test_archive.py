@@ -0,0 +1,51 @@
+import os
+from datetime import datetime, timedelta
+from app.core.config import settings
+from app.models.models import ArchiveSegment, SENSOR_FIELDS
+from app.services import archive
+from app.utils.colfile import SegmentFile, write
+
+def test_colfile_roundtrip_and_group_pruning(tmp_path):
+    path = str(tmp_path / "seg.spc")
+    cols = {"ts": [10, 20, 30, 40, 50], "v": [1.5, None, 3.0, None, 5.0], "j": ["a", None, {"k": 1}, [], "e"]}
+    header = write(path, {"ts": "int", "v": "float", "j": "json"}, cols, "ts", group_rows=2)
+    assert header["rows"] == 5 and len(header["groups"]) == 3
+    f = SegmentFile(path)
+    assert f.groups(25, 45) == [1]
+    got = {k: [] for k in cols}
+    for g in f.groups():
+        for k, v in f.read(g, cols).items():
+            got[k] += v
+    assert got == cols
+
+def _segment(tmp_path, site_id: int, start: datetime, ids: list[int]) -> ArchiveSegment:
+    ts = [archive._us(start + timedelta(minutes=i)) for i in range(len(ids))]
+    data = {c: [0] * len(ids) for c in archive.TYPES}
+    data.update(id=ids, ts=ts, **{f: [float(i) for i in ids] for f in SENSOR_FIELDS})
+    rel = f"{site_id}_{ids[-1]}.spc"
+    write(os.path.join(str(tmp_path), rel), archive.TYPES, data, "ts", group_rows=3)
+    return ArchiveSegment(site_id=site_id, ts_min=archive._dt(ts[0]), ts_max=archive._dt(ts[-1]),
+                          rows=len(ids), path=rel, state="ready")
+
+def test_iter_rows_merges_segments_in_order(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "archive_dir", str(tmp_path))
+    start = datetime(2026, 1, 1)
+    segs = [_segment(tmp_path, 1, start, [1, 3, 5, 7]), _segment(tmp_path, 2, start + timedelta(seconds=30), [2, 4, 6, 8])]
+    asc = [r["id"] for r in archive.iter_rows(segs, ["id", "site_id", "ts", "ph"])]
+    assert asc == [1, 2, 3, 4, 5, 6, 7, 8]
+    desc = list(archive.iter_rows(segs, ["id", "ts"], desc=True, after=(start + timedelta(minutes=2), 5)))
+    assert [r["id"] for r in desc] == [4, 3, 2, 1]
+    window = archive.iter_rows(segs, ["id"], date_from=start + timedelta(minutes=1), date_to=start + timedelta(minutes=2))
+    assert [r["id"] for r in window] == [3, 4]
+
+def test_stats_and_newest_by_device(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "archive_dir", str(tmp_path))
+    start = datetime(2026, 1, 1)
+    segs = [_segment(tmp_path, 1, start, [1, 2, 3, 4, 5])]
+    hourly = lambda t: (t // 3_600_000_000,)
+    acc = {}
+    archive.add_stats(acc, archive._fold(segs, ["ph"], None, None, None, hourly))
+    archive.add_stats(acc, {hourly(archive._us(start))[0]: [[10.0, 1, 10.0, 10.0]]})
+    assert list(acc.values()) == [[[25.0, 6, 1.0, 10.0]]]
+    newest = archive._newest_by_device(segs, ["id", "site_id", "device_id", "ts", "ph"])
+    assert newest == {None: {"id": 5, "site_id": 1, "device_id": None, "ts": start + timedelta(minutes=4), "ph": 5.0}}
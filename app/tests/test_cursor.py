@@ -0,0 +1,13 @@
+import pytest
+from datetime import datetime
+from app.utils.cursor import encode_cursor, decode_cursor
+
+def test_cursor_roundtrip():
+    ts = datetime(2026, 1, 2, 3, 4, 5, 678000)
+    c = decode_cursor(encode_cursor(ts, 42, True, "desc"))
+    assert (c.ts, c.id, c.backward, c.order) == (ts, 42, True, "desc")
+
+@pytest.mark.parametrize("value", ["", "not-base64!", "e30"])  # e30 == "{}"
+def test_cursor_rejects_garbage(value):
+    with pytest.raises(ValueError):
+        decode_cursor(value)
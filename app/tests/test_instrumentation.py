@@ -0,0 +1,22 @@
+import pytest
+from httpx import AsyncClient
+from app.core.instrumentation import REGISTRY, normalize_sql
+from app.main import app
+
+def _count(route: str, status: str) -> float:
+    return REGISTRY.get_sample_value("http_requests_total", {"method": "GET", "route": route, "status": status}) or 0
+
+@pytest.mark.anyio
+async def test_requests_are_labelled_by_route_template():
+    unmatched, scrapes = _count("unmatched", "404"), _count("/metrics", "200")
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        await ac.get("/no/such/path/12345")
+        body = (await ac.get("/metrics")).text
+    assert _count("unmatched", "404") == unmatched + 1
+    assert _count("/metrics", "200") == scrapes + 1
+    assert "12345" not in body
+
+def test_normalize_sql_hides_values_and_collapses_lists():
+    sql = "SELECT a FROM t WHERE x IN (%s, %s, %s) AND y = 'it''s'\n  AND z > 12.5 LIMIT %(param_1)s"
+    assert normalize_sql(sql) == "SELECT a FROM t WHERE x IN (...) AND y = ? AND z > ? LIMIT ?"
+    assert normalize_sql("INSERT INTO t (a, b) VALUES (?, ?), (?, ?)") == "INSERT INTO t (a, b) VALUES (...), ..."
@@ -0,0 +1,23 @@
+import logging, queue
+from app.core.logging import ErrorSampler, NonBlockingQueueHandler
+
+def _record(msg="db down", level=logging.ERROR):
+    return logging.LogRecord("app", level, __file__, 10, msg, None, None)
+
+def test_sampler_passes_a_burst_then_reports_suppressed(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("app.core.logging.time.monotonic", lambda: now[0])
+    sampler = ErrorSampler(window_s=60, burst=2)
+    assert [sampler.filter(_record()) for _ in range(5)] == [True, True, False, False, False]
+    assert sampler.filter(_record("other")) and sampler.filter(_record(level=logging.WARNING))
+    now[0] += 61
+    rec = _record()
+    assert sampler.filter(rec) and rec.suppressed == 3
+
+def test_full_queue_drops_and_counts():
+    handler = NonBlockingQueueHandler(queue.Queue(1))
+    for _ in range(3):
+        handler.handle(_record())
+    handler.queue.get_nowait()
+    handler.handle(_record())
+    assert handler.queue.get_nowait().dropped == 2
@@ -0,0 +1,44 @@
+import os
+import pytest
+from datetime import datetime
+from app.utils.partitions import add_months, month_start, partition_ddl
+
+EXISTING = [
+    ("p_short_202608", "'short','2026-09-01'"),
+    ("p_short_202609", "'short','2026-10-01'"),
+    ("p_short_future", "'short',MAXVALUE"),
+    ("p_standard_202609", "'standard','2026-10-01'"),
+    ("p_standard_future", "'standard',MAXVALUE"),
+    ("p_max", "MAXVALUE,MAXVALUE"),
+]
+
+def test_ddl_adds_months_ahead_and_drops_expired():
+    stmts = partition_ddl(EXISTING, {"short": 1, "standard": 0}, datetime(2026, 10, 18), 1)
+    assert stmts[0].startswith("ALTER TABLE sensor_data REORGANIZE PARTITION p_short_future")
+    assert "p_short_202610" in stmts[0] and "p_short_202611" in stmts[0]
+    assert "p_standard_202611" in stmts[1]
+    assert stmts[-1] == "ALTER TABLE sensor_data DROP PARTITION p_short_202608"
+
+def test_ddl_new_class_is_split_off_the_partition_holding_its_range():
+    stmts = partition_ddl(EXISTING, {"short": 0, "standard": 0, "zeta": 0}, datetime(2026, 9, 2), 0)
+    assert stmts == [
+        "ALTER TABLE sensor_data REORGANIZE PARTITION p_max INTO (\n"
+        "  PARTITION p_zeta_202609 VALUES LESS THAN ('zeta', '2026-10-01'),\n"
+        "  PARTITION p_zeta_future VALUES LESS THAN ('zeta', MAXVALUE),\n"
+        "  PARTITION p_max VALUES LESS THAN (MAXVALUE,MAXVALUE)\n)"
+    ]
+
+@pytest.mark.skipif(not os.getenv("TEST_MYSQL_URL"), reason="needs TEST_MYSQL_URL pointing at a migrated MySQL database")
+def test_data_range_query_prunes_to_its_months():
+    from sqlalchemy import create_engine, select
+    from app.api.routers.data import _range_filters
+    from app.core.config import settings
+    from app.models.models import SensorData
+
+    engine = create_engine(os.environ["TEST_MYSQL_URL"].replace("+aiomysql", "+pymysql"))
+    start = month_start(datetime.utcnow())
+    stmt = select(SensorData.id).where(SensorData.site_id == 1, *_range_filters(None, start, add_months(start, 1)))
+    sql = str(stmt.compile(engine, compile_kwargs={"literal_binds": True}))
+    with engine.connect() as conn:
+        row = conn.exec_driver_sql("EXPLAIN " + sql).mappings().one()
+    assert set(row["partitions"].split(",")) == {f"p_{c}_{start:%Y%m}" for c in settings.retention_classes}
@@ -0,0 +1,37 @@
+import sqlite3
+from app.middlewares.rate_limit import MemoryBackend, SqliteBackend
+
+def _drain(backend, now, n=5):
+    return [backend.hit("k", 60.0 / 60, n, now)[0] for _ in range(n + 1)]
+
+def test_burst_then_reject_then_refill():
+    b = MemoryBackend()
+    assert _drain(b, 1000.0) == [True] * 5 + [False]
+    allowed, remaining, retry_after, _ = b.hit("k", 1.0, 5, 1000.0)
+    assert not allowed and 0 < retry_after <= 1.0
+    # one emission interval later exactly one more request fits
+    assert b.hit("k", 1.0, 5, 1001.0)[0]
+    assert not b.hit("k", 1.0, 5, 1001.0)[0]
+
+def test_memory_backend_is_bounded():
+    b = MemoryBackend(max_keys=3)
+    for i in range(10):
+        b.hit(f"k{i}", 1.0, 5, 1000.0)
+    assert len(b._tat) == 3
+
+def test_sqlite_backend_shares_state(tmp_path):
+    path = str(tmp_path / "rl.db")
+    a, b = SqliteBackend(path), SqliteBackend(path)
+    assert [a.hit("k", 1.0, 2, 1000.0)[0], b.hit("k", 1.0, 2, 1000.0)[0], a.hit("k", 1.0, 2, 1000.0)[0]] == [True, True, False]
+
+def test_sqlite_backend_falls_back_when_locked(tmp_path):
+    path = str(tmp_path / "rl.db")
+    b = SqliteBackend(path, timeout=0.01)
+    holder = sqlite3.connect(path, isolation_level=None)
+    holder.execute("BEGIN IMMEDIATE")
+    try:
+        assert _drain(b, 1000.0, n=2) == [True, True, False]
+        assert len(b.fallback._tat) == 1
+    finally:
+        holder.execute("ROLLBACK")
+    assert b.hit("k", 1.0, 2, 1000.0)[0]
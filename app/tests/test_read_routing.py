@@ -0,0 +1,30 @@
+import time
+from sqlalchemy import create_engine, text
+from starlette.requests import Request
+from app.core import db
+
+def _request(**headers) -> Request:
+    raw = [(k.replace("_", "-").lower().encode(), v.encode()) for k, v in headers.items()]
+    return Request({"type": "http", "headers": raw, "client": ("10.0.0.1", 1234)})
+
+def test_reads_pin_to_primary_after_a_write_or_on_request(monkeypatch):
+    req = _request(authorization="Bearer a")
+    assert not db.reads_pinned(req)
+    assert db.reads_pinned(_request(x_read_primary="1"))
+    monkeypatch.setitem(db._writers, db._caller(req), time.monotonic())
+    assert db.reads_pinned(req)
+    assert not db.reads_pinned(_request(authorization="Bearer b"))
+    monkeypatch.setitem(db._writers, db._caller(req), time.monotonic() - db.settings.db_read_sticky_s - 1)
+    assert not db.reads_pinned(req)
+
+def test_on_commit_runs_after_commit_and_not_after_rollback():
+    calls = []
+    with db.PrimarySession(create_engine("sqlite://")) as s:
+        s.execute(text("SELECT 1"))
+        db.on_commit(s, lambda: calls.append("dropped"))
+        s.rollback()
+        s.execute(text("SELECT 1"))
+        db.on_commit(s, lambda: calls.append("ran"))
+        assert calls == []
+        s.commit()
+    assert calls == ["ran"]
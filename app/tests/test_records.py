@@ -0,0 +1,24 @@
+import pytest
+from app.utils.records import iter_records
+
+async def _chunks(data: bytes, size: int = 7):
+    for i in range(0, len(data), size):
+        yield data[i:i+size]
+
+async def _collect(data: bytes, fmt: str):
+    return [r async for r in iter_records(_chunks(data), fmt)]
+
+@pytest.mark.anyio
+async def test_ndjson_lines_split_across_chunks():
+    out = await _collect(b'{"site_uid":"A","ph":7}\n\nnot json\n{"site_uid":"B"}', "ndjson")
+    assert [(n, r, e is None) for n, r, e in out] == [
+        (1, {"site_uid": "A", "ph": 7}, True),
+        (3, None, False),
+        (4, {"site_uid": "B"}, True),
+    ]
+
+@pytest.mark.anyio
+async def test_csv_header_and_empty_values():
+    out = await _collect(b"site_uid,ph,tss\r\nA,7.1,\r\nB,1\r\n", "csv")
+    assert out[0] == (2, {"site_uid": "A", "ph": "7.1", "tss": None}, None)
+    assert out[1][0] == 3 and out[1][1] is None
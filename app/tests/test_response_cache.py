@@ -0,0 +1,43 @@
+import pytest
+from starlette.requests import Request
+from app.services.response_cache import ResponseCache
+
+def _request(path="/data/last", query=b"site_uid=S1", headers=()):
+    return Request({"type": "http", "method": "GET", "path": path, "query_string": query,
+                    "headers": [(k.lower().encode(), v.encode()) for k, v in headers]})
+
+@pytest.mark.anyio
+async def test_cache_hit_invalidate_and_304():
+    cache = ResponseCache(ttls={"data_last": 60})
+    calls = []
+
+    async def build():
+        calls.append(1)
+        return {"ph": len(calls)}
+
+    first = await cache.serve(_request(), "data_last", ["site:1"], [], build)
+    again = await cache.serve(_request(), "data_last", ["site:1"], [], build)
+    assert len(calls) == 1 and first.body == again.body
+    assert (await cache.serve(_request(), "data_last", ["site:1"], ["S1"], build)).body != first.body  # viewer scope
+    cache.invalidate("site:1")
+    assert (await cache.serve(_request(), "data_last", ["site:1"], [], build)).headers["etag"] != first.headers["etag"]
+    etag = (await cache.serve(_request(), "data_last", ["site:1"], [], build)).headers["etag"]
+    not_modified = await cache.serve(_request(headers=[("If-None-Match", etag)]), "data_last", ["site:1"], [], build)
+    assert not_modified.status_code == 304 and not_modified.body == b""
+
+@pytest.mark.anyio
+async def test_pinned_reads_bypass_and_replica_builds_wait_out_invalidation():
+    cache = ResponseCache(ttls={"sites": 60}, replica=True)
+    calls = []
+
+    async def build():
+        calls.append(1)
+        return {"n": len(calls)}
+
+    await cache.serve(_request("/sites", b""), "sites", ["sites"], [], build)
+    await cache.serve(_request("/sites", b"", [("X-Read-Primary", "1")]), "sites", ["sites"], [], build)
+    assert len(calls) == 2 and len(cache._items) == 1
+    cache.invalidate("sites")
+    await cache.serve(_request("/sites", b""), "sites", ["sites"], [], build)
+    await cache.serve(_request("/sites", b""), "sites", ["sites"], [], build)
+    assert len(calls) == 4  # built from the replica right after the write: not stored
@@ -0,0 +1,21 @@
+from datetime import datetime, timezone
+from app.models.models import SENSOR_FIELDS
+from app.services.rollups import accumulate, plan
+
+UTC = timezone.utc
+
+def test_plan_covers_range_without_gaps():
+    start, end = datetime(2026, 1, 1, 3, 7, tzinfo=UTC), datetime(2026, 1, 4, 20, 13, tzinfo=UTC)
+    parts = plan(start, end)
+    assert parts[0][1] == start and parts[-1][2] == end
+    assert all(a[2] == b[1] for a, b in zip(parts, parts[1:]))
+    assert 86400 in {secs for secs, _, _ in parts}
+
+def test_accumulate_skips_nulls():
+    row = {f: None for f in SENSOR_FIELDS}
+    rows = [dict(row, site_id=1, device_id=None, ts=datetime(2026, 1, 1, 0, 0, s, tzinfo=UTC), ph=v)
+            for s, v in ((1, 7.0), (2, None), (3, 5.0))]
+    acc = accumulate(rows)
+    assert len(acc) == 3  # one bucket per resolution
+    ph = next(iter(acc.values()))[SENSOR_FIELDS.index("ph")]
+    assert ph == [12.0, 2, 5.0, 7.0]
@@ -0,0 +1,32 @@
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+from sqlalchemy import Integer, cast, func, text
+
+BUCKETS = {"1m": 60, "5m": 300, "15m": 900, "1h": 3600, "1d": 86400}
+
+def tz_offset_s(tz: str, at: datetime | None = None) -> int:
+    """UTC offset of ``tz`` in seconds at ``at`` (now by default).
+
+    Buckets use one fixed offset per query; zones with DST shift by an hour across the change.
+    """
+    at = at or datetime.now(timezone.utc)
+    if at.tzinfo is None:
+        at = at.replace(tzinfo=timezone.utc)
+    return int(at.astimezone(ZoneInfo(tz)).utcoffset().total_seconds())
+
+def epoch_expr(col, dialect: str):
+    """Seconds since the epoch of a UTC DATETIME column, independent of the session time zone."""
+    if dialect == "sqlite":
+        return cast(func.strftime("%s", col), Integer)
+    return func.timestampdiff(text("SECOND"), "1970-01-01 00:00:00", col, type_=Integer)
+
+def bucket_expr(col, seconds: int, offset_s: int, dialect: str):
+    """Epoch seconds (UTC) of the start of the bucket ``col`` falls in, aligned to ``offset_s``."""
+    return func.floor((epoch_expr(col, dialect) + offset_s) / seconds) * seconds - offset_s
+
+def floor_ts(ts: datetime, seconds: int, offset_s: int = 0) -> datetime:
+    """Python twin of bucket_expr for a single timestamp."""
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    e = int(ts.timestamp())
+    return datetime.fromtimestamp((e + offset_s) // seconds * seconds - offset_s, tz=timezone.utc)
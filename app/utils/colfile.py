@@ -0,0 +1,103 @@
+import math, os, struct, sys, zlib
+from array import array
+from itertools import accumulate
+import orjson
+
+# Segment files of archived sensor_data (see services/archive.py):
+#   MAGIC | u32 header length | JSON header | zlib blocks
+# Rows are cut into groups of ``group_rows``; each group has one block per column and the
+# min/max of the key column, so readers skip groups outside a window and inflate only the
+# columns they need. Column types:
+#   int   int64, delta-encoded (ids, epoch microseconds); no NULLs
+#   float float64, NaN for NULL
+#   json  JSON list of the values
+MAGIC = b"SPC1"
+
+def _le(a: array) -> array:
+    if sys.byteorder == "big":
+        a.byteswap()
+    return a
+
+def _encode(values: list, type_: str) -> bytes:
+    if type_ == "int":
+        prev, deltas = 0, array("q")
+        for v in values:
+            deltas.append(v - prev)
+            prev = v
+        raw = _le(deltas).tobytes()
+    elif type_ == "float":
+        raw = _le(array("d", [math.nan if v is None else v for v in values])).tobytes()
+    elif type_ == "json":
+        raw = orjson.dumps(values)
+    else:
+        raise ValueError(f"unknown column type {type_!r}")
+    return zlib.compress(raw, 6)
+
+def _decode(blob: bytes, type_: str) -> list:
+    raw = zlib.decompress(blob)
+    if type_ == "json":
+        return orjson.loads(raw)
+    a = array("q" if type_ == "int" else "d")
+    a.frombytes(raw)
+    _le(a)
+    if type_ == "int":
+        return list(accumulate(a))
+    return [None if v != v else v for v in a]
+
+def write(path: str, types: dict[str, str], columns: dict[str, list], key: str, group_rows: int = 8192) -> dict:
+    """Write ``columns`` (equal-length lists, sorted by ``key``) to ``path``; returns the header.
+
+    The file appears atomically: it is written next to ``path`` and renamed into place.
+    """
+    n = len(columns[key])
+    groups, blobs, offset = [], [], 0
+    for lo in range(0, n, group_rows):
+        hi = min(lo + group_rows, n)
+        blocks = {}
+        for name, type_ in types.items():
+            blob = _encode(columns[name][lo:hi], type_)
+            blocks[name] = [offset, len(blob)]
+            blobs.append(blob)
+            offset += len(blob)
+        keys = columns[key][lo:hi]
+        groups.append({"rows": hi - lo, "min": keys[0], "max": keys[-1], "blocks": blocks})
+    header = {"rows": n, "key": key, "types": types, "groups": groups}
+    raw = orjson.dumps(header)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC + struct.pack("<I", len(raw)) + raw)
+        for blob in blobs:
+            f.write(blob)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return header
+
+class SegmentFile:
+    """Reader for files made by ``write``; only the header is loaded up front."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            if f.read(4) != MAGIC:
+                raise ValueError(f"{path}: not a segment file")
+            (size,) = struct.unpack("<I", f.read(4))
+            self.header = orjson.loads(f.read(size))
+        self._data_start = 8 + size
+        self.types: dict[str, str] = self.header["types"]
+        self.rows: int = self.header["rows"]
+
+    def groups(self, lo: int | None = None, hi: int | None = None) -> list[int]:
+        """Indexes of the groups whose key range meets [lo, hi)."""
+        return [i for i, g in enumerate(self.header["groups"])
+                if (lo is None or g["max"] >= lo) and (hi is None or g["min"] < hi)]
+
+    def read(self, group: int, names) -> dict[str, list]:
+        blocks = self.header["groups"][group]["blocks"]
+        out = {}
+        with open(self.path, "rb") as f:
+            for name in names:
+                offset, length = blocks[name]
+                f.seek(self._data_start + offset)
+                out[name] = _decode(f.read(length), self.types[name])
+        return out
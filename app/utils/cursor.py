@@ -0,0 +1,23 @@
+import base64
+from datetime import datetime
+from typing import NamedTuple
+import orjson
+
+class Cursor(NamedTuple):
+    ts: datetime
+    id: int
+    backward: bool  # True for prev_cursor: page towards the start of the ordering
+    order: str
+
+def encode_cursor(ts: datetime, id_: int, backward: bool, order: str) -> str:
+    raw = orjson.dumps({"t": ts.isoformat(), "i": id_, "b": int(backward), "o": order})
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+def decode_cursor(value: str) -> Cursor:
+    """Parse an opaque cursor; raises ValueError when it is malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(value + "=" * (-len(value) % 4))
+        d = orjson.loads(raw)
+        return Cursor(datetime.fromisoformat(d["t"]), int(d["i"]), bool(d["b"]), d["o"])
+    except (ValueError, KeyError, TypeError, orjson.JSONDecodeError) as e:
+        raise ValueError("invalid cursor") from e
@@ -0,0 +1,78 @@
+import re
+from datetime import datetime
+from typing import Iterable
+
+# sensor_data partitions: p_<class>_<yyyymm> per class and month, p_<class>_future catching
+# the months not created yet, and p_max for classes that have no partitions of their own
+_NAME_RE = re.compile(r"^p_(?P<cls>[a-z0-9]+)_(?P<tag>\d{6}|future)$")
+
+def month_start(dt: datetime) -> datetime:
+    return datetime(dt.year, dt.month, 1)
+
+def add_months(dt: datetime, n: int) -> datetime:
+    m = dt.year * 12 + dt.month - 1 + n
+    return datetime(m // 12, m % 12 + 1, 1)
+
+def _month_sql(cls: str, month: datetime) -> str:
+    return f"PARTITION p_{cls}_{month:%Y%m} VALUES LESS THAN ('{cls}', '{add_months(month, 1):%Y-%m-%d}')"
+
+def _future_sql(cls: str) -> str:
+    return f"PARTITION p_{cls}_future VALUES LESS THAN ('{cls}', MAXVALUE)"
+
+def _class_sql(cls: str, first: datetime, last: datetime) -> list[str]:
+    out, m = [], first
+    while m <= last:
+        out.append(_month_sql(cls, m))
+        m = add_months(m, 1)
+    return out + [_future_sql(cls)]
+
+def initial_partitioning_sql(classes: Iterable[str], first_month: datetime, now: datetime, ahead: int) -> str:
+    """PARTITION BY clause for an unpartitioned sensor_data, months first_month..now+ahead."""
+    last = add_months(month_start(now), ahead)
+    first = min(month_start(first_month), month_start(now))
+    parts = []
+    for cls in sorted(classes):
+        parts += _class_sql(cls, first, last)
+    parts.append("PARTITION p_max VALUES LESS THAN (MAXVALUE, MAXVALUE)")
+    return "ALTER TABLE sensor_data PARTITION BY RANGE COLUMNS(retention_class, ts) (\n  " + ",\n  ".join(parts) + "\n)"
+
+def partition_ddl(existing: list[tuple[str, str]], classes: dict[str, int], now: datetime, ahead: int) -> list[str]:
+    """ALTER TABLE statements that bring sensor_data's partitions in line with ``classes``.
+
+    ``existing`` is (PARTITION_NAME, PARTITION_DESCRIPTION) in ordinal order. Months up to
+    ``now`` + ``ahead`` are split off the empty ``future`` partition of each class; a class
+    with no partitions is split off the partition currently holding its range. Months that
+    ended more than the class's retention ago are dropped whole (retention 0 keeps all).
+    """
+    months: dict[str, list[datetime]] = {}
+    for name, _ in existing:
+        m = _NAME_RE.match(name)
+        if m:
+            months.setdefault(m["cls"], [])
+            if m["tag"] != "future":
+                months[m["cls"]].append(datetime.strptime(m["tag"], "%Y%m"))
+    current = month_start(now)
+    last = add_months(current, ahead)
+    stmts, drop = [], []
+    for cls in sorted(classes):
+        if cls in months:
+            have = max(months[cls], default=add_months(current, -1))
+            if have < last:
+                new = _class_sql(cls, max(add_months(have, 1), current), last)
+                stmts.append(f"ALTER TABLE sensor_data REORGANIZE PARTITION p_{cls}_future INTO (\n  " + ",\n  ".join(new) + "\n)")
+        else:
+            # the first partition whose class bound sorts after cls (or p_max) holds cls rows today
+            name, desc = next((n, d) for n, d in existing if _bound_class(d) is None or _bound_class(d) > cls)
+            new = _class_sql(cls, current, last) + [f"PARTITION {name} VALUES LESS THAN ({desc})"]
+            stmts.append(f"ALTER TABLE sensor_data REORGANIZE PARTITION {name} INTO (\n  " + ",\n  ".join(new) + "\n)")
+        keep = classes[cls]
+        if keep > 0:
+            cutoff = add_months(current, -keep)
+            drop += [f"p_{cls}_{m:%Y%m}" for m in sorted(months.get(cls, [])) if m < cutoff]
+    if drop:
+        stmts.append("ALTER TABLE sensor_data DROP PARTITION " + ", ".join(drop))
+    return stmts
+
+def _bound_class(desc: str) -> str | None:
+    first = desc.split(",", 1)[0].strip()
+    return None if first.upper() == "MAXVALUE" else first.strip("'")
@@ -0,0 +1,71 @@
+import csv
+import orjson
+from typing import AsyncIterator
+
+MAX_LINE_BYTES = 64 * 1024
+
+async def iter_lines(chunks: AsyncIterator[bytes], max_line: int = MAX_LINE_BYTES) -> AsyncIterator[tuple[int, bytes | None]]:
+    """Split a byte stream into (line_no, line) pairs without buffering the whole body.
+
+    Lines longer than ``max_line`` are not kept and come out as ``(line_no, None)``.
+    """
+    buf = b""
+    lineno = 0
+    overlong = False
+    async for chunk in chunks:
+        parts = (buf + chunk).split(b"\n")
+        buf = parts.pop()
+        for line in parts:
+            lineno += 1
+            if overlong or len(line) > max_line:
+                overlong = False
+                yield lineno, None
+            else:
+                yield lineno, line.rstrip(b"\r")
+        if len(buf) > max_line:
+            # drop the head of an overlong line, report it when its newline shows up
+            overlong = True
+            buf = b""
+    if buf or overlong:
+        lineno += 1
+        yield lineno, None if overlong else buf.rstrip(b"\r")
+
+async def iter_records(chunks: AsyncIterator[bytes], fmt: str) -> AsyncIterator[tuple[int, dict | None, str | None]]:
+    """Yield (line_no, record, error) for an NDJSON or CSV (header row first) body."""
+    header = None
+    async for lineno, line in iter_lines(chunks):
+        if line is None:
+            yield lineno, None, "line too long"
+            continue
+        if not line.strip():
+            continue
+        if fmt == "csv":
+            try:
+                values = next(csv.reader([line.decode("utf-8")]))
+            except (UnicodeDecodeError, csv.Error) as e:
+                yield lineno, None, f"bad csv: {e}"
+                continue
+            if header is None:
+                header = [h.strip() for h in values]
+                continue
+            if len(values) != len(header):
+                yield lineno, None, f"expected {len(header)} columns, got {len(values)}"
+                continue
+            rec = {k: (v if v != "" else None) for k, v in zip(header, values)}
+            if rec.get("payload"):
+                try:
+                    rec["payload"] = orjson.loads(rec["payload"])
+                except orjson.JSONDecodeError:
+                    yield lineno, None, "payload is not valid JSON"
+                    continue
+            yield lineno, rec, None
+        else:
+            try:
+                rec = orjson.loads(line)
+            except orjson.JSONDecodeError as e:
+                yield lineno, None, f"bad json: {e}"
+                continue
+            if not isinstance(rec, dict):
+                yield lineno, None, "expected a JSON object"
+                continue
+            yield lineno, rec, None
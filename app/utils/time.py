@@ -1,7 +1,12 @@
 from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
 def to_utc(dt: datetime | None):
     if dt is None:
         return datetime.now(timezone.utc)
     if dt.tzinfo is None:
         return dt.replace(tzinfo=timezone.utc)
     return dt.astimezone(timezone.utc)
+
+def local_day_start(now: datetime, tz: str) -> datetime:
+    """Midnight of ``now``'s day in ``tz``, as an aware UTC datetime."""
+    return to_utc(now).astimezone(ZoneInfo(tz)).replace(hour=0, minute=0, second=0, microsecond=0).astimezone(timezone.utc)
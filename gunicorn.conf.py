@@ -0,0 +1,14 @@
+# gunicorn loads this from the working directory; it keeps /metrics right across workers
+import os, shutil
+from prometheus_client import multiprocess
+
+def on_starting(server):
+    # samples of a previous master would be summed into this one's
+    path = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if path:
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path, exist_ok=True)
+
+def child_exit(server, worker):
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(worker.pid)
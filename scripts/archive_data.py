@@ -0,0 +1,18 @@
+"""Move closed months of sensor_data to the archive now.
+
+The API workers run the same job every ARCHIVE_INTERVAL_S when ARCHIVE_DIR is set; use this
+from cron when that is disabled, or to drain a backlog:
+
+    python scripts/archive_data.py
+"""
+import asyncio, os, sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.core.config import settings
+from app.services.archive import run
+
+if __name__ == "__main__":
+    if not settings.archive_dir:
+        sys.exit("ARCHIVE_DIR is not set")
+    print(asyncio.run(run()))
@@ -0,0 +1,86 @@
+"""Latency of a trivial endpoint behind the request-id + rate-limit middlewares.
+
+Compares the previous BaseHTTPMiddleware versions (reproduced below) with the pure
+ASGI ones in app/middlewares. Runs in-process over httpx's ASGI transport, so the
+numbers are middleware + framework overhead only.
+
+    python scripts/bench_middleware.py [requests]
+"""
+import asyncio, os, statistics, sys, time, uuid
+from collections import defaultdict
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import httpx
+from fastapi import FastAPI
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import JSONResponse
+
+from app.middlewares.request_id import RequestIDMiddleware
+from app.middlewares.rate_limit import RateLimitMiddleware, RateRule
+
+class OldRequestIDMiddleware(BaseHTTPMiddleware):
+    async def dispatch(self, request, call_next):
+        request_id = str(uuid.uuid4())
+        response = await call_next(request)
+        response.headers["X-Request-ID"] = request_id
+        return response
+
+class OldRateLimitMiddleware(BaseHTTPMiddleware):
+    def __init__(self, app, routes_prefix, rate_per_min=60):
+        super().__init__(app)
+        self.routes_prefix = routes_prefix
+        self.rate_per_min = rate_per_min
+        self.bucket = defaultdict(list)
+
+    async def dispatch(self, request, call_next):
+        path = request.url.path
+        if any(path.startswith(p) for p in self.routes_prefix):
+            key = request.client.host or "unknown"
+            now = time.time()
+            window = now - 60
+            self.bucket[key] = [t for t in self.bucket[key] if t >= window]
+            if len(self.bucket[key]) >= self.rate_per_min:
+                return JSONResponse({"detail": "Rate limit exceeded"}, status_code=429)
+            self.bucket[key].append(now)
+        return await call_next(request)
+
+def build(old: bool) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/ingest/ping")
+    async def ping():
+        return {"ok": True}
+
+    limit = 10**9  # never reject, measure overhead only
+    if old:
+        app.add_middleware(OldRequestIDMiddleware)
+        app.add_middleware(OldRateLimitMiddleware, routes_prefix=["/ingest"], rate_per_min=limit)
+    else:
+        app.add_middleware(RequestIDMiddleware)
+        app.add_middleware(RateLimitMiddleware, rules=[RateRule(prefix="/ingest", rate_per_min=limit)])
+    return app
+
+async def run(app: FastAPI, n: int) -> list[float]:
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as c:
+        for _ in range(200):  # warm-up
+            await c.get("/ingest/ping")
+        out = []
+        for _ in range(n):
+            t = time.perf_counter()
+            await c.get("/ingest/ping")
+            out.append((time.perf_counter() - t) * 1e6)
+        return out
+
+def summary(name: str, xs: list[float]) -> str:
+    xs = sorted(xs)
+    p = lambda q: xs[min(len(xs) - 1, int(q * len(xs)))]
+    return f"{name:<22} mean {statistics.mean(xs):8.1f}us  p50 {p(.5):8.1f}us  p99 {p(.99):8.1f}us"
+
+async def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    print(summary("BaseHTTPMiddleware", await run(build(old=True), n)))
+    print(summary("pure ASGI", await run(build(old=False), n)))
+
+if __name__ == "__main__":
+    asyncio.run(main())
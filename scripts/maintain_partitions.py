@@ -0,0 +1,16 @@
+"""Create upcoming sensor_data partitions and drop expired ones now.
+
+The API workers run the same job every PARTITION_MAINTENANCE_S; use this from cron when
+that is disabled, or after changing RETENTION_CLASSES:
+
+    python scripts/maintain_partitions.py
+"""
+import asyncio, os, sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.services.partitions import maintain
+
+if __name__ == "__main__":
+    stmts = asyncio.run(maintain())
+    print("\n".join(stmts) or "nothing to do")
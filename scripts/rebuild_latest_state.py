@@ -0,0 +1,29 @@
+"""Recompute latest_state from sensor_data.
+
+Run after deleting readings, direct SQL changes, or the first migration to 0005:
+
+    python scripts/rebuild_latest_state.py [--site SITE_UID]
+"""
+import argparse, asyncio, os, sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from sqlalchemy import select
+from app.core.db import SessionLocal
+from app.models.models import Site
+from app.services import latest_state
+
+async def main(site_uid: str | None):
+    site_id = None
+    if site_uid:
+        async with SessionLocal() as db:
+            site_id = (await db.execute(select(Site.id).where(Site.uid == site_uid))).scalar_one_or_none()
+        if site_id is None:
+            raise SystemExit(f"unknown site {site_uid}")
+    n = await latest_state.rebuild(site_id)
+    print(f"latest_state rebuilt: {n} rows")
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--site", dest="site_uid")
+    asyncio.run(main(ap.parse_args().site_uid))
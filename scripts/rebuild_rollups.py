@@ -0,0 +1,34 @@
+"""Recompute sensor_rollup_* from sensor_data for a date range.
+
+Run after backfills, manual edits of sensor_data, or the first migration to 0004:
+
+    python scripts/rebuild_rollups.py --from 2024-01-01 --to 2024-02-01 [--site SITE_UID]
+"""
+import argparse, asyncio, os, sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from sqlalchemy import select
+from app.core.db import SessionLocal
+from app.models.models import Site
+from app.services import rollups
+from app.utils.time import to_utc
+
+async def main(date_from: datetime, date_to: datetime, site_uid: str | None):
+    site_id = None
+    if site_uid:
+        async with SessionLocal() as db:
+            site_id = (await db.execute(select(Site.id).where(Site.uid == site_uid))).scalar_one_or_none()
+        if site_id is None:
+            raise SystemExit(f"unknown site {site_uid}")
+    n = await rollups.rebuild(to_utc(date_from), to_utc(date_to), site_id)
+    print(f"rebuilt rollups from {n} rows")
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--from", dest="date_from", required=True, type=datetime.fromisoformat)
+    ap.add_argument("--to", dest="date_to", required=True, type=datetime.fromisoformat)
+    ap.add_argument("--site", dest="site_uid")
+    a = ap.parse_args()
+    asyncio.run(main(a.date_from, a.date_to, a.site_uid))